@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Benchmark de ponta a ponta do library_organizer.py, sem acessar a internet.
+
+Gera uma biblioteca sintética (milhares de MKV/MP4 minúsculos criados com o `lavfi` do ffmpeg,
+com nomes de release realistas e séries organizadas em pastas de temporada) e sobe um servidor
+HTTP local que imita o TMDb (busca, detalhes, temporadas e imagens) e um provedor de legendas,
+com latência e limite de requisições configuráveis. O organizador é executado em um processo
+separado, apontado para o servidor local, nos cenários:
+
+- "frio": caches vazios, todos os arquivos são buscados, etiquetados e recebem legenda;
+- "nova_varredura": a mesma biblioteca de novo, sem mudanças (todos os arquivos são pulados);
+- "cache_quente": todos os arquivos processados de novo (--force), com os caches já preenchidos.
+
+Para cada cenário são medidos os arquivos por segundo e o tempo de cada etapa (Fase 1: busca;
+Fase 2: aplicação e legendas), a partir do relatório de métricas do organizador. O resultado
+vai para um JSON que pode ser comparado a uma linha de base para acusar regressões.
+
+Requer ffmpeg e ffprobe no PATH (e mkvpropedit, para os arquivos MKV).
+
+Uso:
+    python benchmarks/bench_end_to_end.py [--movies N] [--shows N] [--seasons N] [--episodes N]
+        [--latency-ms MS] [--rate-limit RPS] [--output ARQUIVO] [--baseline ARQUIVO]
+        [--update-baseline] [--max-regression PORCENTAGEM] [-- ARGUMENTOS DO ORGANIZADOR]
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import random
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from babelfish import Language
+from subliminal import Provider, Subtitle, Movie, Episode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_release_parser import TITLE_WORDS, RESOLUTIONS, SOURCES, EXTRAS, GROUPS
+
+STUB_PROVIDER = 'benchstub'
+STUB_SUBTITLE_URL_ENV = 'FOLDERMOVIE_BENCH_SUBTITLE_URL'
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline_end_to_end.json')
+SCENARIOS = (
+    ('frio', []),
+    ('nova_varredura', []),
+    ('cache_quente', ['--force']),
+)
+# Etapas do relatório de métricas que compõem cada fase
+PHASE_STAGES = {
+    'fase1': ('pipeline_busca',),
+    'fase2': ('pipeline_aplicacao', 'subtitle_download'),
+}
+SUBTITLE_LANGUAGE = Language('por', 'BR')
+SUBTITLE_SRT = '1\n00:00:01,000 --> 00:00:02,000\nLegenda de teste\n\n'
+
+
+# --- BIBLIOTECA SINTÉTICA ---
+def make_templates(directory):
+    """
+    Cria, com o lavfi do ffmpeg, um vídeo mínimo de cada formato (1 s, áudio em inglês)
+    que é copiado para cada arquivo da biblioteca.
+    """
+    templates = {}
+    for extension in ('mkv', 'mp4'):
+        path = os.path.join(directory, f'template.{extension}')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'testsrc=duration=1:size=64x48:rate=5',
+            '-f', 'lavfi', '-i', 'sine=duration=1',
+            '-c:v', 'mpeg4', '-c:a', 'aac', '-metadata:s:a:0', 'language=eng', '-shortest',
+            path
+        ], check=True)
+        templates[extension] = path
+    return templates
+
+
+def make_title(rng, index):
+    return '.'.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 3))) + f".{index}"
+
+
+def make_library(root, templates, movies, shows, seasons, episodes, seed=42):
+    """
+    Gera a biblioteca: filmes soltos na raiz e séries em 'Série/Season NN/'.
+    Retorna o número de arquivos criados.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for index in range(movies):
+        name = (f"{make_title(rng, index)}.{rng.randint(1950, 2025)}.{rng.choice(RESOLUTIONS)}."
+                f"{rng.choice(SOURCES)}.{rng.choice(EXTRAS)}-{rng.choice(GROUPS)}")
+        paths.append(os.path.join(root, name))
+    for index in range(shows):
+        show = make_title(rng, index)
+        resolution, source, group = rng.choice(RESOLUTIONS), rng.choice(SOURCES), rng.choice(GROUPS)
+        for season in range(1, seasons + 1):
+            season_dir = os.path.join(root, show.replace('.', ' '), f"Season {season:02d}")
+            for episode in range(1, episodes + 1):
+                paths.append(os.path.join(season_dir, f"{show}.S{season:02d}E{episode:02d}.{resolution}.{source}-{group}"))
+    for path in paths:
+        extension = rng.choice(('mkv', 'mp4'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(templates[extension], f"{path}.{extension}")
+    return len(paths)
+
+
+# --- SERVIDOR LOCAL (TMDB E LEGENDAS) ---
+def stable_id(*parts):
+    return zlib.crc32('|'.join(str(part) for part in parts).encode('utf-8')) % 1000000 + 1
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Servidor HTTP local que imita as rotas do TMDb usadas pelo organizador e um provedor de
+    legendas. Cada requisição espera `latency` segundos; acima de `rate_limit` requisições por
+    segundo a um mesmo serviço (API do TMDb ou legendas; as imagens vêm de uma CDN, sem limite),
+    responde 429 com Retry-After, como o TMDb. Uma fração `miss_rate` dos títulos não
+    é encontrada (exercitando as novas tentativas em en-US e sem o ano).
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency=0.03, rate_limit=40.0, miss_rate=0.05, poster_kb=32):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.miss_rate = miss_rate
+        self.poster = b'\xff\xd8\xff\xe0' + bytes(poster_kb * 1024)
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._buckets = {}  # serviço -> (fichas, momento da última atualização)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def take_token(self, service):
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(service, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+            allowed = tokens >= 1
+            self._buckets[service] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+        return counts
+
+    def is_missing(self, title):
+        return stable_id('miss', title) % 1000 < self.miss_rate * 1000
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload):
+        self.send_body(200, json.dumps(payload).encode('utf-8'))
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        time.sleep(server.latency)
+        service = parts[0] if parts else ''
+        if service in ('3', 'subtitles') and not server.take_token(service):
+            server.count('429')
+            self.send_body(429, b'{"status_code": 25}', headers=[('Retry-After', '1')])
+            return
+        if parts[:1] == ['img']:
+            server.count('imagem')
+            self.send_body(200, server.poster, 'image/jpeg')
+        elif parts[:1] == ['subtitles']:
+            self.subtitles(parts[1:], query)
+        elif parts[:1] == ['3']:
+            self.tmdb(parts[1:], query)
+        else:
+            self.send_body(404, b'{}')
+
+    def tmdb(self, parts, query):
+        server = self.server
+        if parts[:1] == ['search'] and len(parts) == 2:
+            server.count('busca')
+            media_type, title = parts[1], query.get('query', '')
+            year = query.get('year') or query.get('first_air_date_year')
+            if server.is_missing(title) or (query.get('language') == 'pt-BR' and stable_id('en', title) % 10 == 0):
+                self.send_json({'page': 1, 'results': [], 'total_results': 0})
+                return
+            item_id = stable_id(media_type, title)
+            date = f"{year or 2000}-01-01"
+            result = {'id': item_id, 'poster_path': f'/{item_id}.jpg', 'popularity': 10.0}
+            if media_type == 'tv':
+                result.update(name=title.title(), first_air_date=date)
+            else:
+                result.update(title=title.title(), release_date=date)
+            self.send_json({'page': 1, 'results': [result], 'total_results': 1})
+        elif len(parts) == 4 and parts[0] == 'tv' and parts[2] == 'season':
+            server.count('temporada')
+            season = int(parts[3])
+            self.send_json({'season_number': season, 'episodes': [
+                {'episode_number': episode, 'name': f"Episódio {episode}", 'air_date': f"2010-{season % 12 + 1:02d}-01"}
+                for episode in range(1, 31)
+            ]})
+        elif len(parts) == 2 and parts[0] in ('movie', 'tv'):
+            server.count('detalhes')
+            item_id = int(parts[1])
+            details = {'id': item_id, 'poster_path': f'/{item_id}.jpg', 'genres': [{'id': 18, 'name': 'Drama'}]}
+            if parts[0] == 'tv':
+                details.update(name=f"Série {item_id}", first_air_date='2010-01-01')
+            else:
+                details.update(title=f"Filme {item_id}", release_date='2000-01-01')
+            self.send_json(details)
+        else:
+            self.send_body(404, b'{}')
+
+    def subtitles(self, parts, query):
+        server = self.server
+        if parts == ['search']:
+            server.count('busca_legenda')
+            title = query.get('query', '')
+            found = stable_id('sub', title, query.get('episode')) % 5 != 0  # ~80% têm legenda
+            subtitle_id = stable_id('sub', title, query.get('episode'))
+            self.send_json({'subtitles': [{'id': subtitle_id, 'url': f"{server.url}/subtitles/{subtitle_id}.srt"}] if found else []})
+        elif len(parts) == 1 and parts[0].endswith('.srt'):
+            server.count('download_legenda')
+            self.send_body(200, SUBTITLE_SRT.encode('utf-8'), 'text/plain; charset=utf-8')
+        else:
+            self.send_body(404, b'{}')
+
+
+# --- PROVEDOR DE LEGENDAS DO SERVIDOR LOCAL (registrado no subliminal do processo filho) ---
+class BenchSubtitle(Subtitle):
+    provider_name = STUB_PROVIDER
+
+    def __init__(self, language, subtitle_id, download_url):
+        super().__init__(language, str(subtitle_id))
+        self.download_url = download_url
+
+    @property
+    def id(self):
+        return self.subtitle_id
+
+    def get_matches(self, video):
+        return {'title', 'year', 'hash'}
+
+
+class BenchSubtitleProvider(Provider):
+    languages = {SUBTITLE_LANGUAGE}
+    video_types = (Episode, Movie)
+    subtitle_class = BenchSubtitle
+
+    def __init__(self):
+        self.base_url = os.environ[STUB_SUBTITLE_URL_ENV]
+        self.session = None
+
+    def initialize(self):
+        self.session = requests.Session()
+
+    def terminate(self):
+        self.session.close()
+
+    def list_subtitles(self, video, languages):
+        params = {'query': video.title, 'year': video.year, 'hash': video.hashes.get('opensubtitles')}
+        if isinstance(video, Episode):
+            params['episode'] = f"{video.season}x{video.episode}"
+        response = self.session.get(f"{self.base_url}/subtitles/search", params=params, timeout=30)
+        response.raise_for_status()
+        if SUBTITLE_LANGUAGE not in languages:
+            return []
+        return [BenchSubtitle(SUBTITLE_LANGUAGE, item['id'], item['url']) for item in response.json()['subtitles']]
+
+    def download_subtitle(self, subtitle):
+        response = self.session.get(subtitle.download_url, timeout=30)
+        response.raise_for_status()
+        subtitle.content = response.content
+
+
+def run_child(organizer_args):
+    """
+    Processo filho: registra o provedor de legendas local e executa o organizador.
+    """
+    from subliminal.extensions import provider_manager
+    sys.path.insert(0, REPO_DIR)
+    provider_manager.register(f"{STUB_PROVIDER} = bench_end_to_end:BenchSubtitleProvider")
+    import library_organizer
+    sys.argv = ['library_organizer.py'] + organizer_args
+    library_organizer.main()
+
+
+# --- EXECUÇÃO DOS CENÁRIOS ---
+def run_scenario(name, extra_args, server, workdir, library, cache_dir, file_count, organizer_args, client_rate):
+    """
+    Executa o organizador uma vez e resume o relatório de métricas do cenário.
+    """
+    metrics_file = os.path.join(workdir, f"metrics-{name}.json")
+    env = dict(os.environ,
+               FOLDERMOVIE_TMDB_URL=f"{server.url}/3",
+               FOLDERMOVIE_TMDB_IMAGE_URL=f"{server.url}/img",
+               **{STUB_SUBTITLE_URL_ENV: server.url})
+    cmd = [
+        sys.executable, os.path.abspath(__file__), '--child', '--',
+        library, '--yes', '--cache-dir', cache_dir, '--metrics-file', metrics_file,
+        '--subtitle-providers', STUB_PROVIDER,
+        '--tmdb-rate', str(client_rate), '--subtitle-rate', str(client_rate),
+    ] + extra_args + organizer_args
+    server.reset_counts()
+    log_path = os.path.join(workdir, f"organizer-{name}.log")
+    start = time.perf_counter()
+    with open(log_path, 'w') as log_file:
+        returncode = subprocess.run(cmd, cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT).returncode
+    wall = time.perf_counter() - start
+    if returncode:
+        raise RuntimeError(f"o organizador terminou com código {returncode} no cenário '{name}' (veja {log_path})")
+
+    with open(metrics_file) as f:
+        report = json.load(f)
+    stages = report['stages']
+    return {
+        'files': file_count,
+        'wall_seconds': round(wall, 3),
+        'files_per_second': round(file_count / wall, 2),
+        'phases': {
+            phase: round(sum(stages.get(stage, {}).get('total_seconds', 0) for stage in phase_stages), 3)
+            for phase, phase_stages in PHASE_STAGES.items()
+        },
+        'stages': stages,
+        'caches': report['caches'],
+        'bytes_written': report['bytes_written'],
+        'stub_requests': server.reset_counts(),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compara os arquivos por segundo de cada cenário com a linha de base.
+    Retorna a lista de cenários com regressão acima do limite.
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        change = (result['files_per_second'] / previous['files_per_second'] - 1) * 100
+        print(f"  {name:<16} {previous['files_per_second']:>10.1f} -> {result['files_per_second']:>10.1f} arquivos/s ({change:+.1f}%)")
+        if change < -max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        run_child(sys.argv[3:] if sys.argv[2:3] == ['--'] else sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do organizador, com TMDb e legendas locais.")
+    parser.add_argument('--movies', type=int, default=600, help="Filmes na biblioteca sintética (padrão: 600).")
+    parser.add_argument('--shows', type=int, default=20, help="Séries na biblioteca sintética (padrão: 20).")
+    parser.add_argument('--seasons', type=int, default=2, help="Temporadas por série (padrão: 2).")
+    parser.add_argument('--episodes', type=int, default=10, help="Episódios por temporada (padrão: 10).")
+    parser.add_argument('--latency-ms', type=float, default=30, help="Latência de cada resposta do servidor local (padrão: 30).")
+    parser.add_argument('--rate-limit', type=float, default=40,
+                        help="Requisições por segundo aceitas pelo servidor local antes de responder 429 (0 = sem limite; padrão: 40).")
+    parser.add_argument('--client-rate', type=float, default=None,
+                        help="Limite de requisições/s do organizador ao TMDb e às legendas (padrão: o mesmo do servidor).")
+    parser.add_argument('--miss-rate', type=float, default=0.05, help="Fração dos títulos sem resultado no TMDb (padrão: 0.05).")
+    parser.add_argument('--poster-kb', type=int, default=32, help="Tamanho das capas servidas, em KiB (padrão: 32).")
+    parser.add_argument('--workdir', type=str, help="Diretório de trabalho (padrão: um diretório temporário, removido ao final).")
+    parser.add_argument('--output', type=str, help="Grava o resultado em JSON neste arquivo.")
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help="Linha de base para comparação (padrão: benchmarks/baseline_end_to_end.json).")
+    parser.add_argument('--update-baseline', action='store_true', help="Grava o resultado como a nova linha de base.")
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help="Queda máxima aceita, em %% de arquivos/s, em relação à linha de base (padrão: 20).")
+    parser.add_argument('organizer_args', nargs=argparse.REMAINDER,
+                        help="Argumentos extras para o organizador, após '--' (ex: -- --workers 16).")
+    args = parser.parse_args()
+    organizer_args = args.organizer_args[1:] if args.organizer_args[:1] == ['--'] else args.organizer_args
+    client_rate = args.client_rate or args.rate_limit or 1000
+
+    for tool in ('ffmpeg', 'ffprobe'):
+        if shutil.which(tool) is None:
+            parser.error(f"{tool} não encontrado no PATH.")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='foldermovie-bench-')
+    library = os.path.join(workdir, 'biblioteca')
+    cache_dir = os.path.join(workdir, 'cache')
+    shutil.rmtree(library, ignore_errors=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(library)
+
+    server = StubServer(latency=args.latency_ms / 1000, rate_limit=args.rate_limit, miss_rate=args.miss_rate,
+                        poster_kb=args.poster_kb)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        print("Gerando a biblioteca sintética...")
+        start = time.perf_counter()
+        file_count = make_library(library, make_templates(workdir), args.movies, args.shows, args.seasons, args.episodes)
+        print(f"{file_count} arquivos gerados em {time.perf_counter() - start:.1f}s.")
+
+        results = {
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'revision': git_revision(),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'config': {
+                'movies': args.movies, 'shows': args.shows, 'seasons': args.seasons, 'episodes': args.episodes,
+                'latency_ms': args.latency_ms, 'rate_limit': args.rate_limit, 'client_rate': client_rate,
+                'miss_rate': args.miss_rate, 'poster_kb': args.poster_kb, 'organizer_args': organizer_args,
+            },
+            'scenarios': {},
+        }
+        for name, extra_args in SCENARIOS:
+            print(f"Cenário '{name}'...")
+            result = run_scenario(name, extra_args, server, workdir, library, cache_dir, file_count,
+                                  organizer_args, client_rate)
+            results['scenarios'][name] = result
+            print(f"  {result['files_per_second']:.1f} arquivos/s ({result['wall_seconds']:.1f}s); "
+                  f"fase 1: {result['phases']['fase1']:.1f}s, fase 2: {result['phases']['fase2']:.1f}s "
+                  f"(tempo somado das threads); requisições: {result['stub_requests']}")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != results['config']:
+            print("Aviso: a linha de base foi gerada com outra configuração.")
+        print("Comparação com a linha de base:")
+        regressions = compare(results, baseline, args.max_regression)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"Linha de base atualizada: {args.baseline}")
+    if regressions:
+        print(f"REGRESSÃO acima de {args.max_regression:.0f}% em: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark do parser de nomes de release (parse_release_name / parse_many).
+
+Gera uma lista sintética de nomes de arquivo no estilo de uma biblioteca real (filmes e episódios,
+com ano, resolução, fonte, codec e grupo) e mede a vazão em nomes por segundo, em um único núcleo:
+
+- "frio": cada nome analisado pela primeira vez (memória LRU vazia): é a vazão do parser,
+  e é sobre ela que vale --min-rate;
+- "memorizado": nova varredura da mesma biblioteca, com os nomes já na memória LRU (mede
+  apenas a consulta à memória, exibida como referência).
+
+Uso:
+    python benchmarks/bench_release_parser.py [--names N] [--repeat R] [--min-rate NOMES_POR_SEGUNDO]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_organizer import parse_release_name, parse_many, RELEASE_PARSE_CACHE_SIZE
+
+TITLE_WORDS = ['The', 'Last', 'Night', 'A', 'Mulher', 'no', 'Jardim', 'Blade', 'Runner', '2049', 'Star',
+               'Dark', 'House', 'of', 'Dragon', 'Marvels', 'Odyssey', 'Space', 'Lost', 'City', 'Ironheart']
+RESOLUTIONS = ['480p', '720p', '1080p', '2160p']
+SOURCES = ['BluRay', 'WEB-DL', 'WEBRip', 'HDTV', 'DVDRip']
+EXTRAS = ['x264', 'x265', 'H264', 'HEVC', 'DUAL.5.1', 'EAC3.AAC', 'DDP5.1', '10bit']
+GROUPS = ['FLX', 'GRP', 'RARBG', 'NTb', 'SPARKS']
+
+
+def make_names(count, seed=42):
+    """
+    Gera `count` nomes de arquivo distintos (cerca de um terço de episódios de séries).
+    """
+    rng = random.Random(seed)
+    names = []
+    for index in range(count):
+        title = '.'.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4))) + f".{index}"
+        if index % 3 == 0:
+            marker = f"S{rng.randint(1, 12):02d}E{rng.randint(1, 24):02d}"
+        else:
+            marker = str(rng.randint(1950, 2025))
+        names.append(f"{title}.{marker}.{rng.choice(RESOLUTIONS)}.{rng.choice(SOURCES)}."
+                     f"{rng.choice(EXTRAS)}-{rng.choice(GROUPS)}.{rng.choice(('mkv', 'mp4'))}")
+    return names
+
+
+def measure(names, repeat):
+    """
+    Retorna a melhor vazão (nomes/s) entre `repeat` execuções de parse_many sobre `names`.
+    """
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_many(names)
+        best = max(best, len(names) / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do parser de nomes de release.")
+    parser.add_argument('--names', type=int, default=50000,
+                        help=f"Quantidade de nomes distintos (padrão: 50000; até {RELEASE_PARSE_CACHE_SIZE} cabem na memória LRU).")
+    parser.add_argument('--repeat', type=int, default=5, help="Execuções de cada medida; vale a melhor (padrão: 5).")
+    parser.add_argument('--min-rate', type=float, default=500000,
+                        help="Vazão mínima esperada da análise a frio, em nomes/s (padrão: 500000).")
+    args = parser.parse_args()
+
+    names = make_names(args.names)
+
+    cold = 0.0
+    for _ in range(args.repeat):
+        parse_release_name.cache_clear()
+        cold = max(cold, measure(names, 1))
+    warm = measure(names, args.repeat)
+
+    print(f"Nomes distintos:            {len(names)}")
+    print(f"Parser (análise a frio):    {cold:,.0f} nomes/s ({1e6 / cold:.2f} µs por nome)")
+    print(f"Consulta à memória LRU:     {warm:,.0f} nomes/s ({1e6 / warm:.2f} µs por nome, nova varredura)")
+    if cold < args.min_rate:
+        print(f"PARSER ABAIXO DO MÍNIMO: {cold:,.0f} < {args.min_rate:,.0f} nomes/s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,66 @@
-from tmdbv3api import TMDb, Movie, TV
 import os
 import re
-import requests
+import json
+import gzip
+import array
+import sqlite3
+import threading
+import queue
+import collections
+import time
 import shutil
+import struct
+import hashlib
+import unicodedata
+import functools
+import itertools
+import contextlib
+import mmap
 import subprocess
+import select
 import tempfile
 import traceback
-from subliminal import Video, download_best_subtitles, save_subtitles, ProviderPool
+from dataclasses import dataclass, field, asdict
 
 import socket
 import argparse
 import logging
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.theme import Theme
+
+# Módulos pesados (requests, tmdbv3api, subliminal, rich...) são importados apenas pelas etapas
+# que os usam: --help, --dry-run e execuções sem arquivos novos iniciam sem carregá-los.
 
 # --- CONFIGURAÇÃO DE LOGGING E RICH ---
-# Configurar o logger
+# Configurar o logger (o arquivo de log só é criado quando a primeira mensagem é gravada)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("movie_organizer.log"),
+        logging.FileHandler("movie_organizer.log", delay=True),
         logging.StreamHandler()
     ]
 )
 log = logging.getLogger(__name__)
 
+
+class LazyConsole:
+    """
+    Console do Rich criado apenas na primeira mensagem exibida.
+    """
+
+    def __init__(self, styles):
+        self.styles = styles
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+            from rich.theme import Theme
+            self._console = Console(theme=Theme(self.styles))
+        return getattr(self._console, name)
+
+
 # Configurar o console Rich com um tema personalizado
-custom_theme = Theme({
+custom_theme = {
     "info": "dim cyan",
     "warning": "magenta",
     "error": "bold red",
@@ -37,8 +68,8 @@ custom_theme = Theme({
     "header": "bold white on blue",
     "phase": "bold yellow on #333333",
     "separator": "bold black on white"
-})
-console = Console(theme=custom_theme)
+}
+console = LazyConsole(custom_theme)
 # Aumentar o timeout padrão para conexões de socket para evitar timeouts com a API do OpenSubtitles
 socket.setdefaulttimeout(60)
 
@@ -51,52 +82,795 @@ TMDB_API_KEY = 'SUA_CHAVE_API_TMDB'
 OPENSUBTITLES_USERNAME = 'usuário'
 OPENSUBTITLES_PASSWORD = 'senha'
 
-# --- INICIALIZAÇÃO DA API TMDB ---
-tmdb = TMDb()
-tmdb.api_key = TMDB_API_KEY
-tmdb.language = 'pt-BR'  # Define o idioma para português do Brasil (pode ser ajustado para o idioma detectado)
+# Nome do anexo usado como capa em arquivos MKV (convenção do Matroska)
+MKV_COVER_NAME = 'cover.jpg'
 
-movie_api = Movie()
-tv_api = TV()
+# --- MÉTRICAS DE DESEMPENHO ---
+METRICS_FILE_NAME = 'metrics.json'        # Relatório da última execução, no diretório de cache
+METRICS_PERCENTILES = (50, 95, 99)
+PROMETHEUS_PREFIX = 'foldermovie'
+PROFILE_TOP_FUNCTIONS = 30                # Funções exibidas ao final de uma execução com --profile
+PROFILE_OUTPUT_FILE = 'foldermovie.pstats'  # Estatísticas do cProfile salvas com --profile
 
 
-def extract_title_from_filename(filename):
+def percentile(sorted_values, p):
     """
-    Tenta extrair o título do filme/série e detectar se é uma série de um nome de arquivo.
-    Retorna (title, is_series).
-    Exemplos:
-    - "A.Mulher.no.Jardim.2025.1080p.BluRay.DUAL.5.1.mkv" -> ("A Mulher no Jardim", False)
-    - "As.Marvels.2023.1080p.BluRay.EAC3.AAC.DUAL.5.1.mkv" -> ("As Marvels", False)
-    - "Ironheart.S01E01.1080p.WEB-DL.DUAL.5.1.mkv" -> ("Ironheart", True)
-    - "The.Mandalorian.S02E05.1080p.WEB.H264-FLX.mkv" -> ("The Mandalorian", True)
+    Percentil pelo método do posto mais próximo (valores já ordenados).
     """
-    name_without_ext = os.path.splitext(filename)[0]
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, -(-len(sorted_values) * p // 100) - 1)]
 
-    # Regex para detectar padrões de série (S01E01, S1E1, etc.)
-    series_pattern = re.compile(r'[sS]\d+[eE]\d+')
-    is_series = bool(series_pattern.search(name_without_ext))
 
-    if is_series:
-        # Para séries, tentar extrair o nome antes do padrão SXXEXX
-        match = re.search(r'^(.*?)[sS]\d+[eE]\d+', name_without_ext)
-        if match:
-            title = match.group(1).replace('.', ' ').strip()
-        else:
-            title = name_without_ext.replace('.', ' ').strip() # Fallback
-    else:
-        # Para filmes, remover o ano e o que vem depois
-        match_year = re.search(r'\.\d{4}', name_without_ext)
-        if match_year:
-            name_without_ext = name_without_ext[:match_year.start()]
-        title = name_without_ext.replace('.', ' ').strip()
+class Metrics:
+    """
+    Coleta, de forma segura entre threads, a duração de cada operação por etapa (TMDb,
+    capas, ffprobe, ffmpeg, mkvpropedit, legendas...), os bytes gravados e as taxas de
+    acerto dos caches. Ao final da execução, gera um relatório JSON e, opcionalmente,
+    um arquivo texto no formato do Prometheus (para o textfile collector do node exporter).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = collections.defaultdict(lambda: array.array('d'))
+        self._errors = collections.Counter()
+        self._bytes = collections.Counter()
+        self._caches = {}
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """
+        Mede a duração do bloco `with` na etapa indicada; exceções contam como erro da etapa.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self._errors[stage] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._durations[stage].append(elapsed)
+
+    def add_bytes(self, stage, count):
+        with self._lock:
+            self._bytes[stage] += count
+
+    def cache(self, name, hits, misses):
+        """
+        Registra os contadores de acerto/falha de um cache.
+        """
+        with self._lock:
+            self._caches[name] = (hits, misses)
+
+    def report(self):
+        """
+        Retorna o relatório da execução como um dicionário serializável em JSON.
+        """
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+            errors = dict(self._errors)
+            written = dict(self._bytes)
+            caches = dict(self._caches)
+        stages = {}
+        for stage in sorted(set(durations) | set(written)):
+            values = durations.get(stage, [])
+            summary = {
+                'count': len(values),
+                'errors': errors.get(stage, 0),
+                'total_seconds': round(sum(values), 6),
+                'max_seconds': round(values[-1], 6) if values else None,
+                'bytes_written': written.get(stage, 0),
+            }
+            for p in METRICS_PERCENTILES:
+                value = percentile(values, p)
+                summary[f'p{p}_seconds'] = round(value, 6) if value is not None else None
+            stages[stage] = summary
+        return {
+            'started': self.started,
+            'duration_seconds': round(time.time() - self.started, 3),
+            'stages': stages,
+            'bytes_written': sum(written.values()),
+            'caches': {
+                name: {'hits': hits, 'misses': misses,
+                       'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+                for name, (hits, misses) in sorted(caches.items())
+            },
+        }
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.report(), indent=2, ensure_ascii=False) + '\n')
+
+    def write_prometheus(self, path):
+        """
+        Grava as métricas no formato texto do Prometheus. A gravação é atômica (arquivo
+        temporário + rename), como o textfile collector exige.
+        """
+        report = self.report()
+        name = PROMETHEUS_PREFIX
+        lines = [
+            f'# HELP {name}_stage_duration_seconds Duração das operações de cada etapa.',
+            f'# TYPE {name}_stage_duration_seconds summary',
+        ]
+        for stage, summary in report['stages'].items():
+            if not summary['count']:
+                continue
+            for p in METRICS_PERCENTILES:
+                lines.append(f'{name}_stage_duration_seconds{{stage="{stage}",quantile="{p / 100}"}} {summary[f"p{p}_seconds"]}')
+            lines.append(f'{name}_stage_duration_seconds_sum{{stage="{stage}"}} {summary["total_seconds"]}')
+            lines.append(f'{name}_stage_duration_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        lines += [f'# HELP {name}_stage_errors Operações que falharam em cada etapa.', f'# TYPE {name}_stage_errors gauge']
+        lines += [f'{name}_stage_errors{{stage="{stage}"}} {summary["errors"]}' for stage, summary in report['stages'].items()]
+        lines += [f'# HELP {name}_bytes_written Bytes gravados em disco por etapa.', f'# TYPE {name}_bytes_written gauge']
+        lines += [f'{name}_bytes_written{{stage="{stage}"}} {summary["bytes_written"]}' for stage, summary in report['stages'].items()]
+        lines += [f'# HELP {name}_cache_hits Acertos de cada cache.', f'# TYPE {name}_cache_hits gauge']
+        lines += [f'{name}_cache_hits{{cache="{cache}"}} {values["hits"]}' for cache, values in report['caches'].items()]
+        lines += [f'# HELP {name}_cache_misses Falhas de cada cache.', f'# TYPE {name}_cache_misses gauge']
+        lines += [f'{name}_cache_misses{{cache="{cache}"}} {values["misses"]}' for cache, values in report['caches'].items()]
+        lines += [
+            f'# HELP {name}_run_duration_seconds Duração da execução.',
+            f'# TYPE {name}_run_duration_seconds gauge',
+            f'{name}_run_duration_seconds {report["duration_seconds"]}',
+            f'# HELP {name}_last_run_timestamp_seconds Momento de início da execução.',
+            f'# TYPE {name}_last_run_timestamp_seconds gauge',
+            f'{name}_last_run_timestamp_seconds {report["started"]:.0f}',
+        ]
+        write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def write_atomically(path, text):
+    """
+    Grava um arquivo de texto por meio de um arquivo temporário no mesmo diretório.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.tmp-', delete=False, encoding='utf-8') as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+
+# Métricas da execução atual (compartilhadas por todas as etapas)
+metrics = Metrics()
+
+
+# --- API TMDB ---
+# As URLs podem ser trocadas por variáveis de ambiente (ex: servidor local dos benchmarks)
+TMDB_API_URL = os.environ.get('FOLDERMOVIE_TMDB_URL', 'https://api.themoviedb.org/3')
+TMDB_RATE_LIMIT = 20    # Requisições por segundo (o TMDb tolera cerca de 40-50/s)
+TMDB_MAX_RETRIES = 5    # Tentativas em caso de 429 ou erro temporário
+LOOKUP_WORKERS = 8      # Buscas simultâneas na Fase 1
+
+# --- CACHE PERSISTENTE DO TMDB ---
+# Valores padrão do cache (podem ser ajustados pela linha de comando)
+CACHE_TTL_DAYS = 30           # Validade de respostas com resultado
+CACHE_NEGATIVE_TTL_DAYS = 1   # Validade de respostas "sem resultado"
+CACHE_MAX_ENTRIES = 50000     # Limite de entradas antes da remoção LRU
+
+
+def default_cache_dir():
+    """
+    Retorna o diretório de cache do usuário (respeitando XDG_CACHE_HOME).
+    """
+    base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, 'foldermovie')
+
+
+def normalize_title(title):
+    """
+    Normaliza um título para uso como chave de cache (minúsculas e espaços simples).
+    """
+    return re.sub(r'\s+', ' ', title).strip().casefold()
+
+
+class TMDbCache:
+    """
+    Cache persistente em SQLite para as respostas do TMDb.
+    As chaves combinam endpoint, tipo de mídia, idioma e título normalizado (ou id).
+    Respostas "sem resultado" são guardadas com validade própria (cache negativo) e,
+    ao ultrapassar o limite de entradas, as menos usadas recentemente são removidas.
+    """
+
+    EVICTION_INTERVAL = 100  # Verificar o limite de tamanho a cada N gravações
+
+    def __init__(self, cache_dir, ttl_days=CACHE_TTL_DAYS, negative_ttl_days=CACHE_NEGATIVE_TTL_DAYS,
+                 max_entries=CACHE_MAX_ENTRIES, refresh=False, offline=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'tmdb.sqlite3')
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tmdb_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' payload TEXT NOT NULL,'
+            ' negative INTEGER NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tmdb_cache_accessed ON tmdb_cache (accessed)')
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(endpoint, media_type, language, query):
+        return f"{endpoint}|{media_type}|{language}|{normalize_title(str(query))}"
+
+    def get(self, key):
+        """
+        Retorna (encontrado, payload). Entradas expiradas ou ignoradas por --refresh contam como falha.
+        """
+        now = time.time()
+        with self._lock:
+            if self.refresh:
+                self.misses += 1
+                return False, None
+            row = self._conn.execute(
+                'SELECT payload, negative, created FROM tmdb_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            payload, negative, created = row
+            ttl = self.negative_ttl if negative else self.ttl
+            # No modo offline, entradas expiradas ainda são melhores do que nada
+            if not self.offline and now - created > ttl:
+                self.misses += 1
+                return False, None
+            self._conn.execute('UPDATE tmdb_cache SET accessed = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return True, json.loads(payload)
+
+    def set(self, key, payload):
+        now = time.time()
+        negative = 0 if payload else 1
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tmdb_cache (key, payload, negative, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(payload), negative, now, now)
+            )
+            self._writes += 1
+            if self._writes % self.EVICTION_INTERVAL == 0:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM tmdb_cache').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM tmdb_cache WHERE key IN (SELECT key FROM tmdb_cache ORDER BY accessed LIMIT ?)',
+                (excess,)
+            )
+            log.info(f"Cache do TMDb: {excess} entradas antigas removidas (LRU).")
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+            self._conn.close()
+
+
+class RateLimiter:
+    """
+    Limitador de taxa do tipo "token bucket", compartilhado entre threads.
+    Cada requisição consome um token; os tokens são repostos a `rate` por segundo
+    até o máximo de `burst`. `pause()` suspende todas as requisições (ex: após um 429).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # A reposição recomeça só no fim da pausa: sem isso, a pausa inteira contaria como
+            # tempo de reposição e o balde voltaria cheio, com uma rajada logo após o 429
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+
+class TMDbClient:
+    """
+    Cliente HTTP do TMDb seguro para uso concorrente.
+    O idioma é passado em cada requisição (em vez do `tmdb.language` global do tmdbv3api),
+    todas as threads compartilham o limitador de taxa e as respostas passam pelo cache persistente.
+    Respostas 429 e erros temporários são repetidos com espera exponencial.
+    """
+
+    def __init__(self, api_key, cache, rate_limiter, base_url=TMDB_API_URL, pool_size=10):
+        self.api_key = api_key
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.session = None
+        self._session_lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(256)]
+
+    def _session(self):
+        # A sessão HTTP (e o requests) só é criada na primeira chamada de rede
+        with self._session_lock:
+            if self.session is None:
+                import requests.adapters
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self.session.mount('https://', adapter)
+                self.session.mount('http://', adapter)
+            return self.session
+
+    def _get(self, path, language, **params):
+        import requests
+        params.update(api_key=self.api_key, language=language)
+        url = f"{self.base_url}{path}"
+        session = self._session()
+        for attempt in range(TMDB_MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                with metrics.span('tmdb_request'):
+                    response = session.get(url, params=params, timeout=30)
+            except requests.exceptions.RequestException as e:
+                if attempt == TMDB_MAX_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                log.warning(f"Erro de conexão com o TMDb ({e}). Nova tentativa em {delay}s...")
+                time.sleep(delay)
+                continue
+            if response.status_code == 404:
+                return None
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == TMDB_MAX_RETRIES:
+                    response.raise_for_status()
+                retry_after = response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                log.warning(f"TMDb respondeu {response.status_code}. Aguardando {delay}s antes de tentar novamente...")
+                self.rate_limiter.pause(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _fetch(self, key, path, language, extract, description, **params):
+        """
+        Consulta o cache e, se necessário, o TMDb. Requisições idênticas feitas ao mesmo tempo
+        por threads diferentes resultam em uma única chamada de rede.
+        """
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            found, payload = self.cache.get(key)
+            if found:
+                return payload
+            if self.cache.offline:
+                log.info(f"Modo offline: {description} ({language}) não está no cache.")
+                return None
+            response = self._get(path, language, **params)
+            payload = extract(response) if response else extract({})
+            self.cache.set(key, payload)
+            return payload
+
+    def search(self, query, is_series, language, year=None):
+        """
+        Busca um título no TMDb passando pelo cache persistente, restrita ao ano se ele for informado
+        (ano de lançamento para filmes, ano da primeira exibição para séries).
+        Retorna uma lista (possivelmente vazia) de resultados no formato do tmdbv3api.
+        """
+        from tmdbv3api.as_obj import AsObj
+        media_type = 'tv' if is_series else 'movie'
+        params = {'query': query}
+        if year:
+            params['first_air_date_year' if is_series else 'year'] = year
+        key = TMDbCache.make_key('search', media_type, language, f"{query}|{year}" if year else query)
+        payload = self._fetch(key, f"/search/{media_type}", language, lambda response: response.get('results', []),
+                              f"'{query}'" + (f" ({year})" if year else ""), **params)
+        return [AsObj(item) for item in payload or []]
+
+    def details(self, item_id, is_series, language):
+        """
+        Obtém os detalhes completos de um filme/série passando pelo cache persistente.
+        Retorna None se os detalhes não estiverem disponíveis (ex: modo offline sem cache).
+        """
+        from tmdbv3api.as_obj import AsObj
+        media_type = 'tv' if is_series else 'movie'
+        key = TMDbCache.make_key('details', media_type, language, item_id)
+        payload = self._fetch(key, f"/{media_type}/{item_id}", language, lambda response: response,
+                              f"detalhes de {media_type}/{item_id}")
+        return AsObj(payload) if payload else None
+
+    def season(self, tv_id, season_number, language):
+        """
+        Obtém uma temporada completa (com título e data de exibição de todos os episódios).
+        Retorna None se a temporada não estiver disponível.
+        """
+        from tmdbv3api.as_obj import AsObj
+        key = TMDbCache.make_key('season', 'tv', language, f"{tv_id}/{season_number}")
+        payload = self._fetch(key, f"/tv/{tv_id}/season/{season_number}", language, lambda response: response,
+                              f"temporada {season_number} de tv/{tv_id}")
+        return AsObj(payload) if payload else None
+
+
+# --- ÍNDICE LOCAL DO TMDB (EXPORTAÇÕES DIÁRIAS DE IDS) ---
+OFFLINE_INDEX_NAME = 'tmdb_index.bin'
+OFFLINE_INDEX_SOURCES_SUFFIX = '.sources.json'  # Exportações (caminho, tamanho, mtime) usadas na geração
+OFFLINE_INDEX_MAGIC = b'FMTIDX01'
+OFFLINE_INDEX_HEADER = struct.Struct('<8sQ')    # Assinatura e número de registros
+OFFLINE_INDEX_RECORD = struct.Struct('<IfBB')   # id, popularidade, tipo (0 = filme, 1 = série), tamanho da chave
+OFFLINE_INDEX_CANDIDATES = 3                    # Candidatos conferidos (por popularidade) quando há ano no nome
+
+
+def normalize_index_title(title):
+    """
+    Normaliza um título para o índice local: sem acentos, minúsculas e apenas letras e números
+    separados por um espaço (ex: "Amélie: O Fabuloso Destino" -> "amelie o fabuloso destino").
+    """
+    decomposed = unicodedata.normalize('NFKD', title)
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\W_]+', ' ', without_accents.casefold()).split())
+
+
+class OfflineTitleIndex:
+    """
+    Índice local de títulos do TMDb, gerado a partir das exportações diárias de ids
+    (movie_ids_MM_DD_AAAA.json.gz e tv_series_ids_MM_DD_AAAA.json.gz).
+    O arquivo guarda os registros ordenados por (título normalizado, tipo, popularidade decrescente)
+    e uma tabela de deslocamentos; ele é mapeado em memória (mmap) e consultado por busca binária,
+    sem carregar o índice inteiro.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._file = open(index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = OFFLINE_INDEX_HEADER.unpack_from(self._map)
+        if magic != OFFLINE_INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"Arquivo de índice inválido: {index_path}")
+        self._offsets = memoryview(self._map)[OFFLINE_INDEX_HEADER.size:
+                                             OFFLINE_INDEX_HEADER.size + 4 * self.count].cast('I')
+
+    @staticmethod
+    def build(dump_paths, index_path):
+        """
+        Gera o índice a partir de exportações do TMDb (JSON por linha, compactadas com gzip ou não).
+        O tipo de cada linha vem do campo do título: 'original_title' (filme) ou 'original_name' (série).
+        Itens adultos e vídeos avulsos são ignorados. Retorna o número de registros.
+        """
+        entries = []
+        for dump_path in dump_paths:
+            opener = gzip.open if dump_path.endswith('.gz') else open
+            with opener(dump_path, 'rt', encoding='utf-8') as dump:
+                for line in dump:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue
+                    if item.get('adult') or item.get('video'):
+                        continue
+                    if 'original_title' in item:
+                        media, title = 0, item['original_title']
+                    elif 'original_name' in item:
+                        media, title = 1, item['original_name']
+                    else:
+                        continue
+                    key = normalize_index_title(title or '').encode('utf-8')
+                    if key and len(key) < 256:
+                        entries.append((key, media, -float(item.get('popularity') or 0), item['id']))
+        entries.sort()
+
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        temp_path = f"{index_path}.tmp"
+        data_start = OFFLINE_INDEX_HEADER.size + 4 * len(entries)
+        offsets = []
+        position = data_start
+        for key, _, _, _ in entries:
+            offsets.append(position)
+            position += OFFLINE_INDEX_RECORD.size + len(key)
+        if position >= 2 ** 32:
+            raise ValueError("Índice grande demais para deslocamentos de 32 bits.")
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(OFFLINE_INDEX_HEADER.pack(OFFLINE_INDEX_MAGIC, len(entries)))
+            index_file.write(array.array('I', offsets).tobytes())
+            for key, media, negative_popularity, item_id in entries:
+                index_file.write(OFFLINE_INDEX_RECORD.pack(item_id, -negative_popularity, media, len(key)))
+                index_file.write(key)
+        os.replace(temp_path, index_path)
+        write_atomically(index_path + OFFLINE_INDEX_SOURCES_SUFFIX,
+                         json.dumps(OfflineTitleIndex.dump_signature(dump_paths)))
+        return len(entries)
+
+    @staticmethod
+    def dump_signature(dump_paths):
+        """
+        Identifica as exportações pelo caminho, tamanho e mtime, sem lê-las.
+        """
+        signature = []
+        for dump_path in sorted(os.path.abspath(path) for path in dump_paths):
+            st = os.stat(dump_path)
+            signature.append([dump_path, st.st_size, st.st_mtime_ns])
+        return signature
+
+    @staticmethod
+    def build_if_changed(dump_paths, index_path):
+        """
+        Gera o índice apenas se ele não existir ou se as exportações não forem as mesmas (e inalteradas)
+        da última geração. Retorna o número de registros gerados, ou None se o índice atual foi mantido.
+        """
+        try:
+            with open(index_path + OFFLINE_INDEX_SOURCES_SUFFIX, encoding='utf-8') as sources_file:
+                previous = json.load(sources_file)
+            if os.path.exists(index_path) and previous == OfflineTitleIndex.dump_signature(dump_paths):
+                return None
+        except (OSError, ValueError):
+            pass
+        return OfflineTitleIndex.build(dump_paths, index_path)
+
+    def _key(self, position):
+        offset = self._offsets[position] + OFFLINE_INDEX_RECORD.size
+        return self._map[offset:offset + self._map[offset - 1]]
+
+    def lookup(self, title, is_series, limit=OFFLINE_INDEX_CANDIDATES):
+        """
+        Retorna os ids (até `limit`, do mais popular para o menos) cujo título original normalizado
+        é igual ao título procurado.
+        """
+        key = (normalize_index_title(title).encode('utf-8'), 1 if is_series else 0)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._offsets[middle]
+            if (self._key(middle), self._map[offset + 8]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        item_ids = []
+        while low < self.count and len(item_ids) < limit:
+            item_id, _, media, _ = OFFLINE_INDEX_RECORD.unpack_from(self._map, self._offsets[low])
+            if (self._key(low), media) != key:
+                break
+            item_ids.append(item_id)
+            low += 1
+        return item_ids
+
+    def close(self):
+        if getattr(self, '_offsets', None) is not None:
+            self._offsets.release()
+        self._map.close()
+        self._file.close()
+
+
+# --- PARSER DE NOMES DE RELEASE ---
+RELEASE_PARSE_CACHE_SIZE = 65536   # Nomes analisados guardados em memória (LRU)
+RELEASE_WORD_CACHE_SIZE = 100000   # Palavras da cauda já classificadas guardadas em memória
+
+# Uma única busca por regex pré-compilado acha, no nome inteiro, o primeiro marcador de
+# episódio/qualidade: tudo o que vem antes dele é o título (e o ano, se houver). Só as palavras
+# da cauda, a partir do marcador, são classificadas, e cada palavra nova passa uma única vez
+# pelo regex de tokens: as seguintes são consultas a um dicionário.
+RELEASE_BRACKETS = str.maketrans('[](){}', '      ')
+RELEASE_NUMERIC_START = frozenset('0123456789s')
+RELEASE_KEYWORDS = dict.fromkeys(
+    ('480p', '576p', '720p', '1080p', '1080i', '2160p', '4k', 'uhd'), 'resolution')
+RELEASE_KEYWORDS.update(dict.fromkeys(
+    ('bluray', 'blu-ray', 'bdrip', 'brrip', 'bdremux', 'remux', 'web-dl', 'webdl', 'webrip', 'web-rip', 'web',
+     'hdtv', 'hdrip', 'dvdrip', 'dvd', 'hdcam'), 'source'))
+RELEASE_KEYWORDS.update(dict.fromkeys(
+    ('x264', 'x265', 'h264', 'h265', 'hevc', 'avc', 'xvid', 'divx', '10bit', '10bits', 'hdr', 'hdr10', 'dv',
+     'ac3', 'eac3', 'dd', 'ddp', 'dd5', 'ddp5', 'aac', 'aac2', 'dts', 'dts-hd', 'truehd', 'atmos', 'dual',
+     'dublado', 'legendado', 'nacional', 'multi', 'proper', 'repack', 'extended', 'unrated', 'remastered',
+     'imax', 'complete'), 'other'))
+RELEASE_TOKEN_PATTERN = re.compile(r"""
+    (?P<episode>s(?P<season>\d{1,2})e(?P<first>\d{1,3})(?:-?e(?P<last>\d{1,3}))?)
+  | (?P<cross>(?P<xseason>\d{1,2})x(?P<xepisode>\d{2,3}))
+  | (?P<year>(?:19|20)\d\d)
+  | (?P<resolution>\d{3,4}[pi])
+""", re.VERBOSE)
+
 
-    title = re.sub(r'\s+', ' ', title)
-    return title, is_series
+def keyword_regex(words):
+    """
+    Monta uma alternância de regex em forma de árvore de prefixos (ex: "web(?:-(?:dl|rip)|dl|rip)?"):
+    o regex descarta uma palavra comparando cada letra uma vez, em vez de tentar palavra por palavra.
+    """
+    tree = {}
+    for word in words:
+        node = tree
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def branch(node):
+        alternatives = [re.escape(char) + branch(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+        return f"(?:{body})?" if '' in node else body
+    return branch(tree)
+
+
+# O nome chega em minúsculas e com as palavras separadas por um espaço. Uma palavra termina no
+# espaço seguinte ou no fim; o marcador pode ter um grupo grudado (ex: "x264-grp", "web-dl-grp").
+RELEASE_WORD_END = r"(?=(?:-[^ -]*)?(?: |$))"
+RELEASE_MARKER_PATTERN = re.compile(
+    r" (?:((?:19|20)\d\d) )?"
+    r"(?:s\d{1,2}e\d{1,3}(?:-?e\d{1,3})?|\d{1,2}x\d{2,3}|\d{3,4}[pi]|" + keyword_regex(RELEASE_KEYWORDS) + ")"
+    + RELEASE_WORD_END)
+RELEASE_YEAR_PATTERN = re.compile(r" ((?:19|20)\d\d)" + RELEASE_WORD_END)
+RELEASE_NOT_TOKEN = ()
+# Palavra em minúsculas -> (tipo, temporada, episódios, tamanho da parte antes do grupo ou None)
+release_words = {word: (kind, None, (), None) for word, kind in RELEASE_KEYWORDS.items()}
+
+
+def classify_release_word(word, group_allowed=True):
+    """
+    Classifica uma palavra em minúsculas da cauda de um nome de release.
+    Retorna (tipo, temporada, episódios, tamanho antes do grupo) ou RELEASE_NOT_TOKEN.
+    """
+    known = release_words.get(word)
+    if known is not None:
+        return known
+    if word[0] in RELEASE_NUMERIC_START:
+        match = RELEASE_TOKEN_PATTERN.fullmatch(word)
+        if match is not None:
+            kind = match.lastgroup
+            if kind == 'episode':
+                first = int(match.group('first'))
+                last = int(match.group('last') or first)
+                episodes = tuple(range(first, last + 1)) if last > first else (first,)
+                return kind, int(match.group('season')), episodes, None
+            if kind == 'cross':
+                return kind, int(match.group('xseason')), (int(match.group('xepisode')),), None
+            return kind, None, (), None
+    if group_allowed and '-' in word:
+        # Grupo da release grudado no marcador (ex: "x264-grp", "web-dl-grp")
+        head = word.rpartition('-')[0]
+        if head:
+            kind, season, episodes, _ = classify_release_word(head, False) or (None, None, (), None)
+            if kind is not None:
+                return kind, season, episodes, len(head)
+    return RELEASE_NOT_TOKEN
+
+
+class ReleaseName:
+    """
+    Resultado compacto da análise de um nome de release (ex: "Show.S01E02.1080p.WEB-DL-GRP.mkv").
+    """
+    __slots__ = ('title', 'year', 'season', 'episodes', 'resolution', 'source', 'group')
+
+    def __init__(self, title, year=None, season=None, episodes=(), resolution=None, source=None, group=None):
+        self.title = title
+        self.year = year
+        self.season = season
+        self.episodes = episodes
+        self.resolution = resolution
+        self.source = source
+        self.group = group
+
+    @property
+    def is_series(self):
+        return self.season is not None
+
+    @property
+    def episode(self):
+        return self.episodes[0] if self.episodes else None
 
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"ReleaseName({fields})"
 
-def download_image(image_url, save_path):
+
+@functools.lru_cache(maxsize=RELEASE_PARSE_CACHE_SIZE)
+def parse_release_name(filename):
+    """
+    Analisa um nome de arquivo de release e retorna um ReleaseName.
+    Números com cara de ano no início ou no meio do título fazem parte dele; o ano é o último
+    antes do primeiro marcador de qualidade/episódio:
+    - "Blade.Runner.2049.2017.1080p.BluRay.x264-GRP.mkv" -> "Blade Runner 2049", 2017, grupo "GRP"
+    - "2001.A.Space.Odyssey.1968.mkv" -> "2001 A Space Odyssey", 1968
+    - "The.Office.S02E03E04.720p.mkv" -> "The Office", temporada 2, episódios (3, 4)
+    - "Show.1x05.HDTV.mkv" -> "Show", temporada 1, episódio 5
+    """
+    if filename[-4:].lower() in VIDEO_EXTENSIONS:
+        filename = filename[:-4]
+    # str.replace é bem mais rápido que str.translate; os colchetes são raros e ficam para o translate
+    name = filename.replace('.', ' ').replace('_', ' ')
+    if '[' in name or '(' in name or '{' in name:
+        name = name.translate(RELEASE_BRACKETS)
+    if '  ' in name or name[:1] == ' ' or name[-1:] == ' ':
+        name = ' '.join(name.split())
+    lowered = name.lower()
+    if len(lowered) != len(name):
+        # Raros caracteres mudam de tamanho em minúsculas (ex: "İ"); as posições precisam bater
+        lowered = ''.join(char if len(char.lower()) != 1 else char.lower() for char in name)
+    first_space = lowered.find(' ')
+    if first_space < 0:
+        return ReleaseName(name.strip(' -'))
+
+    # A primeira palavra é sempre parte do título (ex: "1917", "Dual"): as buscas começam no primeiro espaço
+    year = season = resolution = source = group = None
+    episodes = ()
+    title_end = len(lowered)
+    marker = RELEASE_MARKER_PATTERN.search(lowered, first_space)
+    if marker is not None:
+        title_end = marker.start()
+        if marker.group(1):
+            year = int(marker.group(1))
+    if year is None and (lowered.find(' 19', first_space, title_end) >= 0
+                         or lowered.find(' 20', first_space, title_end) >= 0):
+        years = RELEASE_YEAR_PATTERN.findall(lowered, first_space, title_end)
+        if years:
+            title_end = lowered.rfind(' ' + years[-1], first_space, title_end)
+            year = int(years[-1])
+
+    # A cauda começa no ano ou no marcador; só as palavras dela são classificadas. Fonte e grupo
+    # saem do nome original, preservando maiúsculas (ex: "WEB-DL", "FLX")
+    words = release_words
+    end = title_end
+    for word in lowered[title_end + 1:].split(' ') if title_end < len(lowered) else ():
+        start, end = end + 1, end + 1 + len(word)
+        found = words.get(word)
+        if found is None:
+            found = classify_release_word(word)
+            if len(words) < RELEASE_WORD_CACHE_SIZE:
+                words[word] = found
+        if not found:
+            continue
+        kind, word_season, word_episodes, group_at = found
+        if group_at is not None:
+            group = name[start + group_at + 1:end]   # Vale o último
+            word = word[:group_at]
+        if kind == 'other':
+            continue
+        if kind == 'resolution':
+            resolution = resolution or word
+        elif kind == 'source':
+            source = source or name[start:start + len(word)]
+        elif kind == 'year':
+            year = year or int(word)
+        elif season is None:
+            season, episodes = word_season, word_episodes
+    return ReleaseName(name[:title_end].strip(' -'), year, season, episodes, resolution, source, group)
+
+
+def parse_many(filenames):
+    """
+    Analisa vários nomes de arquivo de uma vez (com memorização dos nomes repetidos).
+    Retorna uma lista de ReleaseName na mesma ordem.
+    """
+    parse = parse_release_name
+    return [parse(filename) for filename in filenames]
+
+
+def download_image(image_url, save_path, session=None):
+    import requests
     try:
-        response = requests.get(image_url, stream=True)
+        response = (session or requests).get(image_url, stream=True, timeout=60)
         response.raise_for_status()
         with open(save_path, 'wb') as out_file:
             shutil.copyfileobj(response.raw, out_file)
@@ -144,356 +918,2944 @@ def get_safe_title(selected_item):
     except Exception:
         return "Título Desconhecido (Erro)"
 
-def get_audio_language(file_path):
+# --- CACHE DE CAPAS ---
+TMDB_IMAGE_URL = os.environ.get('FOLDERMOVIE_TMDB_IMAGE_URL', 'https://image.tmdb.org/t/p')
+POSTER_SIZE = 'original'      # Tamanho da capa embutida (ex: 'w342', 'w500', 'w780', 'original')
+POSTER_SIZES = ('w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original')
+POSTER_CACHE_MAX_MB = 500     # Limite do cache de capas antes da remoção LRU
+
+
+class PosterCache:
+    """
+    Cache de capas em disco, compartilhado entre execuções. Cada arquivo é identificado
+    pelo poster_path do TMDb e pelo tamanho escolhido, então todos os episódios de uma
+    série usam o mesmo download. Os downloads reaproveitam conexões (keep-alive) de uma
+    única requests.Session e, a cada EVICTION_INTERVAL downloads e ao fechar, as capas menos
+    usadas são removidas se o cache ultrapassar o limite (o modo de observação e o worker
+    ficam abertos indefinidamente). No modo offline, apenas as capas já em cache são usadas.
+    """
+
+    EVICTION_INTERVAL = 50  # Verificar o limite de tamanho a cada N downloads
+
+    def __init__(self, cache_dir, size=POSTER_SIZE, max_mb=POSTER_CACHE_MAX_MB, pool_size=10, offline=False):
+        self.dir = os.path.join(cache_dir, 'posters')
+        os.makedirs(self.dir, exist_ok=True)
+        self.size = size
+        self.offline = offline
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.pool_size = pool_size
+        self.session = None
+        self._downloads = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _session(self):
+        # Criada no primeiro download: execuções só com capas em cache não carregam o requests
+        with self._lock:
+            if self.session is None:
+                import requests.adapters
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                self.session.mount('https://', adapter)
+                self.session.mount('http://', adapter)
+            return self.session
+
+    def get(self, poster_path):
+        """
+        Retorna o caminho local da capa, baixando-a apenas se ainda não estiver no cache.
+        Retorna None se não houver capa ou o download falhar.
+        """
+        if not poster_path:
+            return None
+        key = hashlib.sha1(f"{self.size}{poster_path}".encode('utf-8')).hexdigest()
+        cover_path = os.path.join(self.dir, key + (os.path.splitext(poster_path)[1] or '.jpg'))
+        # Um lock por capa evita que episódios simultâneos baixem a mesma imagem
+        with self._key_lock(key):
+            if os.path.exists(cover_path):
+                os.utime(cover_path) # Marca como usada recentemente (LRU)
+                with self._lock:
+                    self.hits += 1
+                return cover_path
+            with self._lock:
+                self.misses += 1
+            if self.offline:
+                print(f"Capa fora do cache (modo offline): {poster_path}. Aplicando metadados sem capa.")
+                return None
+            print(f"Baixando capa para: {cover_path}")
+            partial_path = cover_path + '.part'
+            with metrics.span('poster_download'):
+                downloaded = download_image(f"{TMDB_IMAGE_URL}/{self.size}{poster_path}", partial_path, self._session())
+            if not downloaded:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                return None
+            metrics.add_bytes('poster_download', os.path.getsize(partial_path))
+            os.replace(partial_path, cover_path)
+        with self._lock:
+            self._downloads += 1
+            evict = self._downloads % self.EVICTION_INTERVAL == 0
+        if evict:
+            self.evict(keep=cover_path)
+        return cover_path
+
+    def evict(self, keep=None):
+        """
+        Remove as capas menos usadas até o cache caber no limite. Downloads em andamento ('.part')
+        e a capa `keep`, que está para ser embutida, nunca são removidos.
+        """
+        with self._evict_lock:
+            entries = []
+            for entry in os.scandir(self.dir):
+                if entry.is_file() and not entry.name.endswith('.part'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            if removed:
+                log.info(f"Cache de capas: {removed} capas antigas removidas (LRU).")
+
+    def close(self):
+        self.evict()
+        if self.session is not None:
+            self.session.close()
+
+
+# --- ANÁLISE DE MÍDIA (FFPROBE) ---
+FILE_CACHE_MAX_AGE_DAYS = 180  # Entradas de arquivos não vistos há mais tempo são descartadas
+
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: str = None
+    language: str = None
+    attached_pic: bool = False
+
+
+@dataclass
+class MediaProfile:
+    """
+    Resultado de uma única execução do ffprobe: trilhas de vídeo, áudio e legenda,
+    seus idiomas e codecs, a duração e se há uma capa (attached_pic) embutida.
+    """
+    duration: float = None
+    video_streams: list = field(default_factory=list)
+    audio_streams: list = field(default_factory=list)
+    subtitle_streams: list = field(default_factory=list)
+
+    @property
+    def audio_language(self):
+        """
+        Idioma da primeira trilha de áudio (ex: 'eng', 'por') ou None.
+        """
+        return self.audio_streams[0].language if self.audio_streams else None
+
+    @property
+    def has_cover(self):
+        return any(stream.attached_pic for stream in self.video_streams)
+
+    def has_subtitle(self, lang_code='por'):
+        return any(stream.language == lang_code for stream in self.subtitle_streams)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            duration=data.get('duration'),
+            video_streams=[StreamInfo(**stream) for stream in data.get('video_streams', [])],
+            audio_streams=[StreamInfo(**stream) for stream in data.get('audio_streams', [])],
+            subtitle_streams=[StreamInfo(**stream) for stream in data.get('subtitle_streams', [])],
+        )
+
+
+class FileInfoCache:
+    """
+    Cache persistente (SQLite) de informações derivadas do conteúdo de um arquivo.
+    A chave é (dispositivo, inode, tamanho, mtime) mais o tipo de informação, de modo que
+    qualquer alteração no arquivo invalida a entrada sem precisar lê-lo.
+    """
+
+    def __init__(self, cache_dir, max_age_days=FILE_CACHE_MAX_AGE_DAYS):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'files.sqlite3')
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS file_info ('
+            ' dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' kind TEXT NOT NULL, payload TEXT NOT NULL, accessed REAL NOT NULL,'
+            ' PRIMARY KEY (dev, ino, size, mtime_ns, kind))'
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def stat_key(file_path):
+        st = os.stat(file_path)
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, stat_key, kind):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload FROM file_info WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND kind = ?',
+                (*stat_key, kind)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE file_info SET accessed = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND kind = ?',
+                (time.time(), *stat_key, kind)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, stat_key, kind, payload):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO file_info (dev, ino, size, mtime_ns, kind, payload, accessed)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (*stat_key, kind, json.dumps(payload), time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM file_info WHERE accessed < ?', (time.time() - self.max_age,))
+            self._conn.commit()
+            self._conn.close()
+
+
+def run_ffprobe(file_path):
     """
-    Usa ffprobe para obter o idioma da primeira trilha de áudio de um arquivo de vídeo.
-    Retorna o código do idioma (ex: 'eng', 'por') ou None se não for encontrado.
+    Executa o ffprobe uma única vez (saída JSON) e retorna o MediaProfile do arquivo, ou None em caso de erro.
     """
     cmd = [
-        'ffprobe', '-v', '0', '-select_streams', 'a',
-        '-show_entries', 'stream=index:stream_tags=language',
-        '-of', 'compact=p=0:nk=1',
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams',
         file_path
     ]
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        output_lines = result.stdout.strip().split('\n')
-        if output_lines:
-            # Pega a primeira linha e extrai o idioma (formato: index|language)
-            first_audio_track = output_lines[0]
-            if '|' in first_audio_track:
-                lang = first_audio_track.split('|')[1]
-                return lang.strip()
-        return None
+        with metrics.span('ffprobe'):
+            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        data = json.loads(result.stdout or '{}')
     except subprocess.CalledProcessError as e:
         print(f"Erro ao executar ffprobe: {e.stderr}")
         return None
     except Exception as e:
-        print(f"Erro inesperado ao obter idioma do áudio: {e}")
+        print(f"Erro inesperado ao analisar o arquivo com ffprobe: {e}")
         return None
 
-def has_embedded_subtitle(file_path, lang_code='por'):
+    profile = MediaProfile()
+    duration = data.get('format', {}).get('duration')
+    profile.duration = float(duration) if duration else None
+    streams_by_type = {
+        'video': profile.video_streams,
+        'audio': profile.audio_streams,
+        'subtitle': profile.subtitle_streams,
+    }
+    for stream in data.get('streams', []):
+        streams = streams_by_type.get(stream.get('codec_type'))
+        if streams is None:
+            continue
+        language = stream.get('tags', {}).get('language')
+        streams.append(StreamInfo(
+            index=stream.get('index'),
+            codec_type=stream.get('codec_type'),
+            codec_name=stream.get('codec_name'),
+            language=language.strip() if language else None,
+            attached_pic=bool(stream.get('disposition', {}).get('attached_pic')),
+        ))
+    return profile
+
+
+def get_media_profile(file_path, file_cache):
     """
-    Usa ffprobe para verificar se um arquivo de vídeo possui uma trilha de legenda embutida
-    no idioma especificado.
-    Retorna True se encontrar, False caso contrário.
+    Retorna o MediaProfile do arquivo, usando o cache quando o arquivo não mudou.
     """
-    cmd = [
-        'ffprobe', '-v', '0', '-select_streams', 's',
-        '-show_entries', 'stream=index:stream_tags=language',
-        '-of', 'compact=p=0:nk=1',
-        file_path
-    ]
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        output_lines = result.stdout.strip().split('\n')
-        for line in output_lines:
-            if '|' in line:
-                lang = line.split('|')[1]
-                if lang.strip() == lang_code:
-                    return True
-        return False
-    except subprocess.CalledProcessError as e:
-        print(f"Erro ao executar ffprobe para legendas: {e.stderr}")
-        return False
-    except Exception as e:
-        print(f"Erro inesperado ao verificar legendas embutidas: {e}")
-        return False
+        stat_key = FileInfoCache.stat_key(file_path)
+    except OSError as e:
+        print(f"Erro ao acessar o arquivo: {e}")
+        return None
+    cached = file_cache.get(stat_key, 'profile')
+    if cached is not None:
+        return MediaProfile.from_dict(cached)
+    profile = run_ffprobe(file_path)
+    if profile is not None:
+        file_cache.set(stat_key, 'profile', profile.to_dict())
+    return profile
 
-def download_and_save_subtitle(video_path, item_title, release_year):
-    print(f"Buscando legendas para '{item_title}' ({release_year})...")
-    try:
-        # Criar um objeto Video para o subliminal, com metadados para busca mais precisa
-        video = Video.fromname(os.path.basename(video_path))
-        video.title = item_title
-        video.year = release_year
-
-        # Usar a função de alto nível do subliminal para baixar as legendas
-        subtitles = download_best_subtitles(
-            videos=[video],
-            languages={'por'},
-            providers=['opensubtitles'],
-            provider_configs={
-                'opensubtitles': {
-                    'username': OPENSUBTITLES_USERNAME,
-                    'password': OPENSUBTITLES_PASSWORD
-                }
-            }
-        )
 
-        if subtitles and subtitles.get(video):
-            # Salvar a legenda na mesma pasta do vídeo
-            save_subtitles(video, subtitles[video])
-            print(f"Legenda baixada e salva para '{item_title}'.")
-            return True
-        else:
-            print(f"Nenhuma legenda em português do Brasil encontrada para '{item_title}'.")
-            return False
-    except Exception as e:
-        print(f"Erro ao baixar legenda: {e}")
-        traceback.print_exc()
-        return False
+# --- LEGENDAS ---
+SUBTITLE_LANGUAGE = ('por', 'BR')  # Português do Brasil (códigos do babelfish)
+SUBTITLE_PROVIDERS = ['opensubtitles']
+SUBTITLE_WORKERS = 2              # Sessões simultâneas com os provedores (cada uma faz login uma vez)
+SUBTITLE_RATE_LIMIT = 1.0         # Requisições por segundo a cada provedor
+SUBTITLE_NEGATIVE_TTL_DAYS = 7    # Tempo até buscar novamente legendas que não foram encontradas
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Organiza arquivos de vídeo buscando metadados no TMDb.")
-    parser.add_argument('directory', type=str, help="Caminho para o diretório contendo os arquivos de vídeo.")
-    args = parser.parse_args()
+OPENSUBTITLES_HASH_CHUNK = 65536  # O hash usa os primeiros e os últimos 64 KiB do arquivo
 
-    movie_directory = args.directory
 
-    if not os.path.isdir(movie_directory):
-        log.error(f"Erro: O diretório especificado não existe: [bold red]{movie_directory}[/bold red]")
-        console.print(f"[error]Erro: O diretório especificado não existe: {movie_directory}[/error]")
-        return
+def compute_opensubtitles_hash(file_path):
+    """
+    Calcula o hash do OpenSubtitles: tamanho do arquivo + soma dos inteiros de 64 bits
+    (little-endian) dos primeiros e dos últimos 64 KiB. Apenas esses dois trechos são
+    mapeados em memória (mmap); o restante do arquivo nunca é lido.
+    Retorna o hash em hexadecimal, ou None para arquivos menores que 128 KiB.
+    """
+    chunk = OPENSUBTITLES_HASH_CHUNK
+    words = chunk // 8
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 2 * chunk:
+            return None
+        with mmap.mmap(f.fileno(), chunk, access=mmap.ACCESS_READ) as head:
+            total = size + sum(struct.unpack_from(f'<{words}Q', head))
+        # O deslocamento do mmap precisa ser múltiplo da granularidade de alocação
+        tail_offset = (size - chunk) // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(f.fileno(), size - tail_offset, access=mmap.ACCESS_READ, offset=tail_offset) as tail:
+            total += sum(struct.unpack_from(f'<{words}Q', tail, size - chunk - tail_offset))
+    return f"{total & 0xFFFFFFFFFFFFFFFF:016x}"
 
-    console.print(Panel("[bold green]Processamento Concluído![/bold green]\nVerifique seus arquivos organizados.", title="[bold white on green]Sucesso![/bold white on green]", style="success", expand=False))
 
-    files_to_process = []
+def get_video_hash(file_path, file_cache):
+    """
+    Retorna (hash do OpenSubtitles, tamanho do arquivo), usando o cache quando o arquivo não mudou.
+    Os provedores recebem o hash junto com o tamanho, e os dois precisam ser do mesmo arquivo:
+    o tamanho é guardado aqui, antes de a aplicação dos metadados alterá-lo.
+    """
+    try:
+        stat_key = FileInfoCache.stat_key(file_path)
+        cached = file_cache.get(stat_key, 'oshash')
+        if cached is not None:
+            return cached['hash'], cached.get('size', stat_key[2])
+        with metrics.span('oshash'):
+            video_hash = compute_opensubtitles_hash(file_path)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao calcular o hash de '{os.path.basename(file_path)}': {e}")
+        return None, None
+    file_cache.set(stat_key, 'oshash', {'hash': video_hash, 'size': stat_key[2]})
+    return video_hash, stat_key[2]
 
-    console.print(Panel("[bold yellow]Fase 1: Análise e Busca de Metadados[/bold yellow]\nVerificando arquivos de vídeo e buscando informações no TMDb.", title="[bold white on yellow]Início do Processamento[/bold white on yellow]", style="phase", expand=False))
 
-    files_to_process = []
+@functools.cache
+def rate_limited_provider_pool():
+    """
+    Retorna a classe RateLimitedProviderPool. Ela é definida na primeira chamada, pois o
+    subliminal (e os seus provedores) só é importado quando há legendas para buscar.
+    """
+    from subliminal import ProviderPool
+    from subliminal.exceptions import DiscardingError
+    from subliminal.extensions import provider_manager
 
-    for filename in os.listdir(movie_directory):
-        if '_processed' in filename:
-            log.info(f"Arquivo '{filename}' já processado, pulando.")
-            continue
-        file_path = os.path.join(movie_directory, filename)
-        if filename.lower().endswith(('.mkv', '.mp4', '.avi', '.mov')):
-            console.print(f"\n[separator]-- Processando arquivo: [bold blue]{filename}[/bold blue] --[/separator]")
-            extracted_title, is_series = extract_title_from_filename(filename)
-            log.info(f"Título extraído: '{extracted_title}' (Tipo: {"Série" if is_series else "Filme"})")
-            console.print(f"  [info]Título extraído:[/info] [bold cyan]'{extracted_title}'[/bold cyan] ([info]Tipo:[/info] {"Série" if is_series else "Filme"})")
-
-            search_results_pt_br = []
-            search_results_en_us = []
-            selected_item = None
-
-            # Tentar buscar em pt-BR primeiro
-            tmdb.language = 'pt-BR'
-            log.info(f"Buscando '{extracted_title}' no TMDb (idioma: pt-BR)...")
-            if is_series:
-                search_results_pt_br = tv_api.search(extracted_title)
-            else:
-                search_results_pt_br = movie_api.search(extracted_title)
+    class RateLimitedProviderPool(ProviderPool):
+        """
+        ProviderPool que respeita um limite de requisições por provedor, compartilhado entre sessões,
+        e registra os provedores que falharam: o ProviderPool responde a um erro desconhecido com []
+        (como se não houvesse legenda), e esse resultado não pode ir para o cache negativo.
+        """
 
-            if search_results_pt_br and not isinstance(search_results_pt_br, str):
-                selected_item = list(search_results_pt_br)[0] # Seleciona o primeiro resultado automaticamente
-                log.info(f"Resultado encontrado em pt-BR: {get_safe_title(selected_item)}")
-            else:
-                # Se não encontrou em pt-BR, tentar em en-US
-                log.warning(f"Nenhum resultado em pt-BR para '{extracted_title}'. Tentando em en-US...")
-                console.print(f"  [warning]Nenhum resultado em pt-BR para '{extracted_title}'. Tentando em en-US...[/warning]")
-                tmdb.language = 'en-US'
-                if is_series:
-                    search_results_en_us = tv_api.search(extracted_title)
-                else:
-                    search_results_en_us = movie_api.search(extracted_title)
-                
-                if search_results_en_us and not isinstance(search_results_en_us, str):
-                    selected_item = list(search_results_en_us)[0]
-                    log.info(f"Resultado encontrado em en-US: {get_safe_title(selected_item)}")
-                else:
-                    log.warning(f"Nenhum resultado em en-US para '{extracted_title}'.")
+        def __init__(self, rate_limiters, **kwargs):
+            super().__init__(**kwargs)
+            self.rate_limiters = rate_limiters
+            self.failed_providers = set()
 
-            # Resetar o idioma para pt-BR para as próximas operações
-            tmdb.language = 'pt-BR'
+        def _throttle(self, provider):
+            rate_limiter = self.rate_limiters.get(provider)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
 
-            if selected_item and hasattr(selected_item, 'id'):
-                console.print(f"  [success]Sugestão automática:[/success] [bold green]{get_safe_title(selected_item)}[/bold green]")
-                files_to_process.append((file_path, selected_item, is_series))
-            else:
-                log.error(f"Nenhum resultado encontrado para '{extracted_title}'. Pulando este arquivo.")
-                console.print(f"  [error]Nenhum resultado encontrado para '{extracted_title}'. Pulando este arquivo.[/error]")
-            console.print("[separator]----------------------------------------[/separator]")
+        def list_subtitles_provider(self, provider, video, languages):
+            plugin = provider_manager[provider].plugin
+            if not plugin.check(video):
+                return []
+            provider_languages = plugin.check_languages(languages)
+            if not provider_languages:
+                return []
+            self._throttle(provider)
+            try:
+                return self[provider].list_subtitles(video, provider_languages)
+            except DiscardingError as e:
+                log.warning(f"Provedor de legendas '{provider}' descartado: {e}")
+                return None
+            except Exception as e:
+                log.warning(f"Erro ao buscar legendas com '{provider}': {e}")
+                self.failed_providers.add(provider)
+                return []
 
-    print("\n" + "-" * 50)
-    print("  FASE 1.5: CONFIRMAÇÃO  ")
-    print("  Verifique as correlações antes de aplicar os metadados")
-    print("-" * 50 + "\n")
-    if not files_to_process:
-        print("Nenhum arquivo de vídeo encontrado ou selecionado para processamento.")
-        return
+        def answered_all(self):
+            """
+            Indica se todos os provedores responderam (nenhum foi descartado nem falhou).
+            """
+            return not self.discarded_providers and not self.failed_providers
 
-    while True:
-        confirm = input("Confirmar e aplicar metadados aos arquivos listados? (s/n): ").lower()
-        if confirm == 's':
-            break
-        elif confirm == 'n':
-            print("Operação cancelada pelo usuário.")
-            return
-        else:
-            print("Resposta inválida. Por favor, digite 's' para sim ou 'n' para não.")
+        def download_subtitle(self, subtitle):
+            self._throttle(subtitle.provider_name)
+            return super().download_subtitle(subtitle)
 
-    print("\n" + "-" * 50)
-    print("  FASE 2: APLICAÇÃO DE METADADOS  ")
-    print("  Aplicando metadados e baixando legendas  ")
-    print("-" * 50 + "\n")
+    return RateLimitedProviderPool
 
-    for file_path, selected_item, is_series in files_to_process:
-        filename = os.path.basename(file_path)
-        print(f"  Processando metadados para: {filename}")
 
-        # --- Baixar a capa ---
-        cover_url = f"https://image.tmdb.org/t/p/original{selected_item.poster_path}" if selected_item.poster_path else None
-        temp_cover_path = None
+class SubtitleDownloader:
+    """
+    Etapa de legendas do pipeline. Os arquivos que precisam de legenda entram em uma fila limitada
+    e são processados, à medida que chegam, por poucas sessões de longa duração com os provedores
+    (uma por thread, abertas até close(), inclusive entre os lotes do modo de observação e do
+    worker), em vez de um login por arquivo. O resultado de cada busca fica no cache de arquivos,
+    para que novas execuções não consultem os provedores de novo; "nenhuma legenda" só é guardado
+    quando todos os provedores responderam. Uma sessão com provedor descartado é recriada.
+    """
 
-        if cover_url:
-            temp_cover_path = os.path.join(tempfile.gettempdir(), f"cover_{selected_item.id}.jpg")
-            print(f"Baixando capa para: {temp_cover_path}")
-            if not download_image(cover_url, temp_cover_path):
-                temp_cover_path = None # Falha ao baixar
+    def __init__(self, file_cache, providers=SUBTITLE_PROVIDERS, workers=SUBTITLE_WORKERS,
+                 rate=SUBTITLE_RATE_LIMIT, negative_ttl_days=SUBTITLE_NEGATIVE_TTL_DAYS, journal=None):
+        self.file_cache = file_cache
+        self.journal = journal
+        self.providers = providers
+        self.provider_configs = {
+            'opensubtitles': {
+                'username': OPENSUBTITLES_USERNAME,
+                'password': OPENSUBTITLES_PASSWORD
+            }
+        }
+        self.workers = workers
+        self.rate_limiters = {provider: RateLimiter(rate, burst=1) for provider in providers}
+        self.negative_ttl = negative_ttl_days * 86400
+        self.downloaded = 0
+        self._queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools = []
+        self._cancelled = threading.Event()
 
-        output_filename = f"{os.path.splitext(filename)[0]}_processed{os.path.splitext(filename)[1]}"
-        output_file_path = os.path.join(movie_directory, output_filename)
+    def start(self):
+        """
+        Inicia as threads (na primeira chamada); a partir daqui, cada arquivo agendado com add()
+        é processado assim que possível.
+        """
+        self.downloaded = 0
+        self._cancelled.clear()
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"legendas-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
 
-        # --- Aplicar metadados ---
-        if filename.lower().endswith('.mp4'):
-            print("Aplicando metadados (MP4 com ffmpeg)...")
-            # Obter detalhes completos do filme para mais metadados
-            full_item_details = None
-            if is_series:
-                full_item_details = tv_api.details(selected_item.id)
-            else:
-                full_item_details = movie_api.details(selected_item.id)
+    def add(self, file_path, item_title, release_year, video_hash=None, video_size=None):
+        """
+        Agenda a busca de legenda para um arquivo, a menos que uma busca recente já tenha sido feita.
+        `video_hash` e `video_size` são o hash do OpenSubtitles e o tamanho do arquivo original
+        (antes da aplicação dos metadados, que altera o tamanho).
+        Retorna True se a busca foi agendada.
+        """
+        previous = self.file_cache.get(FileInfoCache.stat_key(file_path), 'subtitles')
+        if previous is not None:
+            if previous['found']:
+                print(f"Legenda já baixada anteriormente para '{item_title}'. Pulando.")
+                return False
+            if time.time() - previous['checked'] < self.negative_ttl:
+                print(f"Nenhuma legenda encontrada recentemente para '{item_title}'. Pulando nova busca.")
+                return False
+        self._queue.put((file_path, item_title, release_year, video_hash, video_size))
+        return True
 
-            # Extrair metadados adicionais
-            release_date = full_item_details.release_date if hasattr(full_item_details, 'release_date') else (
-                full_item_details.first_air_date if hasattr(full_item_details, 'first_air_date') else ''
-            )
-            genres = ', '.join([g.name for g in full_item_details.genres]) if hasattr(full_item_details,
-                                                                                       'genres') else ''
-
-            cmd = [
-                'ffmpeg', '-i', file_path,
-            ]
-            # Adicionar capa se existir
-            if temp_cover_path:
-                cmd.extend(['-i', temp_cover_path, '-map', '0', '-map', '1'])
-            
-            cmd.extend([
-                '-c', 'copy',
-                '-metadata', f'title={get_safe_title(selected_item)}',
-                '-metadata', f'date={release_date}',
-            ])
-
-            if temp_cover_path:
-                cmd.extend(['-c:v:1', 'mjpeg', '-disposition:v:1', 'attached_pic'])
-
-            cmd.append(output_file_path)
-
-            print(f"Comando ffmpeg: {' '.join(cmd)}")
+    def _pool(self):
+        # Cada thread mantém a sua sessão aberta até o fim do pipeline
+        pool = getattr(self._local, 'pool', None)
+        if pool is None:
+            pool = rate_limited_provider_pool()(self.rate_limiters, providers=self.providers,
+                                           provider_configs=self.provider_configs)
+            self._local.pool = pool
+            with self._lock:
+                self._pools.append(pool)
+        return pool
+
+    def _reset_pool(self):
+        # Um provedor descartado (limite de downloads, erro de autenticação...) não voltaria
+        # nesta sessão: encerrá-la e abrir outra no próximo arquivo
+        pool = self._local.pool
+        self._local.pool = None
+        with self._lock:
+            self._pools.remove(pool)
+        pool.terminate()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
             try:
-                result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-                print(f"Stdout ffmpeg: {result.stdout}")
-                print(f"Metadados aplicados com sucesso em: {output_filename}")
-                # Substituir o arquivo original pelo processado
-                original_file_backup_path = file_path + '.bak'
-                try:
-                    os.rename(file_path, original_file_backup_path)
-                    os.rename(output_file_path, file_path)
-                    print(f"Arquivo original renomeado para backup: {original_file_backup_path}")
-                    print(f"Arquivo processado renomeado para: {filename}")
-                except OSError as e:
-                    print(f"Erro ao substituir o arquivo: {e}")
-            except subprocess.CalledProcessError as e:
-                print(f"Erro ao aplicar metadados com ffmpeg: {e.stderr}")
-                print(f"Comando falhou: {e.cmd}")
-                print(f"Código de retorno: {e.returncode}")
-                print(f"Stdout do erro: {e.stdout}")
-                print(f"Stderr do erro: {e.stderr}")
-                print(f"Pulando processamento de metadados para {filename} devido ao erro do ffmpeg.")
-                continue # Skip to the next file in files_to_process
-
-            # Baixar legendas após aplicar metadados
-            audio_lang = get_audio_language(file_path)
-            if audio_lang == 'por':
-                print(f"Idioma de áudio detectado como Português ('por'). Pulando download de legendas para {filename}.")
-            elif has_embedded_subtitle(file_path, 'por'):
-                print(f"Legenda em Português (por) já embutida. Pulando download de legendas para {filename}.")
-            else:
-                item_title = get_safe_title(selected_item)
-                item_release_year = int(release_date.split('-')[0]) if release_date else None
-                if item_release_year:
-                    download_and_save_subtitle(file_path, item_title, item_release_year)
-
-        elif filename.lower().endswith('.mkv'):
-            print("Aplicando metadados (MKV com ffmpeg)...")
-            # Obter detalhes completos do filme para mais metadados
-            full_item_details = None
-            if is_series:
-                full_item_details = tv_api.details(selected_item.id)
-            else:
-                full_item_details = movie_api.details(selected_item.id)
+                if job is PIPELINE_DONE:
+                    break
+                if self._cancelled.is_set():
+                    continue  # Interrompido: o arquivo continua no diário para o --resume
+                if self._download(*job):
+                    with self._lock:
+                        self.downloaded += 1
+                if self.journal is not None:
+                    self.journal.finish(job[0])
+            finally:
+                self._queue.task_done()
 
-            # Extrair metadados adicionais
-            release_date = full_item_details.release_date if hasattr(full_item_details, 'release_date') else (
-                full_item_details.first_air_date if hasattr(full_item_details, 'first_air_date') else ''
-            )
-            genres = ', '.join([g.name for g in full_item_details.genres]) if hasattr(full_item_details,
-                                                                                       'genres') else ''
-
-            cmd = [
-                'ffmpeg', '-i', file_path,
-            ]
-            # Adicionar capa se existir
-            if temp_cover_path:
-                cmd.extend(['-i', temp_cover_path, '-map', '0', '-map', '1'])
-            
-            cmd.extend([
-                '-c', 'copy',
-                '-metadata', f'title={get_safe_title(selected_item)}',
-                '-metadata', f'date={release_date}',
-            ])
-
-            if temp_cover_path:
-                cmd.extend(['-c:v:1', 'mjpeg', '-disposition:v:1', 'attached_pic'])
-
-            cmd.append(output_file_path)
-
-            print(f"Comando ffmpeg: {' '.join(cmd)}")
+    def _download(self, file_path, item_title, release_year, video_hash, video_size):
+        print(f"Buscando legendas para '{item_title}' ({release_year})...")
+        try:
+            from subliminal import Video, save_subtitles
+            from babelfish import Language
+            # Criar um objeto Video para o subliminal, com metadados para busca mais precisa
+            video = Video.fromname(os.path.basename(file_path))
+            video.title = item_title
+            video.year = release_year
+            if video_hash and video_size:
+                # Com o hash e o tamanho (do arquivo original, como o hash), os provedores
+                # encontram a legenda exata do arquivo
+                video.size = video_size
+                video.hashes['opensubtitles'] = video_hash
+                video.hashes['opensubtitlescom'] = video_hash
+
+            pool = self._pool()
+            languages = {Language(*SUBTITLE_LANGUAGE)}
             try:
-                result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-                print(f"Stdout ffmpeg: {result.stdout}")
-                print(f"Metadados aplicados com sucesso em: {output_filename}")
-                # Substituir o arquivo original pelo processado
-                original_file_backup_path = file_path + '.bak'
-                try:
-                    os.rename(file_path, original_file_backup_path)
-                    os.rename(output_file_path, file_path)
-                    print(f"Arquivo original renomeado para backup: {original_file_backup_path}")
-                    print(f"Arquivo processado renomeado para: {filename}")
-                except OSError as e:
-                    print(f"Erro ao substituir o arquivo: {e}")
-            except subprocess.CalledProcessError as e:
-                print(f"Erro ao aplicar metadados com ffmpeg: {e.stderr}")
-                print(f"Comando falhou: {e.cmd}")
-                print(f"Código de retorno: {e.returncode}")
-                print(f"Stdout do erro: {e.stdout}")
-                print(f"Stderr do erro: {e.stderr}")
-                print(f"Pulando processamento de metadados para {filename} devido ao erro do ffmpeg.")
-                continue # Skip to the next file in files_to_process
-
-            # Baixar legendas após aplicar metadados
-            audio_lang = get_audio_language(file_path)
-            if audio_lang == 'por':
-                print(f"Idioma de áudio detectado como Português ('por'). Pulando download de legendas para {filename}.")
-            elif has_embedded_subtitle(file_path, 'por'):
-                print(f"Legenda em Português (por) já embutida. Pulando download de legendas para {filename}.")
+                with metrics.span('subtitle_download'):
+                    subtitles = pool.download_best_subtitles(pool.list_subtitles(video, languages), video, languages)
+                answered_all = pool.answered_all()
+            except Exception:
+                self._reset_pool()
+                raise
+            if not answered_all:
+                self._reset_pool()
+            found = bool(subtitles)
+            if found:
+                # Salvar a legenda na mesma pasta do vídeo
+                saved = save_subtitles(video, subtitles, directory=os.path.dirname(os.path.abspath(file_path)))
+                metrics.add_bytes('subtitle_download', sum(len(subtitle.content or b'') for subtitle in saved))
+                print(f"Legenda baixada e salva para '{item_title}'.")
+            elif answered_all:
+                print(f"Nenhuma legenda em português do Brasil encontrada para '{item_title}'.")
             else:
-                item_title = get_safe_title(selected_item)
-                item_release_year = int(release_date.split('-')[0]) if release_date else None
-                if item_release_year:
-                    download_and_save_subtitle(file_path, item_title, item_release_year)
+                print(f"Nenhuma legenda obtida para '{item_title}': um provedor falhou; a busca será repetida na próxima execução.")
+                return False
+            self.file_cache.set(FileInfoCache.stat_key(file_path), 'subtitles',
+                                {'found': found, 'checked': time.time()})
+            return found
+        except Exception as e:
+            print(f"Erro ao baixar legenda: {e}")
+            traceback.print_exc()
+            return False
 
-        else:
-            print("Formato de arquivo não suportado para aplicação de metadados (apenas MP4 e MKV).")
+    def cancel(self):
+        """
+        Descarta as buscas que ainda estão na fila (Ctrl-C); as que já começaram terminam.
+        """
+        self._cancelled.set()
+
+    def finish(self):
+        """
+        Aguarda as buscas agendadas, mantendo as sessões abertas para o próximo lote.
+        Retorna o número de legendas baixadas desde start().
+        """
+        self._queue.join()
+        return self.downloaded
+
+    def close(self):
+        """
+        Encerra as threads e as sessões com os provedores.
+        """
+        for _ in self._threads:
+            self._queue.put(PIPELINE_DONE)
+        try:
+            for thread in self._threads:
+                thread.join()
+        finally:
+            for pool in self._pools:
+                pool.terminate()
+            self._pools = []
+            self._threads = []
 
-        # --- Limpar arquivo temporário ---
-        if temp_cover_path and os.path.exists(temp_cover_path):
-            os.remove(temp_cover_path)
-            print(f"Arquivo temporário removido: {temp_cover_path}")
+
+def get_release_date(item_details):
+    """
+    Retorna a data de lançamento (filmes) ou de estreia (séries) de um item do TMDb, ou ''.
+    """
+    if hasattr(item_details, 'release_date'):
+        return item_details.release_date or ''
+    if hasattr(item_details, 'first_air_date'):
+        return item_details.first_air_date or ''
+    return ''
+
+
+def remux_with_ffmpeg(file_path, item_title, release_date, cover_path, series_info=None, journal=None):
+    """
+    Aplica título, data e capa gerando uma cópia do arquivo com ffmpeg (-c copy).
+    `series_info` é (série, temporada, episódio) para episódios, ou None.
+    O original é mantido como backup (.bak) e substituído pela cópia processada; um backup já
+    existente nunca é sobrescrito, pois é ele que guarda o original. Com o `journal`, o fim da cópia
+    é registrado antes da troca, para que ela possa ser concluída após uma interrupção.
+    Retorna True em caso de sucesso.
+    """
+    filename = os.path.basename(file_path)
+    output_filename = f"{os.path.splitext(filename)[0]}_processed{os.path.splitext(filename)[1]}"
+    output_file_path = os.path.join(os.path.dirname(file_path), output_filename)
+
+    cmd = [
+        'ffmpeg', '-i', file_path,
+    ]
+    # Adicionar capa se existir
+    if cover_path:
+        cmd.extend(['-i', cover_path, '-map', '0', '-map', '1'])
+
+    cmd.extend([
+        '-c', 'copy',
+        '-metadata', f'title={item_title}',
+        '-metadata', f'date={release_date}',
+    ])
+    if series_info:
+        show_name, season_number, episode_number = series_info
+        cmd.extend([
+            '-metadata', f'show={show_name}',
+            '-metadata', f'season_number={season_number}',
+            '-metadata', f'episode_sort={episode_number}',
+            '-metadata', f'episode_id=S{season_number:02d}E{episode_number:02d}',
+        ])
+
+    if cover_path:
+        cmd.extend(['-c:v:1', 'mjpeg', '-disposition:v:1', 'attached_pic'])
+
+    cmd.append(output_file_path)
+
+    print(f"Comando ffmpeg: {' '.join(cmd)}")
+    try:
+        with metrics.span('ffmpeg_remux'):
+            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        metrics.add_bytes('ffmpeg_remux', os.path.getsize(output_file_path))
+        print(f"Stdout ffmpeg: {result.stdout}")
+        print(f"Metadados aplicados com sucesso em: {output_filename}")
+    except subprocess.CalledProcessError as e:
+        print(f"Erro ao aplicar metadados com ffmpeg: {e.stderr}")
+        print(f"Comando falhou: {e.cmd}")
+        print(f"Código de retorno: {e.returncode}")
+        print(f"Stdout do erro: {e.stdout}")
+        print(f"Stderr do erro: {e.stderr}")
+        print(f"Pulando processamento de metadados para {filename} devido ao erro do ffmpeg.")
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        return False
+    except OSError as e:
+        # Ex: ffmpeg ausente do PATH ou disco cheio
+        print(f"Erro ao executar o ffmpeg: {e}")
+        print(f"Pulando processamento de metadados para {filename} devido ao erro do ffmpeg.")
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        return False
+
+    if journal is not None:
+        journal.mark(file_path, 'remux_written')
+    try:
+        shutil.copystat(file_path, output_file_path)
+        os.utime(output_file_path)
+        swap_with_backup(file_path, output_file_path)
+    except OSError as e:
+        print(f"Erro ao substituir o arquivo: {e}")
+        return False
+    print(f"Arquivo processado renomeado para: {filename}")
+    return True
+
+
+def swap_with_backup(file_path, output_file_path):
+    """
+    Substitui o arquivo pela saída processada, guardando o original em '.bak'. Se o backup já
+    existe, ele contém o original (de um remux anterior) e o arquivo atual é apenas substituído.
+    """
+    backup_path = file_path + '.bak'
+    if os.path.exists(file_path) and not os.path.exists(backup_path):
+        os.rename(file_path, backup_path)
+        print(f"Arquivo original renomeado para backup: {backup_path}")
+    os.replace(output_file_path, file_path)
+
+
+# --- EDIÇÃO DE METADADOS MKV ---
+# IDs EBML (com os bits de marcação) dos elementos de nível superior do Matroska
+MKV_EBML_ID = 0x1A45DFA3
+MKV_SEGMENT_ID = 0x18538067
+MKV_CLUSTER_ID = 0x1F43B675
+MKV_SEEKHEAD_ID = 0x114D9B74
+MKV_SEEK_ID = 0x4DBB
+MKV_SEEK_ELEMENT_ID = 0x53AB
+MKV_SEEK_POSITION_ID = 0x53AC
+# Elementos que o mkvpropedit pode reescrever (ou substituir por EbmlVoid ao movê-los)
+MKV_HEADER_ELEMENT_IDS = {
+    0x1549A966,  # Info
+    0x1654AE6B,  # Tracks
+    0x1043A770,  # Chapters
+    0x1254C367,  # Tags
+    0x1941A469,  # Attachments
+    MKV_SEEKHEAD_ID,
+}
+MKV_UNDO_MAX_BYTES = 32 * 1024 * 1024  # Acima disso, a edição não é protegida pelo diário (recorre ao remux)
+
+
+def read_ebml_vint(data, offset, keep_marker=False):
+    """
+    Lê um inteiro de tamanho variável do EBML. Retorna (valor, comprimento); com `keep_marker`
+    (IDs de elementos), o bit de marcação é mantido. Um tamanho "desconhecido" retorna None.
+    """
+    first = data[offset]
+    if first == 0:
+        raise ValueError(f"Inteiro EBML inválido na posição {offset}")
+    length = 9 - first.bit_length()
+    if offset + length > len(data):
+        raise ValueError(f"Inteiro EBML truncado na posição {offset}")
+    value = int.from_bytes(data[offset:offset + length], 'big')
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    return (None if value == (1 << (7 * length)) - 1 else value), length
+
+
+def read_ebml_element_header(f, offset):
+    """
+    Lê o cabeçalho do elemento na posição `offset`. Retorna (id, tamanho do cabeçalho, tamanho dos dados).
+    """
+    f.seek(offset)
+    header = f.read(12)
+    element_id, id_length = read_ebml_vint(header, 0, keep_marker=True)
+    size, size_length = read_ebml_vint(header, id_length)
+    return element_id, id_length + size_length, size
+
+
+def iter_ebml_elements(data, start, end):
+    """
+    Percorre os elementos contidos em data[start:end]. Gera (id, início dos dados, tamanho).
+    """
+    offset = start
+    while offset < end:
+        element_id, id_length = read_ebml_vint(data, offset, keep_marker=True)
+        size, size_length = read_ebml_vint(data, offset + id_length)
+        data_start = offset + id_length + size_length
+        if size is None or data_start + size > end:
+            raise ValueError(f"Elemento EBML inválido na posição {offset}")
+        yield element_id, data_start, size
+        offset = data_start + size
+
+
+def mkv_edit_regions(f, file_size):
+    """
+    Localiza os trechos do arquivo que o mkvpropedit pode reescrever, lendo apenas cabeçalhos:
+    o início do arquivo até o primeiro Cluster (cabeçalho EBML, tamanho do Segment, SeekHead,
+    Info, Tracks, Tags, anexos e EbmlVoid) e, se o SeekHead indicar elementos de cabeçalho depois
+    dos clusters, o trecho do primeiro deles até o fim do arquivo. Retorna [(posição, comprimento)].
+    """
+    element_id, header_length, size = read_ebml_element_header(f, 0)
+    if element_id != MKV_EBML_ID or size is None:
+        raise ValueError("cabeçalho EBML ausente")
+    offset = header_length + size
+    element_id, header_length, segment_size = read_ebml_element_header(f, offset)
+    if element_id != MKV_SEGMENT_ID:
+        raise ValueError("Segment ausente")
+    segment_start = offset + header_length
+    segment_end = file_size if segment_size is None else min(file_size, segment_start + segment_size)
+
+    seek_heads = []
+    offset = segment_start
+    while offset < segment_end:
+        element_id, header_length, size = read_ebml_element_header(f, offset)
+        if element_id == MKV_CLUSTER_ID or size is None:
+            break
+        if element_id == MKV_SEEKHEAD_ID:
+            seek_heads.append(offset)
+        offset += header_length + size
+    head_end = min(offset, file_size)
+
+    # Elementos de cabeçalho gravados depois dos clusters (inclusive num segundo SeekHead)
+    tail_start = None
+    visited = set()
+    while seek_heads:
+        seek_head = seek_heads.pop()
+        if seek_head in visited:
+            continue
+        visited.add(seek_head)
+        _, header_length, size = read_ebml_element_header(f, seek_head)
+        f.seek(seek_head + header_length)
+        data = f.read(size)
+        for element_id, start, length in iter_ebml_elements(data, 0, len(data)):
+            if element_id != MKV_SEEK_ID:
+                continue
+            entry = {child_id: data[child_start:child_start + child_length]
+                     for child_id, child_start, child_length in iter_ebml_elements(data, start, start + length)}
+            target_id = int.from_bytes(entry.get(MKV_SEEK_ELEMENT_ID, b''), 'big')
+            position = segment_start + int.from_bytes(entry.get(MKV_SEEK_POSITION_ID, b''), 'big')
+            if target_id not in MKV_HEADER_ELEMENT_IDS or not head_end <= position < file_size:
+                continue
+            tail_start = position if tail_start is None else min(tail_start, position)
+            if target_id == MKV_SEEKHEAD_ID:
+                seek_heads.append(position)
+
+    regions = [(0, head_end)]
+    if tail_start is not None:
+        regions.append((tail_start, file_size - tail_start))
+    return regions
+
+
+def apply_mkv_metadata(file_path, item_title, release_date, cover_path, series_info=None, journal=None):
+    """
+    Aplica título, data e capa diretamente no arquivo MKV com mkvpropedit.
+    Para episódios (`series_info` = (série, temporada, episódio)), também grava as etiquetas
+    de coleção (70), temporada (60) e episódio (50).
+    Apenas os elementos de cabeçalho (Segment Info, Tags e Attachments) são reescritos, no próprio
+    arquivo. Com o `journal`, os trechos que o mkvpropedit pode alterar (mkv_edit_regions) ficam
+    guardados no diário antes da edição, que é desfeita se falhar ou for interrompida.
+    Retorna False se o mkvpropedit não estiver disponível ou não conseguir editar o arquivo
+    (o chamador recorre ao remux).
+    """
+    from xml.sax.saxutils import escape as xml_escape
+    item_tags = (
+        f'<Simple><Name>TITLE</Name><String>{xml_escape(item_title)}</String></Simple>'
+        f'<Simple><Name>DATE_RELEASED</Name><String>{xml_escape(release_date)}</String></Simple>'
+    )
+    series_tags = ''
+    if series_info:
+        show_name, season_number, episode_number = series_info
+        item_tags += f'<Simple><Name>PART_NUMBER</Name><String>{episode_number}</String></Simple>'
+        series_tags = (
+            '<Tag><Targets><TargetTypeValue>70</TargetTypeValue></Targets>'
+            f'<Simple><Name>TITLE</Name><String>{xml_escape(show_name)}</String></Simple></Tag>'
+            '<Tag><Targets><TargetTypeValue>60</TargetTypeValue></Targets>'
+            f'<Simple><Name>PART_NUMBER</Name><String>{season_number}</String></Simple></Tag>'
+        )
+    tags_xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Tags>{series_tags}<Tag><Targets><TargetTypeValue>50</TargetTypeValue></Targets>{item_tags}</Tag></Tags>\n'
+    )
+    if shutil.which('mkvpropedit') is None:
+        log.warning("mkvpropedit não encontrado no PATH (instale o mkvtoolnix).")
+        return False
+    undo = None
+    if journal is not None:
+        try:
+            with open(file_path, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                undo = []
+                for offset, length in mkv_edit_regions(f, file_size):
+                    f.seek(offset)
+                    undo.append((offset, f.read(length)))
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Estrutura MKV não reconhecida: {e}")
+            return False
+        if sum(len(data) for _, data in undo) > MKV_UNDO_MAX_BYTES:
+            print("Cabeçalho MKV grande demais para ser guardado no diário.")
+            return False
+        journal.save_undo(file_path, file_size, undo)
+    with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False, encoding='utf-8') as tags_file:
+        tags_file.write(tags_xml)
+
+    cmd = [
+        'mkvpropedit', file_path,
+        '--edit', 'info', '--set', f'title={item_title}',
+        '--tags', f'global:{tags_file.name}',
+    ]
+    try:
+        if cover_path:
+            # Substituir a capa existente; se o arquivo ainda não tiver uma, adicioná-la
+            cover_args = ['--attachment-name', MKV_COVER_NAME, '--attachment-mime-type', 'image/jpeg']
+            result = run_mkvpropedit(cmd + cover_args + ['--replace-attachment', f'name:{MKV_COVER_NAME}:{cover_path}'])
+            if result is not None and result.returncode > 1:
+                if undo is not None:
+                    journal.restore_undo(file_path)
+                    journal.save_undo(file_path, file_size, undo)
+                result = run_mkvpropedit(cmd + cover_args + ['--add-attachment', cover_path])
+        else:
+            result = run_mkvpropedit(cmd)
+    finally:
+        os.remove(tags_file.name)
+
+    # Código 1 indica apenas avisos; o arquivo foi modificado normalmente
+    if result is not None and result.returncode > 1:
+        print(f"Erro ao aplicar metadados com mkvpropedit: {result.stdout.strip()}")
+    try:
+        if result is None or result.returncode > 1:
+            if undo is not None:
+                journal.restore_undo(file_path)
+            return False
+        if undo is not None:
+            # O mkvpropedit não sincroniza o arquivo: os trechos guardados só são descartados depois
+            with open(file_path, 'rb') as f:
+                os.fsync(f.fileno())
+            journal.clear_undo(file_path)
+    except OSError as e:
+        print(f"Erro ao concluir a edição do MKV: {e}")
+        return False
+    print(f"Metadados aplicados com sucesso em: {os.path.basename(file_path)}")
+    return True
+
+
+def run_mkvpropedit(cmd):
+    print(f"Comando mkvpropedit: {' '.join(cmd)}")
+    try:
+        with metrics.span('mkvpropedit'):
+            return subprocess.run(cmd, capture_output=True, text=True)
+    except FileNotFoundError:
+        log.warning("mkvpropedit não encontrado no PATH (instale o mkvtoolnix).")
+        return None
+
+
+# --- EDIÇÃO DE METADADOS MP4 ---
+# Caixas (atoms) que contêm outras caixas e precisam ser percorridas para achar stco/co64
+MP4_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf', b'mvex'}
+MP4_PADDING = 4096  # Espaço livre reservado após o moov para edições futuras sem deslocar o mdat
+
+
+def mp4_box(box_type, payload):
+    """
+    Monta uma caixa MP4 (tamanho de 32 bits + tipo + conteúdo).
+    """
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def mp4_free_box(size):
+    return struct.pack('>I4s', size, b'free') + b'\0' * (size - 8)
+
+
+def iter_mp4_boxes(data, start, end):
+    """
+    Percorre as caixas contidas em data[start:end].
+    Gera (tipo, início, tamanho, tamanho_do_cabeçalho).
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_len = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_len = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_len or offset + size > end:
+            raise ValueError(f"Caixa MP4 inválida '{box_type!r}' na posição {offset}")
+        yield box_type, offset, size, header_len
+        offset += size
+
+
+def read_mp4_top_level_boxes(f, file_size):
+    """
+    Lê apenas os cabeçalhos das caixas de nível superior do arquivo (sem ler o mdat).
+    Retorna uma lista de (tipo, início, tamanho).
+    """
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise ValueError(f"Caixa MP4 inválida '{box_type!r}' na posição {offset}")
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def mp4_ilst_item(item_type, data_type, value):
+    """
+    Monta um item do ilst com sua caixa 'data' (tipo 1 = UTF-8, 13 = JPEG, 14 = PNG).
+    """
+    return mp4_box(item_type, mp4_box(b'data', struct.pack('>II', data_type, 0) + value))
+
+
+def build_mp4_meta(old_meta, item_title, release_date, cover_data, series_info=None):
+    """
+    Monta uma nova caixa udta/meta com o ilst atualizado (©nam, ©day e covr; para episódios
+    também tvsh, tvsn, tves e stik), preservando os demais itens de um ilst existente no
+    formato do iTunes (mdir).
+    """
+    kept_items = []
+    if old_meta is not None:
+        # No formato ISO o 'meta' tem versão/flags; no QuickTime os filhos começam logo após o cabeçalho
+        children_start = 8 if old_meta[12:16] == b'hdlr' else 12
+        children = {box_type: old_meta[offset:offset + size]
+                    for box_type, offset, size, _ in iter_mp4_boxes(old_meta, children_start, len(old_meta))}
+        hdlr = children.get(b'hdlr', b'')
+        if b'ilst' in children and hdlr[16:20] == b'mdir':
+            ilst = children[b'ilst']
+            replaced = {b'\xa9nam', b'\xa9day'} | ({b'covr'} if cover_data else set())
+            if series_info:
+                replaced |= {b'tvsh', b'tvsn', b'tves', b'stik'}
+            kept_items = [ilst[offset:offset + size]
+                          for box_type, offset, size, _ in iter_mp4_boxes(ilst, 8, len(ilst))
+                          if box_type not in replaced]
+
+    items = [mp4_ilst_item(b'\xa9nam', 1, item_title.encode('utf-8'))]
+    if release_date:
+        items.append(mp4_ilst_item(b'\xa9day', 1, release_date.encode('utf-8')))
+    if series_info:
+        show_name, season_number, episode_number = series_info
+        items.append(mp4_ilst_item(b'tvsh', 1, show_name.encode('utf-8')))
+        items.append(mp4_ilst_item(b'tvsn', 21, struct.pack('>i', season_number)))
+        items.append(mp4_ilst_item(b'tves', 21, struct.pack('>i', episode_number)))
+        items.append(mp4_ilst_item(b'stik', 21, b'\x0a')) # 10 = Programa de TV
+    items.extend(kept_items)
+    if cover_data:
+        cover_type = 14 if cover_data.startswith(b'\x89PNG') else 13
+        items.append(mp4_ilst_item(b'covr', cover_type, cover_data))
+
+    hdlr = mp4_box(b'hdlr', b'\0' * 8 + b'mdirappl' + b'\0' * 9)
+    return mp4_box(b'meta', b'\0' * 4 + hdlr + mp4_box(b'ilst', b''.join(items)))
+
+
+def build_mp4_moov(moov, item_title, release_date, cover_data, series_info=None):
+    """
+    Reconstrói o moov substituindo apenas udta/meta; as demais caixas são copiadas sem alterações.
+    """
+    children = []
+    udta_found = False
+    for box_type, offset, size, header_len in iter_mp4_boxes(moov, 8, len(moov)):
+        box = moov[offset:offset + size]
+        if box_type == b'udta':
+            udta_found = True
+            udta_children = []
+            old_meta = None
+            for child_type, child_offset, child_size, _ in iter_mp4_boxes(box, header_len, len(box)):
+                child = box[child_offset:child_offset + child_size]
+                if child_type == b'meta':
+                    old_meta = child
+                else:
+                    udta_children.append(child)
+            udta_children.append(build_mp4_meta(old_meta, item_title, release_date, cover_data, series_info))
+            box = mp4_box(b'udta', b''.join(udta_children))
+        children.append(box)
+    if not udta_found:
+        children.append(mp4_box(b'udta', build_mp4_meta(None, item_title, release_date, cover_data, series_info)))
+    return bytearray(mp4_box(b'moov', b''.join(children)))
+
+
+def patch_mp4_chunk_offsets(moov, start, end, threshold, delta):
+    """
+    Soma `delta` às posições de chunk (stco/co64) que apontam para depois de `threshold`.
+    Retorna False se alguma posição não couber mais em 32 bits (stco).
+    """
+    for box_type, offset, size, header_len in iter_mp4_boxes(moov, start, end):
+        if box_type in MP4_CONTAINER_BOXES:
+            if not patch_mp4_chunk_offsets(moov, offset + header_len, offset + size, threshold, delta):
+                return False
+        elif box_type in (b'stco', b'co64'):
+            entry_format = '>I' if box_type == b'stco' else '>Q'
+            entry_size = struct.calcsize(entry_format)
+            entry_count = struct.unpack_from('>I', moov, offset + header_len + 4)[0]
+            entries_start = offset + header_len + 8
+            for i in range(entry_count):
+                position = entries_start + i * entry_size
+                chunk_offset = struct.unpack_from(entry_format, moov, position)[0]
+                if chunk_offset >= threshold:
+                    chunk_offset += delta
+                    if box_type == b'stco' and chunk_offset > 0xFFFFFFFF:
+                        return False
+                    struct.pack_into(entry_format, moov, position, chunk_offset)
+    return True
+
+
+def write_in_place(file_path, edits, truncate_at=None, journal=None):
+    """
+    Grava `edits` ((posição, dados)) no próprio arquivo, sem cópia, e o ajusta para `truncate_at`
+    bytes, se indicado. Com o `journal`, os trechos que serão sobrescritos (e o tamanho original)
+    ficam gravados no diário antes da primeira escrita: se a edição falhar, eles são restaurados
+    na hora, e se o processo for interrompido, na próxima execução (JobJournal.recover).
+    Retorna o número de bytes gravados.
+    """
+    with open(file_path, 'r+b') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if journal is not None:
+            regions = []
+            for offset, data in edits:
+                if offset < file_size:
+                    f.seek(offset)
+                    regions.append((offset, f.read(min(len(data), file_size - offset))))
+            if truncate_at is not None and truncate_at < file_size:
+                f.seek(truncate_at)
+                regions.append((truncate_at, f.read()))
+            journal.save_undo(file_path, file_size, regions)
+        try:
+            for offset, data in edits:
+                f.seek(offset)
+                f.write(data)
+            if truncate_at is not None:
+                f.truncate(truncate_at)
+            f.flush()
+            os.fsync(f.fileno())
+        except OSError:
+            if journal is not None:
+                f.close()
+                journal.restore_undo(file_path)
+            raise
+    if journal is not None:
+        journal.clear_undo(file_path)
+    return sum(len(data) for _, data in edits)
+
+
+def replace_with_edited_copy(file_path, temp_path):
+    """
+    Troca o arquivo pela cópia editada (no mesmo diretório) de forma atômica, mantendo as
+    permissões e os atributos estendidos do original. O mtime passa a ser o atual: o conteúdo
+    mudou, e é por ele que os servidores de mídia percebem a alteração.
+    """
+    shutil.copystat(file_path, temp_path)
+    os.utime(temp_path)
+    os.replace(temp_path, file_path)
+
+
+def apply_mp4_metadata(file_path, item_title, release_date, cover_path, series_info=None, journal=None):
+    """
+    Aplica título, data e capa reescrevendo apenas moov/udta/meta/ilst, sem reprocessar o mdat.
+    - Se o novo moov couber no espaço do antigo (mais caixas 'free' seguintes), é gravado no lugar.
+    - Se o moov estiver após o mdat, é regravado no fim do arquivo (ou anexado ao final).
+    Nesses casos só os bytes do moov são gravados, no próprio arquivo; com o `journal`, os trechos
+    sobrescritos ficam guardados no diário para desfazer uma edição interrompida (write_in_place).
+    - Se o moov vier antes do mdat e crescer, o arquivo é regravado numa cópia '_processed' com
+      folga ('free'), que substitui o original, e as posições de stco/co64 são corrigidas; a folga
+      evita esse custo nas próximas edições.
+    Retorna False se o arquivo não puder ser editado (o chamador recorre ao remux com ffmpeg).
+    """
+    cover_data = None
+    if cover_path:
+        with open(cover_path, 'rb') as cover_file:
+            cover_data = cover_file.read()
+
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            boxes = read_mp4_top_level_boxes(f, file_size)
+            box_types = [box[0] for box in boxes]
+            if b'moov' not in box_types or b'mdat' not in box_types:
+                print("Estrutura MP4 não reconhecida (moov/mdat ausente).")
+                return False
+            moov_index = box_types.index(b'moov')
+            _, moov_offset, moov_size = boxes[moov_index]
+            f.seek(moov_offset)
+            moov = f.read(moov_size)
+        new_moov = build_mp4_moov(moov, item_title, release_date, cover_data, series_info)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Erro ao editar metadados MP4: {e}")
+        return False
+
+    # Espaço disponível: o moov atual mais as caixas 'free'/'skip' logo em seguida
+    available = moov_size
+    for box_type, _, size in boxes[moov_index + 1:]:
+        if box_type not in (b'free', b'skip'):
+            break
+        available += size
+    padding = available - len(new_moov)
+    mdat_offsets = [offset for box_type, offset, _ in boxes if box_type == b'mdat']
+    # Gravações (posição, dados) no próprio arquivo; None = regravar deslocando o mdat
+    edits = None
+    truncate_at = None
+    if padding == 0 or padding >= 8:
+        edits = [(moov_offset, new_moov + (mp4_free_box(padding) if padding else b''))]
+    elif moov_offset > max(mdat_offsets):
+        if moov_offset + available == file_size:
+            # moov é a última caixa: regravar a partir da posição atual
+            edits = [(moov_offset, new_moov + mp4_free_box(MP4_PADDING))]
+            truncate_at = moov_offset + len(new_moov) + MP4_PADDING
+        else:
+            # Anexar o novo moov ao final e só depois transformar o antigo em 'free'
+            edits = [(file_size, new_moov + mp4_free_box(MP4_PADDING)), (moov_offset + 4, b'free')]
+    elif b'moof' in box_types:
+        print("MP4 fragmentado com moov no início: edição no próprio arquivo não suportada.")
+        return False
+    else:
+        # moov antes do mdat e sem espaço: regravar com folga, deslocando o restante do arquivo
+        new_moov += mp4_free_box(MP4_PADDING)
+        delta = len(new_moov) - available
+        if not patch_mp4_chunk_offsets(new_moov, 8, struct.unpack_from('>I', new_moov)[0],
+                                       moov_offset + moov_size, delta):
+            print("Posições de chunk excedem 32 bits após o deslocamento.")
+            return False
+
+    if edits is not None:
+        try:
+            metrics.add_bytes('mp4_edit', write_in_place(file_path, edits, truncate_at, journal))
+        except OSError as e:
+            print(f"Erro ao gravar os metadados MP4: {e}")
+            return False
+        print(f"Metadados aplicados no próprio arquivo: {os.path.basename(file_path)}")
+        return True
+
+    print(f"O moov cresceu além do espaço livre; regravando o arquivo com {MP4_PADDING} bytes de folga...")
+    temp_path = f"{os.path.splitext(file_path)[0]}_processed{os.path.splitext(file_path)[1]}"
+    try:
+        with open(file_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            dst.write(src.read(moov_offset))
+            dst.write(new_moov)
+            src.seek(moov_offset + available)
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            dst.flush()
+            os.fsync(dst.fileno())
+        metrics.add_bytes('mp4_edit', os.path.getsize(temp_path))
+        replace_with_edited_copy(file_path, temp_path)
+    except OSError as e:
+        print(f"Erro ao regravar o arquivo MP4: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    print(f"Metadados aplicados com o arquivo regravado: {os.path.basename(file_path)}")
+    return True
+
+
+def download_subtitles_if_needed(file_path, item_title, release_date, profile, video_hash, video_size,
+                                 subtitle_downloader):
+    """
+    Agenda o download de legendas em português, a menos que o áudio já seja em português
+    ou o arquivo já tenha uma legenda em português embutida (segundo o MediaProfile).
+    Retorna True se o download foi agendado.
+    """
+    filename = os.path.basename(file_path)
+    if profile is None:
+        print(f"Não foi possível analisar as trilhas de {filename}. Pulando download de legendas.")
+    elif profile.audio_language == 'por':
+        print(f"Idioma de áudio detectado como Português ('por'). Pulando download de legendas para {filename}.")
+    elif profile.has_subtitle('por'):
+        print(f"Legenda em Português (por) já embutida. Pulando download de legendas para {filename}.")
+    else:
+        item_release_year = int(release_date.split('-')[0]) if release_date else None
+        if item_release_year:
+            return subtitle_downloader.add(file_path, item_title, item_release_year, video_hash, video_size)
+    return False
+
+
+# --- VARREDURA INCREMENTAL DA BIBLIOTECA ---
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.mov')
+# Formatos em que os metadados podem ser aplicados; os demais vídeos ficam fora da varredura, já que
+# nunca chegariam ao registro e seriam buscados no TMDb (e reenfileirados) a cada execução
+TAGGABLE_EXTENSIONS = ('.mkv', '.mp4')
+# Versão das etiquetas aplicadas; aumente quando a forma de aplicar metadados mudar
+# para que os arquivos já processados sejam tratados novamente
+TAG_VERSION = 2
+
+
+def is_temporary_output(filename):
+    """
+    Indica se o arquivo é uma saída intermediária do remux (ex: 'Filme_processed.mkv').
+    """
+    return os.path.splitext(filename)[0].endswith('_processed')
+
+
+def is_taggable_video(filename):
+    """
+    Indica se o vídeo está em um formato em que os metadados podem ser aplicados (MP4 ou MKV).
+    """
+    return filename.lower().endswith(TAGGABLE_EXTENSIONS)
+
+
+def scan_video_files(root):
+    """
+    Percorre recursivamente o diretório com os.scandir, gerando (caminho, stat) para cada
+    arquivo de vídeo MP4 ou MKV. Os diretórios são visitados em ordem alfabética, sem seguir links simbólicos.
+    """
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as e:
+        log.warning(f"Não foi possível ler o diretório '{root}': {e}")
+        return
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_video_files(entry.path)
+        elif is_taggable_video(entry.name) and entry.is_file():
+            if is_temporary_output(entry.name):
+                log.info(f"Arquivo intermediário '{entry.name}' ignorado.")
+                continue
+            yield entry.path, entry.stat()
+
+
+class LibraryManifest:
+    """
+    Registro persistente (SQLite) dos arquivos já processados: caminho, inode, tamanho,
+    mtime, id do TMDb e versão das etiquetas aplicadas. Um arquivo cujo estado coincide
+    com o registro é pulado sem nenhuma análise ou chamada de rede.
+    """
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'manifest.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS manifest ('
+            ' path TEXT PRIMARY KEY,'
+            ' ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' tmdb_id INTEGER, media_type TEXT,'
+            ' tag_version INTEGER NOT NULL,'
+            ' updated REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def is_unchanged(self, file_path, st):
+        """
+        Consulta o registro de um arquivo (pela chave primária, sem carregar o registro inteiro em memória).
+        """
+        with self._lock:
+            entry = self._conn.execute('SELECT ino, size, mtime_ns, tag_version FROM manifest WHERE path = ?',
+                                       (os.path.abspath(file_path),)).fetchone()
+        return entry == (st.st_ino, st.st_size, st.st_mtime_ns, TAG_VERSION)
+
+    def record(self, file_path, tmdb_id, media_type):
+        """
+        Registra o arquivo como processado, com o seu estado atual (após a aplicação dos metadados).
+        """
+        file_path = os.path.abspath(file_path)
+        st = os.stat(file_path)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO manifest (path, ino, size, mtime_ns, tmdb_id, media_type, tag_version, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_path, st.st_ino, st.st_size, st.st_mtime_ns, tmdb_id, media_type, TAG_VERSION, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- DIÁRIO DE PROCESSAMENTO (RETOMADA APÓS INTERRUPÇÕES) ---
+class JobJournal:
+    """
+    Diário persistente (SQLite, gravado antes de cada etapa) da aplicação dos metadados.
+    Cada arquivo confirmado é registrado com o id do TMDb escolhido e avança pelas etapas
+    'confirmed' -> 'tagging' -> ('remux_written') -> 'tagged'; ao terminar (incluindo a legenda),
+    o registro é removido. Depois de uma interrupção, os registros restantes indicam exatamente
+    quais arquivos ficaram pela metade e em que ponto. Um erro inesperado leva o arquivo para
+    'failed': ele não é retomado e volta a ser processado normalmente na próxima execução.
+    As edições feitas no próprio arquivo (MP4 e mkvpropedit) guardam antes, na tabela 'undo',
+    os trechos que serão sobrescritos e o tamanho original, para que possam ser desfeitas.
+    """
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'journal.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Cada transição precisa estar no disco antes de a etapa começar
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' path TEXT PRIMARY KEY,'
+            ' stage TEXT NOT NULL,'
+            ' tmdb_id INTEGER, media_type TEXT,'
+            ' payload TEXT NOT NULL,'
+            ' updated REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS undo ('
+            ' path TEXT NOT NULL,'
+            ' file_size INTEGER NOT NULL,'
+            ' offset INTEGER NOT NULL,'
+            ' data BLOB NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS undo_path ON undo (path)')
+        self._conn.commit()
+
+    def confirm(self, item):
+        """
+        Registra um arquivo confirmado, com o resultado da busca (para não repetir a busca ao retomar).
+        """
+        payload = {'tmdb_title': item.tmdb_title, 'poster_path': item.poster_path,
+                   'release_date': item.release_date, 'language': item.language}
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO jobs (path, stage, tmdb_id, media_type, payload, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(item.file_path), 'confirmed', item.tmdb_id,
+                 'tv' if item.release.is_series else 'movie', json.dumps(payload), time.time())
+            )
+            self._conn.commit()
+
+    def mark(self, file_path, stage, **updates):
+        """
+        Avança o arquivo para a etapa `stage`, acrescentando `updates` aos dados guardados.
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute('SELECT payload FROM jobs WHERE path = ?', (file_path,)).fetchone()
+            if row is None:
+                return
+            payload = json.loads(row[0])
+            payload.update(updates)
+            self._conn.execute('UPDATE jobs SET stage = ?, payload = ?, updated = ? WHERE path = ?',
+                               (stage, json.dumps(payload), time.time(), file_path))
+            self._conn.commit()
+
+    def fail(self, file_path, error):
+        """
+        Marca o arquivo como 'failed', guardando o erro. Um remux já gravado ('remux_written') é
+        mantido como está, pois recover() ainda pode concluir a troca.
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute('SELECT stage, payload FROM jobs WHERE path = ?', (file_path,)).fetchone()
+            if row is None or row[0] == 'remux_written':
+                return
+            payload = json.loads(row[1])
+            payload['error'] = error
+            self._conn.execute("UPDATE jobs SET stage = 'failed', payload = ?, updated = ? WHERE path = ?",
+                               (json.dumps(payload), time.time(), file_path))
+            self._conn.commit()
+
+    def finish(self, file_path):
+        """
+        Remove o registro de um arquivo concluído (ou que falhou sem deixar nada pela metade).
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE path = ?', (os.path.abspath(file_path),))
+            self._conn.commit()
+
+    def pending(self, include_failed=False):
+        """
+        Retorna [(caminho, etapa, tmdb_id, dados)] dos arquivos que não terminaram; os que falharam
+        só entram com `include_failed`.
+        """
+        query = 'SELECT path, stage, tmdb_id, payload FROM jobs'
+        if not include_failed:
+            query += " WHERE stage != 'failed'"
+        with self._lock:
+            rows = self._conn.execute(query + ' ORDER BY path').fetchall()
+        return [(path, stage, tmdb_id, json.loads(payload)) for path, stage, tmdb_id, payload in rows]
+
+    def save_undo(self, file_path, file_size, regions):
+        """
+        Guarda (já no disco, antes de a edição começar) os trechos ((posição, bytes)) do arquivo que
+        uma edição no próprio arquivo vai sobrescrever e o tamanho original do arquivo.
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            self._conn.execute('DELETE FROM undo WHERE path = ?', (file_path,))
+            self._conn.executemany('INSERT INTO undo (path, file_size, offset, data) VALUES (?, ?, ?, ?)',
+                                   [(file_path, file_size, offset, data) for offset, data in regions])
+            self._conn.commit()
+
+    def clear_undo(self, file_path):
+        """
+        Descarta os trechos guardados depois que a edição terminou (e foi gravada no disco).
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM undo WHERE path = ?', (os.path.abspath(file_path),))
+            self._conn.commit()
+
+    def restore_undo(self, file_path):
+        """
+        Desfaz uma edição interrompida: regrava os trechos guardados e devolve o arquivo ao tamanho
+        original. Retorna True se havia uma edição a desfazer.
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            rows = self._conn.execute('SELECT file_size, offset, data FROM undo WHERE path = ?',
+                                      (file_path,)).fetchall()
+        if not rows:
+            return False
+        with open(file_path, 'r+b') as f:
+            for _, offset, data in rows:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(rows[0][0])
+            f.flush()
+            os.fsync(f.fileno())
+        self.clear_undo(file_path)
+        return True
+
+    def recover(self):
+        """
+        Arruma o que uma interrupção deixou pela metade no disco:
+        - edição no próprio arquivo (MP4 ou mkvpropedit) interrompida: os trechos sobrescritos são
+          restaurados a partir da tabela 'undo';
+        - remux concluído pelo ffmpeg mas não trocado pelo original: a troca é concluída, sem
+          sobrescrever um backup '.bak' já existente;
+        - saídas '_processed' incompletas: são removidas (o original continua intacto).
+        Arquivos que não existem mais saem do diário. Retorna o número de arquivos ainda pendentes
+        (os que falharam não contam).
+        """
+        with self._lock:
+            undo_paths = [row[0] for row in self._conn.execute('SELECT DISTINCT path FROM undo').fetchall()]
+        for file_path in undo_paths:
+            try:
+                if not os.path.exists(file_path):
+                    self.clear_undo(file_path)
+                elif self.restore_undo(file_path):
+                    print(f"Edição interrompida desfeita: {os.path.basename(file_path)}")
+            except OSError as e:
+                log.error(f"Erro ao desfazer a edição de '{os.path.basename(file_path)}': {e}")
+        for file_path, stage, _, _ in self.pending(include_failed=True):
+            name, ext = os.path.splitext(file_path)
+            processed_path = f"{name}_processed{ext}"
+            try:
+                if stage == 'remux_written' and os.path.exists(processed_path):
+                    # O ffmpeg terminou: concluir a troca (o original vai para o backup, se ainda não foi)
+                    swap_with_backup(file_path, processed_path)
+                    print(f"Remux interrompido concluído: {os.path.basename(file_path)}")
+                    self.mark(file_path, 'tagged')
+                elif stage in ('confirmed', 'tagging', 'failed') and os.path.exists(processed_path):
+                    os.remove(processed_path)
+                    print(f"Saída incompleta removida: {os.path.basename(processed_path)}")
+                if not os.path.exists(file_path):
+                    log.warning(f"Arquivo do diário não encontrado: {file_path}")
+                    self.finish(file_path)
+            except OSError as e:
+                log.error(f"Erro ao recuperar '{os.path.basename(file_path)}': {e}")
+        return len(self.pending())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- MODO DE OBSERVAÇÃO (--watch) ---
+WATCH_SETTLE_SECONDS = 5.0  # Tempo sem mudança de tamanho/mtime para considerar um arquivo completo
+WATCH_CHECK_SECONDS = 1.0   # Intervalo de verificação dos arquivos ainda em cópia
+WATCH_POLL_SECONDS = 30.0   # Intervalo entre varreduras quando o inotify não está disponível
+
+# Constantes do inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (seguido do nome)
+
+
+def is_watched_video(path):
+    """
+    Indica se o caminho é um arquivo de vídeo que o modo de observação deve tratar.
+    """
+    name = os.path.basename(path)
+    return not name.startswith('.') and is_taggable_video(name) and not is_temporary_output(name)
+
+
+def stat_video_files(paths):
+    """
+    Gera (caminho, stat) para uma lista de arquivos, como scan_video_files, ignorando os que sumiram.
+    """
+    for path in paths:
+        try:
+            yield path, os.stat(path)
+        except OSError:
+            continue
+
+
+class InotifyWatcher:
+    """
+    Observa a árvore de diretórios com o inotify do Linux (via ctypes). A thread fica bloqueada
+    no descritor até o kernel avisar de uma mudança, então o processo não consome CPU ocioso.
+    Novos subdiretórios passam a ser observados assim que aparecem.
+    """
+
+    def __init__(self, root):
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches = {}
+        self._add_tree(root)
+
+    def _add_tree(self, root):
+        import ctypes
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            wd = self._add_watch(self.fd, os.fsencode(dirpath), INOTIFY_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                log.warning(f"Não foi possível observar '{dirpath}': {os.strerror(errno)}")
+                continue
+            self._watches[wd] = dirpath
+
+    def wait(self, timeout=None):
+        """
+        Aguarda eventos por até `timeout` segundos (None = indefinidamente) e retorna o conjunto
+        de arquivos de vídeo criados, gravados ou movidos para a árvore.
+        """
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Eventos perdidos: reavaliar a árvore inteira (os inalterados são pulados pelo registro)
+                log.warning("Fila do inotify transbordou; varrendo a biblioteca novamente.")
+                for root in set(self._watches.values()):
+                    changed.update(path for path, _ in scan_video_files(root))
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if not os.path.basename(path).startswith('.'):
+                    # Diretório novo (ou movido para cá, já com arquivos dentro)
+                    self._add_tree(path)
+                    changed.update(path for path, _ in scan_video_files(path))
+            elif is_watched_video(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Alternativa ao inotify (outros sistemas, sistemas de arquivos de rede): compara, a cada
+    `interval` segundos, o tamanho e o mtime dos arquivos de vídeo com a varredura anterior.
+    """
+
+    def __init__(self, root, interval=WATCH_POLL_SECONDS):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        return {path: (st.st_size, st.st_mtime_ns) for path, st in scan_video_files(self.root)}
+
+    def wait(self, timeout=None):
+        """
+        Aguarda até a próxima varredura (ou até `timeout` segundos) e retorna os arquivos novos ou alterados.
+        """
+        delay = self._next_scan - time.monotonic()
+        if timeout is not None and timeout < delay:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(delay, 0))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = self._scan()
+        changed = {path for path, state in snapshot.items() if self._snapshot.get(path) != state}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, poll_seconds=WATCH_POLL_SECONDS):
+    """
+    Usa o inotify quando disponível; caso contrário, recorre à varredura periódica.
+    """
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError) as e:
+        log.warning(f"inotify indisponível ({e}); verificando a biblioteca a cada {poll_seconds:.0f}s.")
+        return PollingWatcher(root, poll_seconds)
+
+
+def watch_directory(watcher, process_files, settle_seconds=WATCH_SETTLE_SECONDS):
+    """
+    Laço do modo de observação. Os arquivos sinalizados pelo observador só são processados depois
+    que o tamanho e o mtime ficam estáveis por `settle_seconds` (download ou cópia concluídos);
+    então `process_files` recebe o lote de caminhos prontos. Termina com Ctrl-C.
+    """
+    settling = {}  # caminho -> ((tamanho, mtime), momento da última mudança)
+    while True:
+        for path in watcher.wait(WATCH_CHECK_SECONDS if settling else None):
+            settling.setdefault(path, None)
+        now = time.monotonic()
+        ready = []
+        for path, previous in list(settling.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removido ou renomeado antes de terminar (o novo nome gera outro evento)
+                del settling[path]
+                continue
+            state = (st.st_size, st.st_mtime_ns)
+            if previous is None or previous[0] != state:
+                settling[path] = (state, now)
+            elif now - previous[1] >= settle_seconds:
+                del settling[path]
+                ready.append(path)
+        if ready:
+            process_files(sorted(ready))
+
+
+# --- FILA DE TRABALHOS COMPARTILHADA (VÁRIOS HOSTS) ---
+JOB_LEASE_SECONDS = 300.0      # Validade da reserva de um trabalho; o worker a renova a cada quarto desse tempo
+JOB_CLAIM_BATCH = 16           # Trabalhos reservados de uma vez por worker (um lote do pipeline)
+JOB_CLAIM_SCAN_FACTOR = 8      # Candidatos examinados por reserva, para dar preferência aos de discos locais
+JOB_MAX_ATTEMPTS = 3           # Reservas vencidas (worker morto) antes de o trabalho ser dado como falho
+JOB_IDLE_SECONDS = 10.0        # Espera entre tentativas quando não há trabalhos livres
+JOB_QUEUE_BUSY_TIMEOUT = 60.0  # Espera máxima (em segundos) pelo bloqueio do arquivo da fila
+JOB_ENQUEUE_BATCH = 500        # Arquivos gravados por transação ao enfileirar
+
+# Sistemas de arquivos de rede: um arquivo neles não está num disco local deste host
+NETWORK_FILESYSTEMS = frozenset((
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', '9p', 'ceph', 'glusterfs',
+    'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs', 'fuse.glusterfs', 'fuse.cephfs',
+))
+
+
+class SQLiteJobQueue:
+    """
+    Fila de trabalhos num arquivo SQLite no armazenamento compartilhado (NFS/SMB), usada por todos
+    os hosts. Cada arquivo de vídeo passa por 'pending' -> 'leased' (reservado por um worker até
+    `lease_until`, prazo renovado pelos heartbeats) -> 'done' ou 'failed'. Uma reserva vencida
+    (worker morto ou sem acesso à fila) volta a ser disputada, até JOB_MAX_ATTEMPTS vezes.
+    Usa o journal de rollback em vez do WAL, cuja memória compartilhada não funciona entre hosts,
+    e transações BEGIN IMMEDIATE, para que duas reservas nunca fiquem com o mesmo trabalho.
+    Os prazos usam o relógio de cada host: os relógios precisam estar sincronizados (NTP).
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=JOB_QUEUE_BUSY_TIMEOUT, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=DELETE')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id INTEGER PRIMARY KEY,'
+                ' path TEXT NOT NULL UNIQUE,'
+                ' size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+                ' state TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL,'
+                ' worker TEXT, lease_until REAL, error TEXT,'
+                ' force INTEGER NOT NULL DEFAULT 0,'
+                ' enqueued REAL NOT NULL,'
+                ' updated REAL NOT NULL)'
+            )
+            # Filas criadas antes da coluna 'force'
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'force' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN force INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS workers ('
+                ' id TEXT PRIMARY KEY,'
+                ' heartbeat REAL NOT NULL,'
+                ' completed INTEGER NOT NULL DEFAULT 0)'
+            )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE obtém o bloqueio de escrita já no início (aguardando até JOB_QUEUE_BUSY_TIMEOUT)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def enqueue(self, files, force=False):
+        """
+        Enfileira os arquivos de `files` ((caminho, stat)). Um arquivo já na fila só volta a ficar
+        pendente se mudou desde que foi concluído, se falhou da última vez ou com `force`; com `force`,
+        o trabalho é marcado para que o worker o processe mesmo que o manifesto o dê como inalterado
+        (o que também vale para os trabalhos que ainda estão pendentes).
+        Retorna o número de arquivos enfileirados.
+        """
+        queued = 0
+        files = iter(files)
+        while True:
+            batch = [(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+                     for path, st in itertools.islice(files, JOB_ENQUEUE_BATCH)]
+            if not batch:
+                return queued
+            now = time.time()
+            with self._transaction() as conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT INTO jobs (path, size, mtime_ns, state, attempts, force, enqueued, updated)"
+                    " VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)"
+                    " ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,"
+                    " state = 'pending', attempts = 0, worker = NULL, lease_until = NULL, error = NULL,"
+                    " force = MAX(jobs.force, excluded.force), enqueued = excluded.enqueued, updated = excluded.updated"
+                    " WHERE (jobs.state = 'pending' AND excluded.force AND NOT jobs.force)"
+                    " OR (jobs.state IN ('done', 'failed') AND (excluded.force OR jobs.state = 'failed'"
+                    " OR jobs.size != excluded.size OR jobs.mtime_ns != excluded.mtime_ns))",
+                    [(path, size, mtime_ns, int(force), now, now) for path, size, mtime_ns in batch]
+                )
+                queued += conn.total_changes - before
+
+    def claim(self, worker, limit, lease_seconds=JOB_LEASE_SECONDS, is_local=None):
+        """
+        Reserva até `limit` trabalhos pendentes (ou com a reserva vencida) para `worker`.
+        Entre os primeiros candidatos da fila, os arquivos para os quais `is_local(caminho)`
+        é verdadeiro vêm primeiro. Retorna [(id, caminho, forçado)].
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', worker = NULL, lease_until = NULL, error = ?, updated = ?"
+                " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (f"reserva vencida {JOB_MAX_ATTEMPTS} vezes sem conclusão", now, now, JOB_MAX_ATTEMPTS)
+            )
+            candidates = conn.execute(
+                "SELECT id, path, force FROM jobs WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                " ORDER BY id LIMIT ?",
+                (now, limit * JOB_CLAIM_SCAN_FACTOR)
+            ).fetchall()
+            if is_local is not None:
+                candidates.sort(key=lambda job: not is_local(job[1]))
+            jobs = candidates[:limit]
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                " updated = ? WHERE id = ?",
+                [(worker, now + lease_seconds, now, job_id) for job_id, _, _ in jobs]
+            )
+        return [(job_id, path, bool(force)) for job_id, path, force in jobs]
+
+    def heartbeat(self, worker, lease_seconds=JOB_LEASE_SECONDS):
+        """
+        Renova o prazo de todos os trabalhos reservados por `worker` e registra que ele está ativo.
+        Retorna o número de trabalhos que continuam com ele.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            held = conn.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND state = 'leased'",
+                                (now + lease_seconds, worker)).rowcount
+            conn.execute('INSERT INTO workers (id, heartbeat) VALUES (?, ?)'
+                         ' ON CONFLICT (id) DO UPDATE SET heartbeat = excluded.heartbeat', (worker, now))
+        return held
+
+    def complete(self, worker, results):
+        """
+        Registra o resultado dos trabalhos de `results` ((id, caminho, erro); erro None = concluído).
+        O estado do arquivo concluído (após a aplicação dos metadados) é guardado, para que a próxima
+        varredura não o enfileire de novo. Trabalhos cuja reserva já passou a outro worker são ignorados.
+        """
+        updates = []
+        for job_id, path, error in results:
+            size = mtime_ns = None
+            if error is None:
+                try:
+                    st = os.stat(path)
+                    size, mtime_ns = st.st_size, st.st_mtime_ns
+                except OSError as e:
+                    error = f"arquivo inacessível após o processamento: {e}"
+            updates.append(('done' if error is None else 'failed', size, mtime_ns, error, job_id))
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE jobs SET state = ?, size = COALESCE(?, size), mtime_ns = COALESCE(?, mtime_ns),"
+                " worker = NULL, lease_until = NULL, error = ?, force = 0, updated = ?"
+                " WHERE id = ? AND worker = ? AND state = 'leased'",
+                [(state, size, mtime_ns, error, now, job_id, worker) for state, size, mtime_ns, error, job_id in updates]
+            )
+            conn.execute('UPDATE workers SET completed = completed + ?, heartbeat = ? WHERE id = ?',
+                         (sum(1 for update in updates if update[0] == 'done'), now, worker))
+
+    def release(self, worker):
+        """
+        Devolve à fila os trabalhos ainda reservados por `worker` (encerramento com Ctrl-C),
+        sem esperar o prazo da reserva vencer.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL,"
+                " attempts = MAX(attempts - 1, 0), updated = ? WHERE worker = ? AND state = 'leased'",
+                (time.time(), worker)
+            )
+
+    def has_open_jobs(self):
+        """
+        Indica se ainda há trabalhos pendentes ou reservados (que podem voltar à fila se o worker morrer).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM jobs WHERE state IN ('pending', 'leased') LIMIT 1").fetchone()
+        return row is not None
+
+    def stats(self):
+        """
+        Retorna ({estado: número de trabalhos}, número de workers com heartbeat dentro do prazo de reserva).
+        """
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+            active = self._conn.execute('SELECT COUNT(*) FROM workers WHERE heartbeat >= ?',
+                                        (time.time() - JOB_LEASE_SECONDS,)).fetchone()[0]
+        return counts, active
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Backends da fila, pelo esquema da URL de --queue. Outro backend (ex: um banco de dados
+# de rede) só precisa oferecer os mesmos métodos de SQLiteJobQueue.
+JOB_QUEUE_BACKENDS = {
+    'sqlite': SQLiteJobQueue,
+}
+
+
+def open_job_queue(url):
+    """
+    Abre a fila indicada por 'esquema://destino' (ex: 'sqlite:///mnt/nas/foldermovie/fila.sqlite3');
+    um caminho sem esquema usa o SQLite.
+    """
+    scheme, separator, target = url.partition('://')
+    if not separator:
+        scheme, target = 'sqlite', url
+    backend = JOB_QUEUE_BACKENDS.get(scheme)
+    if backend is None:
+        raise ValueError(f"backend de fila desconhecido: '{scheme}' (disponíveis: {', '.join(JOB_QUEUE_BACKENDS)})")
+    return backend(target)
+
+
+def parse_path_map(entries):
+    """
+    Converte as entradas 'ORIGEM=DESTINO' de --path-map em [(prefixo na fila, prefixo neste host)],
+    do prefixo mais longo para o mais curto.
+    """
+    path_map = []
+    for entry in entries:
+        source, separator, target = entry.partition('=')
+        if not separator or not source or not target:
+            raise ValueError(f"mapeamento de caminho inválido: '{entry}' (use ORIGEM=DESTINO)")
+        path_map.append((source.rstrip(os.sep) or os.sep, target.rstrip(os.sep) or os.sep))
+    path_map.sort(key=lambda mapping: len(mapping[0]), reverse=True)
+    return path_map
+
+
+def map_path(path, path_map):
+    """
+    Traduz um caminho da fila para o caminho do mesmo arquivo neste host.
+    """
+    for source, target in path_map:
+        if path == source or path.startswith(os.path.join(source, '')):
+            return target + path[len(source):] if source != os.sep else os.path.join(target, path[1:])
+    return path
+
+
+class MountTable:
+    """
+    Pontos de montagem deste host (segundo /proc/mounts), para saber se um arquivo está num
+    disco local ou num compartilhamento de rede. Sem /proc/mounts, nenhum arquivo é considerado local.
+    """
+
+    def __init__(self, mounts_file='/proc/mounts'):
+        self.mounts = []
+        try:
+            with open(mounts_file, encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Espaços e outros caracteres especiais aparecem como escapes octais ('\040')
+                    mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                    self.mounts.append((mount_point, fields[2] not in NETWORK_FILESYSTEMS))
+        except OSError:
+            pass
+        # O ponto de montagem mais longo (e, no mesmo ponto, a montagem mais recente) prevalece
+        self.mounts.reverse()
+        self.mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+        self._cache = {}
+
+    def is_local(self, path):
+        directory = os.path.dirname(path)
+        if directory not in self._cache:
+            self._cache[directory] = next(
+                (local for mount_point, local in self.mounts
+                 if directory == mount_point or directory.startswith(os.path.join(mount_point, ''))),
+                False
+            )
+        return self._cache[directory]
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_files(job_queue, files, force=False):
+    """
+    Enfileira os arquivos de vídeo de `files` ((caminho, stat)) e exibe a situação da fila.
+    """
+    queued = job_queue.enqueue(files, force=force)
+    log.info(f"{queued} arquivos enfileirados em '{job_queue.path}'.")
+    console.print(f"[success]{queued} arquivos novos ou alterados enfileirados.[/success]")
+    print_queue_status(job_queue)
+    return queued
+
+
+def print_queue_status(job_queue):
+    counts, active = job_queue.stats()
+    summary = ', '.join(f"{counts.get(state, 0)} {label}" for state, label in
+                        (('pending', 'pendentes'), ('leased', 'em processamento'),
+                         ('done', 'concluídos'), ('failed', 'com falha')))
+    console.print(f"[info]Fila: {summary}; {active} workers ativos.[/info]")
+
+
+def run_worker(job_queue, process_files, worker_id, lease_seconds=JOB_LEASE_SECONDS, batch_size=JOB_CLAIM_BATCH,
+               path_map=(), keep_waiting=False):
+    """
+    Laço do worker: reserva lotes de trabalhos (preferindo os arquivos em discos locais deste host),
+    entrega os caminhos a `process_files(caminhos, force)`, que retorna {caminho: metadados aplicados},
+    e informa os resultados à fila. Os trabalhos enfileirados com --force são entregues à parte, com
+    `force` verdadeiro. Enquanto o lote é processado, uma thread renova as reservas a cada quarto do
+    prazo. Termina quando não há mais trabalhos pendentes nem reservados por outros workers (ou,
+    com `keep_waiting`, só com Ctrl-C). Retorna o número de trabalhos concluídos.
+    """
+    mounts = MountTable()
+    stop = threading.Event()
+    held_count = 0
+
+    def heartbeat():
+        while not stop.wait(lease_seconds / 4):
+            try:
+                held = job_queue.heartbeat(worker_id, lease_seconds)
+            except sqlite3.Error as e:
+                log.warning(f"Falha ao renovar as reservas na fila: {e}")
+                continue
+            if held < held_count:
+                log.warning(f"{held_count - held} reservas vencidas passaram a outro worker durante o processamento.")
+
+    job_queue.heartbeat(worker_id, lease_seconds)
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+    console.print(f"[info]Worker '{worker_id}' aguardando trabalhos em '{job_queue.path}' (Ctrl-C para encerrar)...[/info]")
+    done_count = 0
+    try:
+        while True:
+            with metrics.span('job_claim'):
+                jobs = job_queue.claim(worker_id, batch_size, lease_seconds,
+                                       is_local=lambda path: mounts.is_local(map_path(path, path_map)))
+            if not jobs:
+                if not keep_waiting and not job_queue.has_open_jobs():
+                    break
+                time.sleep(JOB_IDLE_SECONDS)
+                continue
+            held_count = len(jobs)
+            local_paths = [(job_id, map_path(path, path_map), force) for job_id, path, force in jobs]
+            log.info(f"Worker '{worker_id}': {len(jobs)} trabalhos reservados.")
+            applied = {}
+            for force in (False, True):
+                batch = sorted(path for _, path, forced in local_paths if forced == force)
+                if batch:
+                    applied.update(process_files(batch, force))
+            results = []
+            for job_id, path, _ in local_paths:
+                if applied.get(path):
+                    results.append((job_id, path, None))
+                elif not os.path.exists(path):
+                    results.append((job_id, path, "arquivo não encontrado neste host"))
+                else:
+                    results.append((job_id, path, "metadados não aplicados (sem resultado no TMDb ou falha; veja o log do worker)"))
+            job_queue.complete(worker_id, results)
+            held_count = 0
+            done_count += sum(1 for _, _, error in results if error is None)
+    finally:
+        stop.set()
+        job_queue.release(worker_id)
+    console.print(f"[success]Worker '{worker_id}' concluiu {done_count} trabalhos.[/success]")
+    print_queue_status(job_queue)
+    return done_count
+
+
+# --- CONCORRÊNCIA DA FASE 2 ---
+APPLY_WORKERS = 8             # Arquivos processados simultaneamente na Fase 2
+DISK_JOBS_PER_DEVICE = 1      # Operações de disco simultâneas por dispositivo
+NETWORK_JOBS = 6              # Operações de rede simultâneas na Fase 2
+
+
+class IOScheduler:
+    """
+    Controla a concorrência da Fase 2. Etapas que leem ou gravam os arquivos de vídeo
+    são limitadas por dispositivo de bloco (st_dev), para não disputar o mesmo disco,
+    enquanto as etapas de rede (capa, detalhes, legendas) têm um limite global próprio.
+    """
+
+    def __init__(self, disk_jobs=DISK_JOBS_PER_DEVICE, network_jobs=NETWORK_JOBS, workers=APPLY_WORKERS):
+        self.disk_jobs = disk_jobs
+        self.workers = workers
+        self.network = threading.BoundedSemaphore(network_jobs)
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def disk(self, file_path):
+        """
+        Retorna o semáforo do dispositivo onde está o arquivo (use com `with`).
+        """
+        device = os.stat(file_path).st_dev
+        with self._lock:
+            if device not in self._devices:
+                self._devices[device] = threading.BoundedSemaphore(self.disk_jobs)
+            return self._devices[device]
+
+
+# --- PIPELINE ---
+PIPELINE_QUEUE_SIZE = 64      # Itens em espera entre uma etapa e a seguinte (mantém a memória constante)
+CONFIRM_BATCH_SIZE = 20       # Arquivos por pergunta de confirmação
+CONFIRM_IDLE_SECONDS = 2.0    # Pergunta antes de completar o lote se as buscas estiverem demorando
+LOOKUP_MEMO_SIZE = 1024       # Buscas de títulos e temporadas mantidas em memória (LRU)
+PIPELINE_DONE = object()      # Marca o fim de uma fila
+
+
+class PipelineItem:
+    """
+    Registro compacto de um arquivo ao longo do pipeline: o nome analisado e, após a busca,
+    apenas os campos do TMDb usados na aplicação dos metadados. Ao retomar um processamento
+    interrompido, `video_hash`, `video_size` e `tagged` vêm do diário. `sequence` é a posição do
+    arquivo na varredura, usada para exibir os resultados na ordem dos arquivos.
+    """
+    __slots__ = ('file_path', 'release', 'sequence', 'tmdb_id', 'tmdb_title', 'poster_path', 'release_date',
+                 'language', 'video_hash', 'video_size', 'tagged')
+
+    def __init__(self, file_path, release, sequence=None):
+        self.file_path = file_path
+        self.release = release
+        self.sequence = sequence
+        self.tmdb_id = self.tmdb_title = self.poster_path = self.release_date = self.language = None
+        self.video_hash = self.video_size = None
+        self.tagged = False
+
+    @classmethod
+    def from_journal(cls, file_path, stage, tmdb_id, payload):
+        """
+        Reconstrói o registro de um arquivo pendente no diário, sem nova busca no TMDb.
+        """
+        item = cls(file_path, parse_release_name(os.path.basename(file_path)))
+        item.tmdb_id = tmdb_id
+        item.tmdb_title = payload.get('tmdb_title')
+        item.poster_path = payload.get('poster_path')
+        item.release_date = payload.get('release_date')
+        item.language = payload.get('language')
+        item.video_hash = payload.get('video_hash')
+        item.video_size = payload.get('video_size')
+        item.tagged = stage == 'tagged'
+        return item
+
+
+class TitleResolver:
+    """
+    Etapa de busca do pipeline. Guarda em memória (LRU limitado) os resultados recentes, para que
+    os episódios de uma série busquem o título e cada temporada uma única vez, mesmo com --refresh.
+    Buscas iguais feitas ao mesmo tempo por threads diferentes resultam em uma única busca.
+    """
+
+    def __init__(self, client, offline_index=None, max_size=LOOKUP_MEMO_SIZE):
+        self.client = client
+        self.offline_index = offline_index
+        self.max_size = max_size
+        self._memo = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    def _memoized(self, key, compute):
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            with self._lock:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    return self._memo[key]
+            value = compute()
+            with self._lock:
+                self._memo[key] = value
+                if len(self._memo) > self.max_size:
+                    self._memo.popitem(last=False)
+            return value
+
+    def _lookup(self, release):
+        selected_item, language = lookup_title(self.client, release.title, release.is_series, release.year,
+                                               self.offline_index)
+        if not selected_item or not hasattr(selected_item, 'id'):
+            return None, None, None, None, language
+        return (selected_item.id, get_safe_title(selected_item), getattr(selected_item, 'poster_path', None),
+                get_release_date(selected_item), language)
+
+    def resolve(self, item):
+        """
+        Preenche o registro com o resultado da busca no TMDb (tmdb_id fica None se nada for encontrado).
+        O registro sempre segue adiante, mesmo após um erro: a confirmação espera cada posição da varredura.
+        """
+        release = item.release
+        try:
+            (item.tmdb_id, item.tmdb_title, item.poster_path, item.release_date,
+             item.language) = self._memoized(('title', release.title, release.is_series, release.year),
+                                             lambda: self._lookup(release))
+        except Exception as e:
+            log.error(f"Erro inesperado ao buscar '{release.title}': {e}")
+            traceback.print_exc()
+            item.language = 'pt-BR'
+        return item
+
+    def episode(self, item):
+        """
+        Retorna o episódio do arquivo (título e data de exibição), buscando a temporada inteira uma única vez.
+        """
+        season_number = item.release.season
+        season_details = self._memoized(('season', item.tmdb_id, season_number),
+                                        lambda: self.client.season(item.tmdb_id, season_number, 'pt-BR'))
+        return get_episode(season_details, item.release.episode)
+
+
+class ScanProgress:
+    """
+    Contagem dos arquivos enviados pela varredura; o total só é conhecido quando ela termina.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.finished = False
+
+    def label(self, position):
+        return f"{position}/{self.count}" if self.finished else f"{position}/{self.count}+"
+
+
+def start_stage(name, handler, inbox, outbox, workers):
+    """
+    Inicia `workers` threads que aplicam `handler` a cada item de `inbox` e repassam o resultado
+    (se houver) para `outbox`. Quando a última thread termina, o fim da fila é repassado adiante.
+    Retorna as threads.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = inbox.get()
+            if item is PIPELINE_DONE:
+                inbox.put(PIPELINE_DONE)  # Repassar o fim da fila para as outras threads da etapa
+                break
+            try:
+                with metrics.span(f'pipeline_{name}'):
+                    result = handler(item)
+            except Exception as e:
+                log.error(f"Erro inesperado ao processar '{os.path.basename(item.file_path)}': {e}")
+                traceback.print_exc()
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+        with lock:
+            remaining[0] -= 1
+            last = not remaining[0]
+        if last and outbox is not None:
+            outbox.put(PIPELINE_DONE)
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{index}", daemon=True) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def apply_to_file(item, client, resolver, file_cache, poster_cache, subtitle_downloader, scheduler, journal):
+    """
+    Etapas de capa/detalhes, metadados e legenda do pipeline para um arquivo já confirmado;
+    a legenda, se necessária, é agendada no subtitle_downloader.
+    Cada etapa é registrada no diário antes de começar; um erro inesperado marca o arquivo como
+    'failed' no diário (em vez de deixá-lo preso numa etapa intermediária) e é repassado.
+    Seguro para uso em threads; retorna True se os metadados foram aplicados.
+    """
+    try:
+        return apply_file_stages(item, client, resolver, file_cache, poster_cache, subtitle_downloader,
+                                 scheduler, journal)
+    except Exception as e:
+        # As edições são feitas em cópias '_processed': recover() remove as que sobrarem
+        journal.fail(item.file_path, f"{type(e).__name__}: {e}")
+        raise
+
+
+def apply_file_stages(item, client, resolver, file_cache, poster_cache, subtitle_downloader, scheduler, journal):
+    """
+    Executa as etapas de apply_to_file.
+    Episódios recebem o título e a data de exibição do próprio episódio (obtidos com a temporada inteira).
+    Arquivos retomados que já tinham os metadados aplicados seguem direto para a legenda.
+    """
+    file_path = item.file_path
+    release = item.release
+    is_series = release.is_series
+    filename = os.path.basename(file_path)
+    print(f"  Processando metadados para: {filename}")
+
+    if not is_taggable_video(filename):
+        print("Formato de arquivo não suportado para aplicação de metadados (apenas MP4 e MKV).")
+        journal.finish(file_path)
+        return False
+
+    # Analisar o arquivo antes de modificá-lo: o hash para as legendas precisa ser do arquivo original
+    profile = get_media_profile(file_path, file_cache)
+    if item.video_hash and item.video_size:
+        video_hash, video_size = item.video_hash, item.video_size
+    else:
+        video_hash, video_size = get_video_hash(file_path, file_cache)
+
+    if item.tagged:
+        print(f"Metadados já aplicados antes da interrupção: {filename}")
+        if not download_subtitles_if_needed(file_path, item.tmdb_title, item.release_date or '', profile,
+                                            video_hash, video_size, subtitle_downloader):
+            journal.finish(file_path)
+        return True
+
+    with scheduler.network:
+        # --- Obter a capa (do cache ou baixando) ---
+        cover_path = poster_cache.get(item.poster_path)
+
+        # Obter detalhes completos do filme para mais metadados
+        full_item_details = client.details(item.tmdb_id, is_series, 'pt-BR')
+        episode = resolver.episode(item) if is_series else None
+    release_date = get_release_date(full_item_details) if full_item_details else item.release_date
+    item_title = item.tmdb_title
+
+    # Episódios recebem o próprio título e data de exibição, além de série/temporada/episódio
+    tag_title, tag_date, series_info = item_title, release_date, None
+    if is_series:
+        series_info = (item_title, release.season, release.episode)
+        if episode is not None:
+            tag_title = getattr(episode, 'name', None) or item_title
+            tag_date = getattr(episode, 'air_date', None) or release_date
+
+    # --- Aplicar metadados ---
+    journal.mark(file_path, 'tagging', video_hash=video_hash, video_size=video_size, release_date=release_date)
+    with scheduler.disk(file_path):
+        if filename.lower().endswith('.mp4'):
+            print("Aplicando metadados (MP4 com edição direta dos atoms)...")
+            with metrics.span('mp4_edit'):
+                applied = apply_mp4_metadata(file_path, tag_title, tag_date, cover_path, series_info, journal)
+        else:
+            print("Aplicando metadados (MKV com mkvpropedit)...")
+            applied = apply_mkv_metadata(file_path, tag_title, tag_date, cover_path, series_info, journal)
+        if not applied:
+            print("Edição no próprio arquivo indisponível. Recorrendo ao remux com ffmpeg...")
+            applied = remux_with_ffmpeg(file_path, tag_title, tag_date, cover_path, series_info, journal)
+
+    # Baixar legendas após aplicar metadados
+    if applied:
+        journal.mark(file_path, 'tagged')
+        if profile is not None and os.path.exists(file_path):
+            # A edição de metadados não altera as trilhas: reaproveitar a análise para o arquivo modificado
+            file_cache.set(FileInfoCache.stat_key(file_path), 'profile', profile.to_dict())
+        if download_subtitles_if_needed(file_path, item_title, release_date, profile, video_hash, video_size,
+                                        subtitle_downloader):
+            return applied
+    # Concluído (ou falhou sem deixar nada pela metade): a legenda agendada remove o registro ao terminar
+    journal.finish(file_path)
+    return applied
+
+
+def lookup_in_offline_index(client, offline_index, extracted_title, is_series, year=None):
+    """
+    Resolve um título pelo índice local, sem buscas na rede: apenas os detalhes (em pt-BR) dos
+    candidatos são obtidos do TMDb, e eles ficam no cache para a Fase 2.
+    Com ano no nome do arquivo, escolhe o candidato mais popular lançado nesse ano (com tolerância
+    de um ano); sem ano, o mais popular. Retorna os detalhes do item escolhido ou None.
+    """
+    for item_id in offline_index.lookup(extracted_title, is_series):
+        item_details = client.details(item_id, is_series, 'pt-BR')
+        if item_details is None:
+            continue
+        release_year = get_release_date(item_details)[:4]
+        if not year or (release_year.isdigit() and abs(int(release_year) - year) <= 1):
+            log.info(f"Resultado encontrado no índice local: {get_safe_title(item_details)}")
+            return item_details
+    return None
+
+
+def lookup_title(client, extracted_title, is_series, year=None, offline_index=None):
+    """
+    Busca um título no TMDb, primeiro em pt-BR e, se não houver resultados, em en-US.
+    Se o nome do arquivo tiver o ano, a busca é restrita a ele; sem resultados, repete sem o ano
+    (o ano do arquivo às vezes difere em um do ano cadastrado no TMDb).
+    Com o índice local, o título é procurado nele primeiro e a busca na rede fica só para o que
+    não for encontrado (ex: nomes de arquivo com o título traduzido).
+    Retorna (selected_item, idioma) — selected_item é None se nada for encontrado.
+    """
+    if offline_index is not None:
+        selected_item = lookup_in_offline_index(client, offline_index, extracted_title, is_series, year)
+        if selected_item is not None:
+            return selected_item, 'pt-BR'
+    for search_year in ((year, None) if year else (None,)):
+        for language in ('pt-BR', 'en-US'):
+            log.info(f"Buscando '{extracted_title}' no TMDb (idioma: {language}{f', ano: {search_year}' if search_year else ''})...")
+            search_results = client.search(extracted_title, is_series, language, search_year)
+            if search_results:
+                selected_item = search_results[0] # Seleciona o primeiro resultado automaticamente
+                log.info(f"Resultado encontrado em {language}: {get_safe_title(selected_item)}")
+                return selected_item, language
+            log.warning(f"Nenhum resultado em {language} para '{extracted_title}'.")
+    return None, language
+
+
+def get_episode(season_details, episode_number):
+    """
+    Retorna o episódio de número `episode_number` dos detalhes de uma temporada, ou None.
+    """
+    if season_details is None or not hasattr(season_details, 'episodes'):
+        return None
+    for episode in season_details.episodes:
+        if getattr(episode, 'episode_number', None) == episode_number:
+            return episode
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Organiza arquivos de vídeo buscando metadados no TMDb.")
+    parser.add_argument('directory', type=str, nargs='?',
+                        help="Caminho para o diretório contendo os arquivos de vídeo (incluindo subpastas).")
+    parser.add_argument('--cache-dir', type=str, default=default_cache_dir(),
+                        help="Diretório dos caches persistentes (consultas ao TMDb e análise dos arquivos).")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL_DAYS,
+                        help="Validade (em dias) das respostas do TMDb com resultado.")
+    parser.add_argument('--cache-negative-ttl', type=float, default=CACHE_NEGATIVE_TTL_DAYS,
+                        help="Validade (em dias) das respostas do TMDb sem resultado.")
+    parser.add_argument('--cache-max-entries', type=int, default=CACHE_MAX_ENTRIES,
+                        help="Número máximo de entradas no cache antes da remoção LRU.")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--refresh', action='store_true',
+                            help="Ignora o cache e consulta o TMDb novamente (atualizando o cache).")
+    cache_mode.add_argument('--offline', action='store_true',
+                            help="Usa apenas o cache, sem nenhuma chamada de rede ao TMDb.")
+    parser.add_argument('--offline-index', action='store_true',
+                        help="Resolve os títulos pelo índice local das exportações do TMDb (a rede fica só para os detalhes).")
+    parser.add_argument('--build-offline-index', type=str, nargs='+', metavar='EXPORTACAO',
+                        help="Gera o índice local a partir das exportações diárias de ids do TMDb (.json.gz) e o usa.")
+    parser.add_argument('--workers', type=int, default=LOOKUP_WORKERS,
+                        help="Número de buscas simultâneas no TMDb durante a Fase 1.")
+    parser.add_argument('--tmdb-rate', type=float, default=TMDB_RATE_LIMIT,
+                        help="Limite de requisições por segundo ao TMDb (compartilhado entre as buscas).")
+    parser.add_argument('--apply-workers', type=int, default=APPLY_WORKERS,
+                        help="Número de arquivos processados simultaneamente na Fase 2.")
+    parser.add_argument('--disk-jobs', type=int, default=DISK_JOBS_PER_DEVICE,
+                        help="Operações de disco simultâneas por dispositivo na Fase 2.")
+    parser.add_argument('--network-jobs', type=int, default=NETWORK_JOBS,
+                        help="Operações de rede simultâneas (capas, detalhes, legendas) na Fase 2.")
+    parser.add_argument('--poster-size', type=str, default=POSTER_SIZE, choices=POSTER_SIZES,
+                        help="Tamanho da capa do TMDb a ser embutida nos arquivos.")
+    parser.add_argument('--poster-cache-mb', type=int, default=POSTER_CACHE_MAX_MB,
+                        help="Tamanho máximo (em MB) do cache de capas.")
+    parser.add_argument('--subtitle-providers', type=str, default=','.join(SUBTITLE_PROVIDERS),
+                        help="Provedores de legenda do subliminal, separados por vírgula.")
+    parser.add_argument('--subtitle-workers', type=int, default=SUBTITLE_WORKERS,
+                        help="Sessões simultâneas com os provedores de legenda.")
+    parser.add_argument('--subtitle-rate', type=float, default=SUBTITLE_RATE_LIMIT,
+                        help="Limite de requisições por segundo a cada provedor de legenda.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Conclui apenas os arquivos cujo processamento foi interrompido (sem nova varredura nem buscas).")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="Aplica os metadados sem pedir confirmação.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Após o processamento, continua observando o diretório e processa os arquivos novos ou alterados.")
+    parser.add_argument('--watch-settle', type=float, default=WATCH_SETTLE_SECONDS,
+                        help="Segundos sem mudança de tamanho/mtime para considerar um arquivo novo completo.")
+    parser.add_argument('--watch-poll', type=float, default=WATCH_POLL_SECONDS,
+                        help="Intervalo (em segundos) entre varreduras quando o inotify não está disponível.")
+    parser.add_argument('--queue', type=str, metavar='URL',
+                        help="Fila de trabalhos compartilhada entre hosts (ex: sqlite:///mnt/nas/foldermovie/fila.sqlite3). Sem --worker, a varredura só enfileira os arquivos.")
+    parser.add_argument('--worker', action='store_true',
+                        help="Processa os trabalhos da fila indicada em --queue (aplicando o melhor resultado, como com --yes).")
+    parser.add_argument('--worker-id', type=str, default=default_worker_id(),
+                        help="Identificação do worker na fila (padrão: host:pid).")
+    parser.add_argument('--lease', type=float, default=JOB_LEASE_SECONDS,
+                        help="Prazo (em segundos) da reserva de um trabalho, renovado enquanto o worker está ativo.")
+    parser.add_argument('--worker-batch', type=int, default=JOB_CLAIM_BATCH,
+                        help="Trabalhos reservados de uma vez por worker.")
+    parser.add_argument('--path-map', type=str, action='append', metavar='ORIGEM=DESTINO',
+                        help="Traduz os caminhos da fila para os caminhos deste host (pode ser repetido).")
+    parser.add_argument('--force', action='store_true',
+                        help="Processa novamente todos os arquivos, mesmo os já registrados como processados.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Apenas lista os arquivos novos ou alterados e o que foi extraído dos nomes, sem consultar o TMDb nem alterar nada.")
+    parser.add_argument('--metrics-file', type=str,
+                        help=f"Caminho do relatório JSON de desempenho (padrão: {METRICS_FILE_NAME} no diretório de cache).")
+    parser.add_argument('--prometheus-file', type=str,
+                        help="Grava também as métricas no formato texto do Prometheus (ex: para o textfile collector do node exporter).")
+    parser.add_argument('--profile', action='store_true',
+                        help="Executa sob o cProfile, exibe as funções mais custosas e salva as estatísticas.")
+    parser.add_argument('--profile-output', type=str, default=PROFILE_OUTPUT_FILE, metavar='ARQUIVO',
+                        help=f"Arquivo das estatísticas do cProfile (padrão: {PROFILE_OUTPUT_FILE}).")
+    args = parser.parse_args()
+
+    if not args.profile:
+        run(args, parser)
+        return
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args, parser)
+    finally:
+        profiler.dump_stats(args.profile_output)
+        pstats.Stats(profiler).sort_stats('tottime').print_stats(PROFILE_TOP_FUNCTIONS)
+        log.info(f"Estatísticas do cProfile salvas em: {args.profile_output}")
+
+
+def run(args, parser):
+    """
+    Executa o organizador com os argumentos da linha de comando.
+    """
+    movie_directory = args.directory
+    index_path = os.path.join(args.cache_dir, OFFLINE_INDEX_NAME)
+
+    if args.build_offline_index:
+        console.print("[info]Gerando o índice local do TMDb...[/info]")
+        count = OfflineTitleIndex.build_if_changed(args.build_offline_index, index_path)
+        if count is None:
+            console.print("[info]As exportações não mudaram desde a última geração: índice local mantido.[/info]")
+        else:
+            log.info(f"Índice local do TMDb gerado com {count} títulos: {index_path}")
+            console.print(f"[success]Índice local gerado com {count} títulos.[/success]")
+        if movie_directory is None:
+            return
+    elif movie_directory is None and not args.worker:
+        parser.error("informe o diretório dos arquivos de vídeo.")
+    if args.worker and not args.queue:
+        parser.error("--worker requer a fila de trabalhos (--queue).")
+    if args.worker and args.dry_run:
+        parser.error("--dry-run não pode ser usado com --worker.")
+    try:
+        path_map = parse_path_map(args.path_map or [])
+    except ValueError as e:
+        parser.error(str(e))
+
+    if movie_directory is not None and not os.path.isdir(movie_directory):
+        log.error(f"Erro: O diretório especificado não existe: [bold red]{movie_directory}[/bold red]")
+        console.print(f"[error]Erro: O diretório especificado não existe: {movie_directory}[/error]")
+        return
+
+    if args.dry_run:
+        manifest = LibraryManifest(args.cache_dir)
+        try:
+            preview_directory(movie_directory, manifest, force=args.force)
+        finally:
+            manifest.close()
+        return
+
+    job_queue = None
+    if args.queue:
+        try:
+            job_queue = open_job_queue(args.queue)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            log.error(f"Fila de trabalhos indisponível: {e}")
+            console.print(f"[error]Fila de trabalhos indisponível: {e}[/error]")
+            return
+        if movie_directory is not None:
+            # Com a fila, a varredura só enfileira: o processamento fica com os workers
+            enqueue_files(job_queue, scan_video_files(movie_directory), force=args.force)
+        if not args.worker:
+            try:
+                if args.watch:
+                    watcher = create_watcher(movie_directory, args.watch_poll)
+                    console.print(f"[info]Observando '{movie_directory}' por arquivos novos (Ctrl-C para encerrar)...[/info]")
+                    try:
+                        watch_directory(watcher, lambda paths: enqueue_files(job_queue, stat_video_files(paths)),
+                                        settle_seconds=args.watch_settle)
+                    except KeyboardInterrupt:
+                        console.print("[info]Observação encerrada.[/info]")
+                    finally:
+                        watcher.close()
+            finally:
+                job_queue.close()
+            return
+
+    offline_index = None
+    if args.offline_index or args.build_offline_index:
+        try:
+            offline_index = OfflineTitleIndex(index_path)
+        except (OSError, ValueError) as e:
+            log.error(f"Índice local do TMDb indisponível ({e}). Gere-o com --build-offline-index.")
+            console.print("[error]Índice local do TMDb indisponível. Gere-o com --build-offline-index.[/error]")
+            return
+
+    cache = TMDbCache(
+        args.cache_dir,
+        ttl_days=args.cache_ttl,
+        negative_ttl_days=args.cache_negative_ttl,
+        max_entries=args.cache_max_entries,
+        refresh=args.refresh,
+        offline=args.offline
+    )
+    rate_limiter = RateLimiter(args.tmdb_rate)
+    client = TMDbClient(TMDB_API_KEY, cache, rate_limiter, pool_size=args.workers)
+    file_cache = FileInfoCache(args.cache_dir)
+    manifest = LibraryManifest(args.cache_dir)
+    journal = JobJournal(args.cache_dir)
+    poster_cache = PosterCache(args.cache_dir, size=args.poster_size, max_mb=args.poster_cache_mb,
+                               pool_size=args.network_jobs, offline=args.offline)
+    metrics_file = args.metrics_file or os.path.join(args.cache_dir, METRICS_FILE_NAME)
+
+    def write_metrics():
+        metrics.cache('tmdb', cache.hits, cache.misses)
+        metrics.cache('file_info', file_cache.hits, file_cache.misses)
+        metrics.cache('posters', poster_cache.hits, poster_cache.misses)
+        try:
+            metrics.write_json(metrics_file)
+            if args.prometheus_file:
+                metrics.write_prometheus(args.prometheus_file)
+        except OSError as e:
+            log.warning(f"Não foi possível gravar o relatório de desempenho: {e}")
+
+    scheduler = IOScheduler(disk_jobs=args.disk_jobs, network_jobs=args.network_jobs, workers=args.apply_workers)
+    subtitle_downloader = SubtitleDownloader(file_cache, providers=args.subtitle_providers.split(','),
+                                             workers=args.subtitle_workers, rate=args.subtitle_rate,
+                                             journal=journal)
+    try:
+        if job_queue is not None:
+            def process_claimed(paths, force):
+                # Um lote reservado da fila: conta como concluído o arquivo em que os metadados foram
+                # aplicados agora ou, sem --force, o que o manifesto já dá como processado e inalterado
+                root = os.path.commonpath(paths) if len(paths) > 1 else os.path.dirname(paths[0])
+                applied_paths = process_directory(root, client, file_cache, poster_cache, subtitle_downloader,
+                                                  scheduler, manifest, journal, workers=args.workers, force=force,
+                                                  offline_index=offline_index, assume_yes=True, paths=paths)
+                write_metrics()
+                applied = {}
+                for path in paths:
+                    try:
+                        applied[path] = path in applied_paths or (not force and manifest.is_unchanged(path, os.stat(path)))
+                    except OSError:
+                        applied[path] = False
+                return applied
+
+            try:
+                run_worker(job_queue, process_claimed, args.worker_id, lease_seconds=args.lease,
+                           batch_size=args.worker_batch, path_map=path_map, keep_waiting=args.watch)
+            except KeyboardInterrupt:
+                console.print("[info]Worker encerrado; os trabalhos reservados voltaram à fila.[/info]")
+            finally:
+                job_queue.close()
+            return
+        # Com --watch, o observador começa antes da primeira passada para não perder arquivos que cheguem durante ela
+        watcher = create_watcher(movie_directory, args.watch_poll) if args.watch else None
+        process_directory(movie_directory, client, file_cache, poster_cache, subtitle_downloader, scheduler, manifest,
+                          journal, workers=args.workers, force=args.force, offline_index=offline_index,
+                          assume_yes=args.yes, resume=args.resume)
+        if watcher is not None:
+            console.print(f"[info]Observando '{movie_directory}' por arquivos novos (Ctrl-C para encerrar)...[/info]")
+
+            def process_new_files(paths):
+                # As gravações do próprio organizador também geram eventos: descartá-las antes do pipeline
+                paths = [path for path, st in stat_video_files(paths) if not manifest.is_unchanged(path, st)]
+                if paths:
+                    log.info(f"Modo de observação: {len(paths)} arquivos novos ou alterados.")
+                    process_directory(movie_directory, client, file_cache, poster_cache, subtitle_downloader,
+                                      scheduler, manifest, journal, workers=args.workers,
+                                      offline_index=offline_index, assume_yes=args.yes, paths=paths)
+                    write_metrics()
+
+            try:
+                watch_directory(watcher, process_new_files, settle_seconds=args.watch_settle)
+            except KeyboardInterrupt:
+                console.print("[info]Observação encerrada.[/info]")
+            finally:
+                watcher.close()
+    finally:
+        subtitle_downloader.close()
+        write_metrics()
+        log.info(f"Relatório de desempenho salvo em: {metrics_file}")
+        log.info(f"Cache do TMDb: {cache.hits} acertos, {cache.misses} falhas.")
+        log.info(f"Cache de análise de arquivos: {file_cache.hits} acertos, {file_cache.misses} falhas.")
+        cache.close()
+        log.info(f"Cache de capas: {poster_cache.hits} acertos, {poster_cache.misses} downloads.")
+        file_cache.close()
+        manifest.close()
+        journal.close()
+        poster_cache.close()
+        if offline_index is not None:
+            offline_index.close()
+
+
+def show_match(movie_directory, item, progress=None):
+    """
+    Exibe o resultado da busca de um arquivo, com a posição (`progress`, ex: '12/40+') entre os já varridos.
+    """
+    extracted_title, is_series = item.release.title, item.release.is_series
+    filename = os.path.relpath(item.file_path, movie_directory)
+    position = f"[{progress}] " if progress else ""
+    console.print(f"\n[separator]-- {position}Processando arquivo: [bold blue]{filename}[/bold blue] --[/separator]")
+    console.print(f"  [info]Título extraído:[/info] [bold cyan]'{extracted_title}'[/bold cyan] ([info]Tipo:[/info] {"Série" if is_series else "Filme"})")
+    if item.language != 'pt-BR':
+        console.print(f"  [warning]Nenhum resultado em pt-BR para '{extracted_title}'. Tentando em en-US...[/warning]")
+
+    if item.tmdb_id is not None:
+        console.print(f"  [success]Sugestão automática:[/success] [bold green]{item.tmdb_title}[/bold green]")
+    else:
+        log.error(f"Nenhum resultado encontrado para '{extracted_title}'. Pulando este arquivo.")
+        console.print(f"  [error]Nenhum resultado encontrado para '{extracted_title}'. Pulando este arquivo.[/error]")
+    console.print("[separator]----------------------------------------[/separator]")
+
+
+def ask_confirmation(count):
+    """
+    Pergunta se os metadados devem ser aplicados aos `count` arquivos listados desde a última pergunta.
+    Retorna 's' (sim), 'n' (pular este lote), 't' (sim para este e todos os próximos) ou 'c' (cancelar).
+    """
+    print("\n" + "-" * 50)
+    print("  FASE 1.5: CONFIRMAÇÃO  ")
+    print("  Verifique as correlações antes de aplicar os metadados")
+    print("-" * 50 + "\n")
+    while True:
+        confirm = input(f"Aplicar metadados aos {count} arquivos listados? "
+                        "(s = sim, n = pular, t = sim para todos, c = cancelar): ").lower()
+        if confirm in ('s', 'n', 't', 'c'):
+            return confirm
+        print("Resposta inválida. Digite 's', 'n', 't' ou 'c'.")
+
+
+def confirm_matches(movie_directory, inbox, outbox, stop, journal, assume_yes=False, progress=None,
+                    confirmed_progress=None):
+    """
+    Etapa de confirmação do pipeline (na thread principal): exibe cada resultado e repassa os
+    arquivos confirmados (registrados no diário) para a aplicação. Sem `assume_yes`, pergunta a cada
+    CONFIRM_BATCH_SIZE arquivos, ou antes, se as buscas estiverem demorando.
+    As buscas terminam fora de ordem; os resultados ficam retidos até que todos os anteriores
+    (na ordem da varredura) cheguem, e são exibidos com a contagem de `progress` (ScanProgress).
+    Os arquivos repassados são contados em `confirmed_progress` (ScanProgress), se indicado.
+    Retorna o número de arquivos confirmados.
+    """
+    pending = []
+    confirmed = 0
+    cancelled = False
+    waiting = {}  # Resultados que chegaram antes dos anteriores (posição na varredura -> registro)
+    next_sequence = 0
+    shown = 0
+
+    def hand_off(items):
+        nonlocal confirmed
+        if not confirmed:
+            print("\n" + "-" * 50)
+            print("  FASE 2: APLICAÇÃO DE METADADOS  ")
+            print("  Aplicando metadados e baixando legendas  ")
+            print("-" * 50 + "\n")
+        for item in items:
+            journal.confirm(item)
+            outbox.put(item)
+        confirmed += len(items)
+        if confirmed_progress is not None:
+            confirmed_progress.count = confirmed
+
+    while True:
+        try:
+            item = inbox.get(timeout=CONFIRM_IDLE_SECONDS if pending else None)
+        except queue.Empty:
+            item = None  # As buscas estão demorando: perguntar logo sobre o que já foi encontrado
+        finished = item is PIPELINE_DONE
+        if item is not None and not finished:
+            if cancelled:
+                continue  # Apenas esvaziar a fila até o fim das buscas em andamento
+            waiting[item.sequence] = item
+        ready = []
+        while next_sequence in waiting:
+            ready.append(waiting.pop(next_sequence))
+            next_sequence += 1
+        if finished:
+            ready.extend(waiting.pop(sequence) for sequence in sorted(waiting))
+        for ready_item in ready:
+            shown += 1
+            show_match(movie_directory, ready_item, progress.label(shown) if progress else None)
+            if ready_item.tmdb_id is None:
+                continue
+            if assume_yes:
+                hand_off([ready_item])
+            else:
+                pending.append(ready_item)
+        if item is not None and not finished and len(pending) < CONFIRM_BATCH_SIZE:
+            continue
+
+        if pending:
+            answer = ask_confirmation(len(pending))
+            if answer in ('s', 't'):
+                hand_off(pending)
+                assume_yes = answer == 't'
+            elif answer == 'n':
+                print(f"{len(pending)} arquivos pulados.")
+            else:
+                print("Operação cancelada pelo usuário.")
+                cancelled = True
+                waiting.clear()
+                stop.set()
+            pending = []
+        if finished:
+            return confirmed
+
+
+def preview_directory(movie_directory, manifest, force=False):
+    """
+    Simulação (--dry-run): percorre o diretório e mostra o título, o ano e o episódio extraídos
+    do nome de cada arquivo novo ou alterado, sem consultar o TMDb nem modificar os arquivos
+    (o subliminal e o requests não chegam a ser importados). Retorna o número de arquivos listados.
+    """
+    pending_count = 0
+    unchanged_count = 0
+    for file_path, st in scan_video_files(movie_directory):
+        if not force and manifest.is_unchanged(file_path, st):
+            unchanged_count += 1
+            continue
+        pending_count += 1
+        release = parse_release_name(os.path.basename(file_path))
+        if release.is_series:
+            kind = f"Série, S{release.season:02d}{''.join(f'E{number:02d}' for number in release.episodes)}"
+        else:
+            kind = "Filme"
+        print(f"  {os.path.relpath(file_path, movie_directory)}: '{release.title}' ({kind}, Ano: {release.year or '-'})")
+    print(f"{pending_count} arquivos seriam processados; {unchanged_count} já processados e inalterados foram pulados.")
+    return pending_count
+
+
+def process_directory(movie_directory, client, file_cache, poster_cache, subtitle_downloader, scheduler, manifest,
+                      journal, workers=LOOKUP_WORKERS, force=False, offline_index=None, assume_yes=False, resume=False,
+                      paths=None):
+    """
+    Processa os arquivos de vídeo do diretório (ou apenas os de `paths`) pelo pipeline completo.
+    Retorna o conjunto dos arquivos em que os metadados foram aplicados.
+    """
+    # Arrumar o que uma execução interrompida deixou pela metade (saídas '_processed', trocas de remux)
+    interrupted_count = journal.recover()
+    if interrupted_count and not resume:
+        console.print(f"[warning]{interrupted_count} arquivos tiveram o processamento interrompido. Use --resume para concluí-los.[/warning]")
+
+    def announce():
+        # Os painéis só são exibidos quando há o que processar: uma execução sem arquivos novos
+        # termina sem carregar o restante do Rich
+        from rich.panel import Panel
+        console.print(Panel("[bold green]Processamento Concluído![/bold green]\nVerifique seus arquivos organizados.", title="[bold white on green]Sucesso![/bold white on green]", style="success", expand=False))
+        console.print(Panel("[bold yellow]Fase 1: Análise e Busca de Metadados[/bold yellow]\nVerificando arquivos de vídeo e buscando informações no TMDb.", title="[bold white on yellow]Início do Processamento[/bold white on yellow]", style="phase", expand=False))
+
+    # Pipeline: varredura e análise do nome -> busca no TMDb -> confirmação -> capa, detalhes e
+    # metadados -> legendas. As etapas rodam ao mesmo tempo, ligadas por filas limitadas, de modo
+    # que os primeiros arquivos ficam prontos logo e a memória não cresce com o tamanho da biblioteca.
+    resolver = TitleResolver(client, offline_index)
+    stop = threading.Event()
+    lookup_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    confirm_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    apply_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    # Ctrl-C: a aplicação e as legendas deixam de pegar novos arquivos (que ficam no diário para o --resume)
+    interrupted = threading.Event()
+    unchanged_count = 0
+    scan_progress = ScanProgress()
+    confirmed_progress = ScanProgress()
+    processed_count = 0
+    applied_paths = set()
+    applied_lock = threading.Lock()
+
+    def scan():
+        # Varredura recursiva (ou só os arquivos indicados pelo modo de observação):
+        # arquivos inalterados desde o último processamento são pulados
+        nonlocal unchanged_count
+        files = scan_video_files(movie_directory) if paths is None else stat_video_files(paths)
+        announced = False
+        try:
+            for file_path, st in files:
+                if stop.is_set():
+                    break
+                if not force and manifest.is_unchanged(file_path, st):
+                    unchanged_count += 1
+                    continue
+                if not announced:
+                    announce()
+                    announced = True
+                release = parse_release_name(os.path.basename(file_path))
+                log.info(f"Título extraído: '{release.title}' (Tipo: {"Série" if release.is_series else "Filme"}, Ano: {release.year or '-'})")
+                lookup_queue.put(PipelineItem(file_path, release, scan_progress.count))
+                scan_progress.count += 1
+        finally:
+            scan_progress.finished = True
+            lookup_queue.put(PIPELINE_DONE)
+
+    def apply(item):
+        nonlocal processed_count
+        if interrupted.is_set():
+            return
+        applied = apply_to_file(item, client, resolver, file_cache, poster_cache, subtitle_downloader, scheduler,
+                                journal)
+        if applied:
+            manifest.record(item.file_path, item.tmdb_id, 'tv' if item.release.is_series else 'movie')
+        with applied_lock:
+            processed_count += 1
+            if applied:
+                applied_paths.add(item.file_path)
+            summary = (f"{confirmed_progress.label(processed_count)} arquivos processados "
+                       f"({len(applied_paths)} com metadados aplicados)")
+        console.print(f"[info]Fase 2: {summary}.[/info]")
+
+    subtitle_downloader.start()
+    apply_threads = start_stage("aplicacao", apply, apply_queue, None, scheduler.workers)
+    if not resume:
+        threading.Thread(target=scan, name="varredura", daemon=True).start()
+        start_stage("busca", resolver.resolve, lookup_queue, confirm_queue, workers)
+
+    try:
+        if resume:
+            # Retomar apenas os arquivos pendentes no diário: já foram buscados e confirmados
+            root = os.path.join(os.path.abspath(movie_directory), '')
+            pending = [job for job in journal.pending() if job[0].startswith(root)]
+            if pending:
+                announce()
+            console.print(f"[info]Retomando {len(pending)} arquivos com processamento interrompido.[/info]")
+            confirmed_progress.count = len(pending)
+            confirmed_progress.finished = True
+            for file_path, stage, tmdb_id, payload in pending:
+                apply_queue.put(PipelineItem.from_journal(file_path, stage, tmdb_id, payload))
+            confirmed_count = len(pending)
+        else:
+            confirmed_count = confirm_matches(movie_directory, confirm_queue, apply_queue, stop, journal, assume_yes,
+                                              progress=scan_progress, confirmed_progress=confirmed_progress)
+            confirmed_progress.finished = True
+    except KeyboardInterrupt:
+        interrupted.set()
+        subtitle_downloader.cancel()
+        console.print("[warning]Interrompido: aguardando os arquivos em andamento; os demais ficam no diário para o --resume.[/warning]")
+        raise
+    finally:
+        stop.set()
+        apply_queue.put(PIPELINE_DONE)
+        for thread in apply_threads:
+            thread.join()
+        subtitle_count = subtitle_downloader.finish()
+
+    if unchanged_count:
+        log.info(f"{unchanged_count} arquivos já processados e inalterados foram pulados.")
+        console.print(f"[info]{unchanged_count} arquivos já processados e inalterados foram pulados.[/info]")
+    if not confirmed_count:
+        print("Nenhum arquivo de vídeo encontrado ou selecionado para processamento.")
+        return applied_paths
+    console.print(f"[success]Metadados aplicados em {len(applied_paths)} de {confirmed_count} arquivos.[/success]")
+    console.print(f"[success]{subtitle_count} legendas baixadas.[/success]")
+    return applied_paths
 
 
 if __name__ == "__main__":
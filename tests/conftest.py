@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os testes importam o script diretamente da raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
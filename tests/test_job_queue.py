@@ -0,0 +1,183 @@
+import os
+import threading
+
+import pytest
+
+import library_organizer as lo
+
+
+@pytest.fixture
+def library(tmp_path):
+    paths = []
+    for index in range(6):
+        path = tmp_path / 'biblioteca' / f'Filme.{index}.2020.mkv'
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b'video')
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = lo.SQLiteJobQueue(str(tmp_path / 'fila' / 'fila.sqlite3'))
+    yield job_queue
+    job_queue.close()
+
+
+def states(job_queue):
+    return job_queue.stats()[0]
+
+
+def finish_all(job_queue, worker='w1'):
+    jobs = job_queue.claim(worker, 100)
+    job_queue.complete(worker, [(job_id, path, None) for job_id, path, _ in jobs])
+    return jobs
+
+
+def test_claim_leases_each_job_once(job_queue, library):
+    assert job_queue.enqueue(lo.stat_video_files(library)) == len(library)
+
+    first = job_queue.claim('w1', 4)
+    second = job_queue.claim('w2', 4)
+
+    assert len(first) == 4 and len(second) == 2
+    assert {path for _, path, _ in first + second} == set(library)
+    assert job_queue.claim('w3', 4) == []
+    assert states(job_queue) == {'leased': len(library)}
+
+
+def test_expired_lease_is_reclaimed_and_the_old_result_ignored(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:1]))
+    (job_id, path, _), = job_queue.claim('morto', 1, lease_seconds=-1)
+
+    assert job_queue.claim('vivo', 1) == [(job_id, path, False)]
+    # O worker antigo perdeu a reserva: o resultado dele não vale mais
+    job_queue.complete('morto', [(job_id, path, "falhou")])
+    assert states(job_queue) == {'leased': 1}
+    job_queue.complete('vivo', [(job_id, path, None)])
+    assert states(job_queue) == {'done': 1}
+
+
+def test_job_fails_after_too_many_expired_leases(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:1]))
+    for attempt in range(lo.JOB_MAX_ATTEMPTS):
+        assert len(job_queue.claim(f'w{attempt}', 1, lease_seconds=-1)) == 1
+
+    assert job_queue.claim('outro', 1) == []
+    assert states(job_queue) == {'failed': 1}
+    assert not job_queue.has_open_jobs()
+
+
+def test_heartbeat_keeps_the_lease(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:2]))
+    job_queue.claim('w1', 2, lease_seconds=-1)
+
+    assert job_queue.heartbeat('w1') == 2
+    assert job_queue.claim('w2', 2) == []
+
+
+def test_release_returns_jobs_to_pending(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library))
+    job_queue.claim('w1', 3)
+
+    job_queue.release('w1')
+
+    assert states(job_queue) == {'pending': len(library)}
+    # A devolução não conta como tentativa
+    for attempt in range(lo.JOB_MAX_ATTEMPTS - 1):
+        job_queue.claim(f'w{attempt}', 100, lease_seconds=-1)
+    assert len(job_queue.claim('ultimo', 100)) == len(library)
+
+
+def test_complete_records_done_and_failed_jobs(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:2]))
+    (ok_id, ok_path, _), (bad_id, bad_path, _) = job_queue.claim('w1', 2)
+
+    job_queue.complete('w1', [(ok_id, ok_path, None), (bad_id, bad_path, "sem resultado")])
+
+    assert states(job_queue) == {'done': 1, 'failed': 1}
+    assert not job_queue.has_open_jobs()
+
+
+def test_finished_jobs_are_requeued_only_when_changed_failed_or_forced(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library))
+    jobs = job_queue.claim('w1', 100)
+    failed_path = jobs[0][1]
+    job_queue.complete('w1', [(job_id, path, "falhou" if path == failed_path else None)
+                              for job_id, path, _ in jobs])
+
+    changed_path = library[-1] if library[-1] != failed_path else library[0]
+    with open(changed_path, 'ab') as f:
+        f.write(b'mais dados')
+    assert job_queue.enqueue(lo.stat_video_files(library)) == 2
+    assert sorted(path for _, path, _ in finish_all(job_queue)) == sorted([failed_path, changed_path])
+
+    assert job_queue.enqueue(lo.stat_video_files(library)) == 0
+    assert job_queue.enqueue(lo.stat_video_files(library), force=True) == len(library)
+    forced = job_queue.claim('w1', 100)
+    assert len(forced) == len(library) and all(force for _, _, force in forced)
+
+
+def test_force_reaches_pending_jobs_and_is_cleared_on_completion(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:1]))
+    assert job_queue.enqueue(lo.stat_video_files(library[:1]), force=True) == 1
+    assert job_queue.enqueue(lo.stat_video_files(library[:1]), force=True) == 0
+
+    (_, _, force), = finish_all(job_queue)
+    assert force
+    job_queue.enqueue(lo.stat_video_files(library[:1]))
+    assert states(job_queue) == {'done': 1}
+
+
+def test_concurrent_claims_from_two_connections(tmp_path, library):
+    path = str(tmp_path / 'fila' / 'fila.sqlite3')
+    setup = lo.SQLiteJobQueue(path)
+    many = [(f'/biblioteca/Filme.{index}.mkv', os.stat(library[0])) for index in range(200)]
+    setup.enqueue(many)
+    setup.close()
+    claimed = {'a': [], 'b': []}
+
+    def worker(name):
+        # Cada worker tem a própria conexão, como se estivesse em outro host
+        job_queue = lo.SQLiteJobQueue(path)
+        while True:
+            jobs = job_queue.claim(name, 3)
+            if not jobs:
+                break
+            claimed[name].extend(job_path for _, job_path, _ in jobs)
+        job_queue.close()
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = claimed['a'] + claimed['b']
+    assert len(all_claimed) == len(set(all_claimed)) == len(many)
+
+
+def test_run_worker_reports_results_and_forced_batches(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library[:3]))
+    job_queue.enqueue(lo.stat_video_files(library[3:]), force=True)
+    os.remove(library[2])
+    calls = []
+
+    def process_files(paths, force):
+        calls.append((paths, force))
+        return {path: path != library[1] for path in paths if os.path.exists(path)}
+
+    assert lo.run_worker(job_queue, process_files, 'w1', lease_seconds=60) == 4
+    assert calls == [(library[:3], False), (library[3:], True)]
+    assert states(job_queue) == {'done': 4, 'failed': 2}
+
+
+def test_run_worker_releases_jobs_when_processing_fails(job_queue, library):
+    job_queue.enqueue(lo.stat_video_files(library))
+
+    def process_files(paths, force):
+        raise RuntimeError("worker caiu")
+
+    with pytest.raises(RuntimeError):
+        lo.run_worker(job_queue, process_files, 'w1', lease_seconds=60)
+    assert states(job_queue) == {'pending': len(library)}
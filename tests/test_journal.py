@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import library_organizer as lo
+
+
+def make_item(file_path):
+    item = lo.PipelineItem(file_path, lo.parse_release_name(os.path.basename(file_path)))
+    item.tmdb_id = 42
+    item.tmdb_title = "Filme"
+    item.release_date = '2020-01-01'
+    item.language = 'pt-BR'
+    return item
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = lo.JobJournal(str(tmp_path / 'cache'))
+    yield journal
+    journal.close()
+
+
+def test_failed_files_are_not_pending_and_leftovers_are_removed(tmp_path, journal):
+    video = tmp_path / 'Filme.2020.mp4'
+    video.write_bytes(b'original')
+    leftover = tmp_path / 'Filme.2020_processed.mp4'
+    leftover.write_bytes(b'incompleto')
+    journal.confirm(make_item(str(video)))
+    journal.mark(str(video), 'tagging')
+    journal.fail(str(video), 'RuntimeError: falhou')
+
+    assert journal.pending() == []
+    (_, stage, _, payload), = journal.pending(include_failed=True)
+    assert stage == 'failed'
+    assert payload['error'] == 'RuntimeError: falhou'
+    assert journal.recover() == 0
+    assert not leftover.exists()
+    assert video.read_bytes() == b'original'
+
+
+def test_fail_keeps_a_written_remux_for_recovery(tmp_path, journal):
+    video = tmp_path / 'Filme.2020.mkv'
+    video.write_bytes(b'original')
+    journal.confirm(make_item(str(video)))
+    journal.mark(str(video), 'remux_written')
+    journal.fail(str(video), 'OSError: falhou')
+
+    (_, stage, _, _), = journal.pending()
+    assert stage == 'remux_written'
+
+
+def test_recovered_remux_never_overwrites_an_existing_backup(tmp_path, journal):
+    video = tmp_path / 'Filme.2020.mkv'
+    video.write_bytes(b'primeira edicao')
+    backup = tmp_path / 'Filme.2020.mkv.bak'
+    backup.write_bytes(b'original')
+    (tmp_path / 'Filme.2020_processed.mkv').write_bytes(b'segunda edicao')
+    journal.confirm(make_item(str(video)))
+    journal.mark(str(video), 'remux_written')
+
+    assert journal.recover() == 1
+    assert video.read_bytes() == b'segunda edicao'
+    assert backup.read_bytes() == b'original'
+    (_, stage, _, _), = journal.pending()
+    assert stage == 'tagged'
+
+
+def test_remux_without_ffmpeg_fails_cleanly(tmp_path, monkeypatch):
+    video = tmp_path / 'Filme.2020.mkv'
+    video.write_bytes(b'original')
+    monkeypatch.setenv('PATH', str(tmp_path / 'vazio'))
+
+    assert lo.remux_with_ffmpeg(str(video), "Filme", '2020-01-01', None) is False
+    assert sorted(os.listdir(tmp_path)) == ['Filme.2020.mkv']
+
+
+def test_unexpected_error_marks_the_file_as_failed(tmp_path, journal, monkeypatch):
+    video = tmp_path / 'Filme.2020.mp4'
+    video.write_bytes(b'original')
+    item = make_item(str(video))
+    journal.confirm(item)
+
+    def broken_profile(file_path, file_cache):
+        raise RuntimeError("ffprobe quebrado")
+    monkeypatch.setattr(lo, 'get_media_profile', broken_profile)
+
+    with pytest.raises(RuntimeError):
+        lo.apply_to_file(item, None, None, None, None, None, None, journal)
+    (_, stage, _, payload), = journal.pending(include_failed=True)
+    assert stage == 'failed'
+    assert payload['error'] == 'RuntimeError: ffprobe quebrado'
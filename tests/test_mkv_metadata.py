@@ -0,0 +1,142 @@
+import os
+import stat
+
+import pytest
+
+import library_organizer as lo
+
+INFO_ID = 0x1549A966
+TAGS_ID = 0x1254C367
+VOID_ID = 0xEC
+
+
+def ebml(element_id, payload):
+    # Tamanho sempre com 8 bytes, como fazem vários muxers
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + b'\x01' + len(payload).to_bytes(7, 'big') + payload
+
+
+def seek_head(entries):
+    return ebml(lo.MKV_SEEKHEAD_ID, b''.join(
+        ebml(lo.MKV_SEEK_ID, ebml(lo.MKV_SEEK_ELEMENT_ID, element_id.to_bytes(4, 'big'))
+             + ebml(lo.MKV_SEEK_POSITION_ID, position.to_bytes(4, 'big')))
+        for element_id, position in entries))
+
+
+def write_mkv(path, tags_at_end=True):
+    """
+    Grava um MKV sintético: SeekHead, Info, EbmlVoid, dois Clusters e, opcionalmente, Tags no fim.
+    Retorna (arquivo, posição do primeiro Cluster, posição das Tags).
+    """
+    header = ebml(lo.MKV_EBML_ID, b'\x42\x82\x88matroska')
+    info = ebml(INFO_ID, b'\x7b\xa9\x85Nome!')
+    void = ebml(VOID_ID, b'\0' * 64)
+    clusters = ebml(lo.MKV_CLUSTER_ID, b'V' * 300) + ebml(lo.MKV_CLUSTER_ID, b'W' * 300)
+    tags = ebml(TAGS_ID, b'T' * 40) if tags_at_end else b''
+    # As posições do SeekHead são relativas ao início dos dados do Segment
+    seek_size = len(seek_head([(INFO_ID, 0), (TAGS_ID, 0)]))
+    info_position = seek_size
+    tags_position = seek_size + len(info) + len(void) + len(clusters)
+    entries = [(INFO_ID, info_position)] + ([(TAGS_ID, tags_position)] if tags_at_end else [(VOID_ID, 0)])
+    segment_data = seek_head(entries) + info + void + clusters + tags
+    segment = ebml(lo.MKV_SEGMENT_ID, segment_data)
+    with open(path, 'wb') as f:
+        f.write(header + segment)
+    segment_start = len(header) + len(segment) - len(segment_data)
+    return str(path), segment_start + seek_size + len(info) + len(void), segment_start + tags_position
+
+
+def test_edit_regions_cover_the_head_and_the_trailing_tags(tmp_path):
+    path, first_cluster, tags_offset = write_mkv(tmp_path / 'filme.mkv')
+    file_size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        regions = lo.mkv_edit_regions(f, file_size)
+
+    assert regions == [(0, first_cluster), (tags_offset, file_size - tags_offset)]
+
+
+def test_edit_regions_without_trailing_elements(tmp_path):
+    path, first_cluster, _ = write_mkv(tmp_path / 'filme.mkv', tags_at_end=False)
+
+    with open(path, 'rb') as f:
+        assert lo.mkv_edit_regions(f, os.path.getsize(path)) == [(0, first_cluster)]
+
+
+def test_edit_regions_reject_other_files(tmp_path):
+    path = tmp_path / 'filme.mkv'
+    path.write_bytes(b'\0' * 100)
+
+    with open(path, 'rb') as f, pytest.raises(ValueError):
+        lo.mkv_edit_regions(f, 100)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = lo.JobJournal(str(tmp_path / 'cache'))
+    yield journal
+    journal.close()
+
+
+def fake_mkvpropedit(tmp_path, monkeypatch, exit_code):
+    """
+    Instala um mkvpropedit falso que sobrescreve o início do arquivo e anexa dados ao fim.
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'mkvpropedit'
+    script.write_text('#!/bin/sh\n'
+                      'printf "EDITADO" | dd of="$1" bs=1 seek=0 conv=notrunc 2>/dev/null\n'
+                      'printf "ANEXO" >> "$1"\n'
+                      f'exit {exit_code}\n')
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_mkvpropedit_edits_the_original_file(tmp_path, journal, monkeypatch):
+    path, _, _ = write_mkv(tmp_path / 'filme.mkv')
+    inode_before = os.stat(path).st_ino
+    fake_mkvpropedit(tmp_path, monkeypatch, 0)
+
+    assert lo.apply_mkv_metadata(path, 'Título', '2020', None, journal=journal)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data.startswith(b'EDITADO') and data.endswith(b'ANEXO')
+    assert os.stat(path).st_ino == inode_before
+    assert sorted(os.listdir(tmp_path)) == ['bin', 'cache', 'filme.mkv']
+    assert not journal.restore_undo(path)
+
+
+def test_failed_mkvpropedit_is_undone(tmp_path, journal, monkeypatch):
+    path, _, _ = write_mkv(tmp_path / 'filme.mkv')
+    with open(path, 'rb') as f:
+        original = f.read()
+    fake_mkvpropedit(tmp_path, monkeypatch, 2)
+
+    assert not lo.apply_mkv_metadata(path, 'Título', '2020', None, journal=journal)
+
+    with open(path, 'rb') as f:
+        assert f.read() == original
+
+
+def test_interrupted_mkvpropedit_is_undone_by_recover(tmp_path, journal, monkeypatch):
+    path, _, tags_offset = write_mkv(tmp_path / 'filme.mkv')
+    with open(path, 'rb') as f:
+        original = f.read()
+    fake_mkvpropedit(tmp_path, monkeypatch, 0)
+
+    def interrupted(cmd):
+        with open(path, 'r+b') as f:
+            f.seek(tags_offset)
+            f.write(b'XXXX')
+            f.seek(0, os.SEEK_END)
+            f.write(b'novas tags')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(lo, 'run_mkvpropedit', interrupted)
+
+    with pytest.raises(KeyboardInterrupt):
+        lo.apply_mkv_metadata(path, 'Título', '2020', None, journal=journal)
+
+    journal.recover()
+    with open(path, 'rb') as f:
+        assert f.read() == original
@@ -0,0 +1,217 @@
+import os
+import struct
+
+import pytest
+
+import library_organizer as lo
+
+CHUNKS = (b'CHUNK-A' * 10, b'CHUNK-B' * 20, b'CHUNK-C' * 5)
+
+
+def build_moov(offsets, co64=False):
+    entry_format = '>Q' if co64 else '>I'
+    table = struct.pack('>II', 0, len(offsets)) + b''.join(struct.pack(entry_format, o) for o in offsets)
+    stbl = lo.mp4_box(b'stbl', lo.mp4_box(b'co64' if co64 else b'stco', table))
+    trak = lo.mp4_box(b'trak', lo.mp4_box(b'mdia', lo.mp4_box(b'minf', stbl)))
+    return lo.mp4_box(b'moov', lo.mp4_box(b'mvhd', b'\0' * 100) + trak)
+
+
+def write_mp4(path, moov_first=True, co64=False, free_after_moov=0):
+    """
+    Grava um MP4 sintético cujas tabelas stco/co64 apontam para os chunks de CHUNKS dentro do mdat.
+    """
+    ftyp = lo.mp4_box(b'ftyp', b'isom\0\0\0\0isom')
+    mdat = lo.mp4_box(b'mdat', b''.join(CHUNKS))
+    moov_size = len(build_moov([0] * len(CHUNKS), co64))
+    free = lo.mp4_free_box(free_after_moov) if free_after_moov else b''
+    data_start = len(ftyp) + 8 + (moov_size + len(free) if moov_first else 0)
+    offsets = []
+    for chunk in CHUNKS:
+        offsets.append(data_start)
+        data_start += len(chunk)
+    moov = build_moov(offsets, co64)
+    with open(path, 'wb') as f:
+        f.write(ftyp + (moov + free + mdat if moov_first else mdat + moov))
+    return str(path)
+
+
+def children(data, start, end):
+    return {box_type: (offset, size, header_len) for box_type, offset, size, header_len
+            in lo.iter_mp4_boxes(data, start, end)}
+
+
+def find_moov(data):
+    moovs = [(offset, size) for box_type, offset, size, _ in lo.iter_mp4_boxes(data, 0, len(data))
+             if box_type == b'moov']
+    assert len(moovs) == 1
+    offset, size = moovs[0]
+    return data[offset:offset + size]
+
+
+def chunk_offsets(box, start, end):
+    offsets = []
+    for box_type, offset, size, header_len in lo.iter_mp4_boxes(box, start, end):
+        if box_type in lo.MP4_CONTAINER_BOXES:
+            offsets += chunk_offsets(box, offset + header_len, offset + size)
+        elif box_type in (b'stco', b'co64'):
+            entry_format = '>I' if box_type == b'stco' else '>Q'
+            count = struct.unpack_from('>I', box, offset + header_len + 4)[0]
+            offsets += [struct.unpack_from(entry_format, box, offset + header_len + 8 + i * struct.calcsize(entry_format))[0]
+                        for i in range(count)]
+    return offsets
+
+
+def ilst_items(moov):
+    udta_offset, udta_size, udta_header = children(moov, 8, len(moov))[b'udta']
+    udta = moov[udta_offset:udta_offset + udta_size]
+    meta_offset, meta_size, _ = children(udta, udta_header, len(udta))[b'meta']
+    meta = udta[meta_offset:meta_offset + meta_size]
+    ilst_offset, ilst_size, _ = children(meta, 12, len(meta))[b'ilst']
+    ilst = meta[ilst_offset:ilst_offset + ilst_size]
+    # Valor de cada item: caixa 'data' (8 bytes de cabeçalho + tipo + localidade)
+    return {box_type: ilst[offset + 24:offset + size] for box_type, offset, size, _ in lo.iter_mp4_boxes(ilst, 8, len(ilst))}
+
+
+def assert_chunks_intact(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    moov = find_moov(data)
+    offsets = chunk_offsets(moov, 8, len(moov))
+    assert [data[offset:offset + len(chunk)] for offset, chunk in zip(offsets, CHUNKS)] == list(CHUNKS)
+    return data
+
+
+@pytest.mark.parametrize('co64', [False, True])
+def test_moov_first_growth_shifts_chunk_offsets(tmp_path, co64):
+    path = write_mp4(tmp_path / 'filme.mp4', co64=co64)
+    size_before = os.path.getsize(path)
+
+    assert lo.apply_mp4_metadata(path, 'Título', '2020-05-05', None)
+
+    data = assert_chunks_intact(path)
+    assert len(data) > size_before
+    items = ilst_items(find_moov(data))
+    assert items[b'\xa9nam'] == 'Título'.encode('utf-8')
+    assert items[b'\xa9day'] == b'2020-05-05'
+    # A folga reservada fica logo após o moov
+    top_level = [box_type for box_type, _, _, _ in lo.iter_mp4_boxes(data, 0, len(data))]
+    assert top_level == [b'ftyp', b'moov', b'free', b'mdat']
+
+
+def test_moov_first_fits_in_free_space(tmp_path):
+    path = write_mp4(tmp_path / 'filme.mp4', free_after_moov=8192)
+    size_before = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        moov = find_moov(f.read())
+    offsets_before = chunk_offsets(moov, 8, len(moov))
+
+    assert lo.apply_mp4_metadata(path, 'Título', None, None)
+
+    data = assert_chunks_intact(path)
+    assert len(data) == size_before
+    moov = find_moov(data)
+    assert chunk_offsets(moov, 8, len(moov)) == offsets_before
+
+
+def test_moov_last_is_rewritten_at_the_end(tmp_path):
+    path = write_mp4(tmp_path / 'filme.mp4', moov_first=False)
+
+    assert lo.apply_mp4_metadata(path, 'Título', '2021', None)
+
+    data = assert_chunks_intact(path)
+    top_level = [box_type for box_type, _, _, _ in lo.iter_mp4_boxes(data, 0, len(data))]
+    assert top_level == [b'ftyp', b'mdat', b'moov', b'free']
+    assert ilst_items(find_moov(data))[b'\xa9day'] == b'2021'
+
+
+def test_second_edit_keeps_cover_and_fits_in_padding(tmp_path):
+    path = write_mp4(tmp_path / 'filme.mp4')
+    cover_path = tmp_path / 'capa.jpg'
+    cover_path.write_bytes(b'\xff\xd8' + b'I' * 500)
+    assert lo.apply_mp4_metadata(path, 'Primeiro', None, str(cover_path))
+    size_after_first = os.path.getsize(path)
+
+    assert lo.apply_mp4_metadata(path, 'Segundo', None, None)
+
+    data = assert_chunks_intact(path)
+    assert len(data) == size_after_first
+    items = ilst_items(find_moov(data))
+    assert items[b'\xa9nam'] == b'Segundo'
+    assert items[b'covr'] == cover_path.read_bytes()
+
+
+def test_edit_in_place_keeps_inode_and_hardlinks(tmp_path):
+    path = write_mp4(tmp_path / 'filme.mp4', free_after_moov=8192)
+    os.link(path, tmp_path / 'link.mp4')
+    inode_before = os.stat(path).st_ino
+
+    assert lo.apply_mp4_metadata(path, 'Título', None, None)
+
+    assert os.stat(path).st_ino == inode_before
+    with open(tmp_path / 'link.mp4', 'rb') as f:
+        assert ilst_items(find_moov(f.read()))[b'\xa9nam'] == 'Título'.encode('utf-8')
+    assert sorted(os.listdir(tmp_path)) == ['filme.mp4', 'link.mp4']
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = lo.JobJournal(str(tmp_path / 'cache'))
+    yield journal
+    journal.close()
+
+
+def fail_first_fsync(monkeypatch, error):
+    real_fsync = os.fsync
+    calls = []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise error
+        real_fsync(fd)
+    monkeypatch.setattr(lo.os, 'fsync', fsync)
+
+
+@pytest.mark.parametrize('moov_first', [True, False])
+def test_interrupted_edit_is_undone_by_recover(tmp_path, journal, monkeypatch, moov_first):
+    path = write_mp4(tmp_path / 'filme.mp4', moov_first=moov_first, free_after_moov=8192 if moov_first else 0)
+    with open(path, 'rb') as f:
+        original = f.read()
+    fail_first_fsync(monkeypatch, KeyboardInterrupt())
+
+    with pytest.raises(KeyboardInterrupt):
+        lo.apply_mp4_metadata(path, 'Título', None, None, journal=journal)
+    with open(path, 'rb') as f:
+        assert f.read() != original
+
+    journal.recover()
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    assert not journal.restore_undo(path)
+
+
+def test_failed_write_is_undone_immediately(tmp_path, journal, monkeypatch):
+    path = write_mp4(tmp_path / 'filme.mp4', moov_first=False)
+    with open(path, 'rb') as f:
+        original = f.read()
+    fail_first_fsync(monkeypatch, OSError(28, "No space left on device"))
+
+    assert not lo.apply_mp4_metadata(path, 'Título', None, None, journal=journal)
+
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    assert not journal.restore_undo(path)
+
+
+def test_growing_moov_first_rewrites_a_copy_and_keeps_permissions(tmp_path):
+    path = write_mp4(tmp_path / 'filme.mp4')
+    os.chmod(path, 0o640)
+    inode_before = os.stat(path).st_ino
+
+    assert lo.apply_mp4_metadata(path, 'Título', None, None)
+
+    st = os.stat(path)
+    assert st.st_mode & 0o777 == 0o640
+    # Regravado numa cópia que substitui o original, sem deixar a saída intermediária
+    assert st.st_ino != inode_before
+    assert os.listdir(tmp_path) == ['filme.mp4']
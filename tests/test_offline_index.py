@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import library_organizer as lo
+
+MOVIES = [
+    {'id': 1, 'original_title': 'Amélie: O Fabuloso Destino', 'popularity': 30.0, 'adult': False, 'video': False},
+    {'id': 2, 'original_title': 'Dune', 'popularity': 80.0, 'adult': False, 'video': False},
+    {'id': 3, 'original_title': 'Dune', 'popularity': 15.0, 'adult': False, 'video': False},
+    {'id': 4, 'original_title': 'Dune', 'popularity': 40.0, 'adult': False, 'video': False},
+    {'id': 5, 'original_title': 'Dune', 'popularity': 1.0, 'adult': False, 'video': False},
+    {'id': 6, 'original_title': 'Filme Adulto', 'popularity': 99.0, 'adult': True, 'video': False},
+    {'id': 7, 'original_title': 'Making Of', 'popularity': 5.0, 'adult': False, 'video': True},
+]
+SERIES = [
+    {'id': 100, 'original_name': 'Dune', 'popularity': 10.0},
+    {'id': 101, 'original_name': 'The Office', 'popularity': 50.0},
+]
+# Anos de lançamento dos itens, usados pelos detalhes falsos do TMDb
+RELEASE_DATES = {2: '2021-09-15', 3: '1984-12-14', 4: '2000-12-03', 5: '2024-02-28'}
+
+
+def write_dump(path, items, compress=True):
+    lines = ''.join(json.dumps(item) + '\n' for item in items) + 'linha inválida\n'
+    if compress:
+        with gzip.open(path, 'wt', encoding='utf-8') as dump:
+            dump.write(lines)
+    else:
+        path.write_text(lines, encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    return [write_dump(tmp_path / 'movie_ids_05_15_2025.json.gz', MOVIES),
+            write_dump(tmp_path / 'tv_series_ids_05_15_2025.json.gz', SERIES)]
+
+
+@pytest.fixture
+def index(tmp_path, dumps):
+    index_path = str(tmp_path / 'cache' / lo.OFFLINE_INDEX_NAME)
+    lo.OfflineTitleIndex.build(dumps, index_path)
+    offline_index = lo.OfflineTitleIndex(index_path)
+    yield offline_index
+    offline_index.close()
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def details(self, item_id, is_series, language):
+        self.calls.append(item_id)
+        return SimpleNamespace(id=item_id, title=f"Item {item_id}", release_date=RELEASE_DATES.get(item_id, ''))
+
+
+def test_build_skips_adult_video_and_invalid_lines(tmp_path, dumps):
+    index_path = str(tmp_path / lo.OFFLINE_INDEX_NAME)
+
+    assert lo.OfflineTitleIndex.build(dumps, index_path) == 7
+
+    offline_index = lo.OfflineTitleIndex(index_path)
+    try:
+        assert offline_index.count == 7
+        assert offline_index.lookup('Filme Adulto', False) == []
+        assert offline_index.lookup('Making Of', False) == []
+    finally:
+        offline_index.close()
+
+
+def test_build_accepts_uncompressed_dump(tmp_path):
+    dump = write_dump(tmp_path / 'movie_ids.json', MOVIES, compress=False)
+    index_path = str(tmp_path / lo.OFFLINE_INDEX_NAME)
+
+    assert lo.OfflineTitleIndex.build([dump], index_path) == 5
+
+
+def test_exact_lookup_orders_by_popularity_and_separates_types(index):
+    assert index.lookup('Dune', False) == [2, 4, 3]
+    assert index.lookup('Dune', False, limit=10) == [2, 4, 3, 5]
+    assert index.lookup('Dune', True) == [100]
+    assert index.lookup('The Office', True) == [101]
+    assert index.lookup('The Office', False) == []
+    assert index.lookup('Duna', False) == []
+
+
+def test_lookup_normalizes_accents_case_and_punctuation(index):
+    assert index.lookup('amelie o fabuloso destino', False) == [1]
+    assert index.lookup('AMÉLIE - O Fabuloso Destino!', False) == [1]
+    assert index.lookup('the.office', True) == [101]
+
+
+def test_year_picks_matching_candidate_within_one_year(index):
+    client = FakeClient()
+
+    selected = lo.lookup_in_offline_index(client, index, 'Dune', False, year=2001)
+
+    assert selected.id == 4
+    assert client.calls == [2, 4]
+
+
+def test_without_year_the_most_popular_wins(index):
+    client = FakeClient()
+
+    assert lo.lookup_in_offline_index(client, index, 'Dune', False).id == 2
+    assert client.calls == [2]
+
+
+def test_year_without_matching_candidate_returns_none(index):
+    # O candidato de 2024 está fora dos OFFLINE_INDEX_CANDIDATES mais populares
+    assert lo.lookup_in_offline_index(FakeClient(), index, 'Dune', False, year=2024) is None
+
+
+def test_rebuild_only_when_dump_changes(tmp_path, dumps):
+    index_path = str(tmp_path / 'cache' / lo.OFFLINE_INDEX_NAME)
+
+    assert lo.OfflineTitleIndex.build_if_changed(dumps, index_path) == 7
+    assert lo.OfflineTitleIndex.build_if_changed(dumps, index_path) is None
+
+    # Nova exportação no mesmo caminho
+    write_dump(tmp_path / 'tv_series_ids_05_15_2025.json.gz', SERIES + [{'id': 102, 'original_name': 'Nova Série'}])
+    st = os.stat(dumps[1])
+    os.utime(dumps[1], ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert lo.OfflineTitleIndex.build_if_changed(dumps, index_path) == 8
+
+    # Outro conjunto de exportações
+    assert lo.OfflineTitleIndex.build_if_changed(dumps[:1], index_path) == 5
+
+
+def test_rebuild_when_index_file_is_missing(tmp_path, dumps):
+    index_path = str(tmp_path / 'cache' / lo.OFFLINE_INDEX_NAME)
+    lo.OfflineTitleIndex.build_if_changed(dumps, index_path)
+    os.remove(index_path)
+
+    assert lo.OfflineTitleIndex.build_if_changed(dumps, index_path) == 7
+
+
+def test_offline_poster_cache_never_downloads(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("download no modo offline")
+
+    monkeypatch.setattr(lo, 'download_image', fail)
+    poster_cache = lo.PosterCache(str(tmp_path), offline=True)
+    cached_key = lo.hashlib.sha1(f"{poster_cache.size}/cached.jpg".encode('utf-8')).hexdigest()
+    cached_path = os.path.join(poster_cache.dir, cached_key + '.jpg')
+    with open(cached_path, 'wb') as cover:
+        cover.write(b'\xff\xd8')
+
+    assert poster_cache.get('/cached.jpg') == cached_path
+    assert poster_cache.get('/missing.jpg') is None
+    assert (poster_cache.hits, poster_cache.misses) == (1, 1)
+    poster_cache.close()
@@ -0,0 +1,118 @@
+import queue
+import threading
+
+import library_organizer as lo
+
+
+class FakeJournal:
+    def __init__(self):
+        self.confirmed = []
+
+    def confirm(self, item):
+        self.confirmed.append(item.file_path)
+
+
+def make_item(sequence, found=True):
+    name = f"/biblioteca/Filme.{sequence}.2020.mkv"
+    item = lo.PipelineItem(name, lo.parse_release_name(name.rsplit('/', 1)[1]), sequence)
+    if found:
+        item.tmdb_id = 100 + sequence
+        item.tmdb_title = f"Filme {sequence}"
+    item.language = 'pt-BR'
+    return item
+
+
+def run_confirmation(arrival_order, missing=(), confirmed_progress=None):
+    inbox = queue.Queue()
+    outbox = queue.Queue()
+    for sequence in arrival_order:
+        inbox.put(make_item(sequence, found=sequence not in missing))
+    inbox.put(lo.PIPELINE_DONE)
+    progress = lo.ScanProgress()
+    progress.count = len(arrival_order)
+    progress.finished = True
+    journal = FakeJournal()
+    confirmed = lo.confirm_matches('/biblioteca', inbox, outbox, threading.Event(), journal,
+                                   assume_yes=True, progress=progress, confirmed_progress=confirmed_progress)
+    return confirmed, [outbox.get_nowait().sequence for _ in range(outbox.qsize())]
+
+
+def test_results_are_confirmed_in_scan_order():
+    confirmed, order = run_confirmation([3, 0, 4, 1, 2])
+
+    assert confirmed == 5
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_unmatched_files_keep_their_place_without_blocking_the_rest():
+    confirmed, order = run_confirmation([2, 1, 0, 3], missing={1})
+
+    assert confirmed == 3
+    assert order == [0, 2, 3]
+
+
+def test_confirmed_files_are_counted_for_the_apply_progress():
+    confirmed_progress = lo.ScanProgress()
+
+    run_confirmation([1, 0, 2], missing={2}, confirmed_progress=confirmed_progress)
+
+    assert confirmed_progress.count == 2
+
+
+def test_scan_progress_label():
+    progress = lo.ScanProgress()
+    progress.count = 40
+
+    assert progress.label(12) == '12/40+'
+    progress.finished = True
+    assert progress.label(12) == '12/40'
+
+
+def test_resolve_error_still_forwards_the_item():
+    class BrokenClient:
+        def search(self, *args):
+            raise RuntimeError("falha simulada")
+
+    item = make_item(0, found=False)
+
+    assert lo.TitleResolver(BrokenClient()).resolve(item) is item
+    assert item.tmdb_id is None
+
+
+def test_cancelled_subtitle_searches_are_dropped(tmp_path, monkeypatch):
+    file_cache = lo.FileInfoCache(str(tmp_path / 'cache'))
+    journal = lo.JobJournal(str(tmp_path / 'cache'))
+    downloader = lo.SubtitleDownloader(file_cache, workers=1, journal=journal)
+    started = threading.Event()
+    release = threading.Event()
+    searched = []
+
+    def download(file_path, *args):
+        searched.append(file_path)
+        started.set()
+        release.wait()
+        return True
+    monkeypatch.setattr(downloader, '_download', download)
+
+    paths = []
+    for index in range(3):
+        path = tmp_path / f'Filme.{index}.mkv'
+        path.write_bytes(b'video')
+        item = lo.PipelineItem(str(path), lo.parse_release_name(path.name))
+        item.tmdb_id = index
+        journal.confirm(item)
+        paths.append(str(path))
+    downloader.start()
+    for path in paths:
+        assert downloader.add(path, "Filme", 2020)
+    started.wait()
+    downloader.cancel()
+    release.set()
+
+    assert downloader.finish() == 1
+    assert searched == paths[:1]
+    # Os arquivos descartados continuam no diário para o --resume
+    assert [job[0] for job in journal.pending()] == paths[1:]
+    downloader.close()
+    journal.close()
+    file_cache.close()
@@ -0,0 +1,61 @@
+import os
+
+import library_organizer as lo
+
+
+def fake_download(monkeypatch, size=1024):
+    downloads = []
+
+    def download_image(image_url, save_path, session=None):
+        downloads.append(image_url)
+        with open(save_path, 'wb') as cover:
+            cover.write(b'\xff' * size)
+        # mtimes crescentes: a ordem LRU não depende da resolução do relógio do sistema de arquivos
+        os.utime(save_path, (len(downloads), len(downloads)))
+        return True
+    monkeypatch.setattr(lo, 'download_image', download_image)
+    return downloads
+
+
+def poster_cache(tmp_path, max_files):
+    cache = lo.PosterCache(str(tmp_path))
+    cache.session = object()   # Sem requests: os downloads são falsos
+    cache.max_bytes = max_files * 1024
+    return cache
+
+
+def test_size_cap_is_enforced_while_the_cache_stays_open(tmp_path, monkeypatch):
+    fake_download(monkeypatch)
+    cache = poster_cache(tmp_path, max_files=3)
+
+    paths = [cache.get(f"/capa{index}.jpg") for index in range(cache.EVICTION_INTERVAL)]
+
+    # Sem chamar close(), como no modo de observação e no worker
+    assert sorted(os.listdir(cache.dir)) == sorted(os.path.basename(path) for path in paths[-3:])
+
+
+def test_eviction_keeps_the_cover_being_returned_and_partial_downloads(tmp_path, monkeypatch):
+    fake_download(monkeypatch)
+    cache = poster_cache(tmp_path, max_files=0)
+    partial = os.path.join(cache.dir, 'baixando.jpg.part')
+    with open(partial, 'wb') as cover:
+        cover.write(b'\xff' * 4096)
+    cache.EVICTION_INTERVAL = 1
+
+    path = cache.get('/capa.jpg')
+
+    assert os.path.exists(path) and os.path.exists(partial)
+    cache.evict()
+    assert os.listdir(cache.dir) == ['baixando.jpg.part']
+
+
+def test_hits_do_not_trigger_eviction(tmp_path, monkeypatch):
+    downloads = fake_download(monkeypatch)
+    cache = poster_cache(tmp_path, max_files=0)
+    cache.EVICTION_INTERVAL = 2
+    path = cache.get('/capa.jpg')
+
+    for _ in range(5):
+        assert cache.get('/capa.jpg') == path
+
+    assert len(downloads) == 1 and os.path.exists(path)
@@ -0,0 +1,73 @@
+import pytest
+
+import library_organizer as lo
+
+
+def fields(release):
+    return (release.title, release.year, release.season, release.episodes,
+            release.resolution, release.source, release.group)
+
+
+@pytest.mark.parametrize('filename, expected', [
+    # Números com cara de ano no título: o ano é o último antes do primeiro marcador
+    ("Blade.Runner.2049.2017.1080p.BluRay.x264-GRP.mkv",
+     ("Blade Runner 2049", 2017, None, (), '1080p', 'BluRay', 'GRP')),
+    ("2001.A.Space.Odyssey.1968.mkv", ("2001 A Space Odyssey", 1968, None, (), None, None, None)),
+    # A primeira palavra é sempre parte do título
+    ("1917.2019.2160p.mkv", ("1917", 2019, None, (), '2160p', None, None)),
+    ("Movie.2019.Extended.Cut.1080p.mkv", ("Movie", 2019, None, (), '1080p', None, None)),
+])
+def test_year_in_title(filename, expected):
+    assert fields(lo.parse_release_name(filename)) == expected
+
+
+@pytest.mark.parametrize('filename, season, episodes', [
+    ("The.Office.S02E03E04.720p.mkv", 2, (3, 4)),
+    ("Show.S01E01-E03.WEB-DL.mkv", 1, (1, 2, 3)),
+    ("Show.s1e5.mkv", 1, (5,)),
+    ("Show.1x05.HDTV.mkv", 1, (5,)),
+])
+def test_episodes(filename, season, episodes):
+    release = lo.parse_release_name(filename)
+
+    assert release.title in ("The Office", "Show")
+    assert release.is_series
+    assert (release.season, release.episodes) == (season, episodes)
+    assert release.episode == episodes[0]
+
+
+def test_cross_marker_keeps_the_source():
+    assert fields(lo.parse_release_name("Show.1x05.HDTV.mkv")) == ("Show", None, 1, (5,), None, 'HDTV', None)
+
+
+@pytest.mark.parametrize('filename, source, group', [
+    ("The.Mandalorian.S02E05.1080p.WEB.H264-FLX.mkv", 'WEB', 'FLX'),
+    ("Show.S01E01.WEB-DL-GRP.mkv", 'WEB-DL', 'GRP'),
+    ("Movie.2017-GRP.mkv", None, 'GRP'),
+    ("Ironheart.S01E01.1080p.WEB-DL.DUAL.5.1.mkv", 'WEB-DL', None),
+    # Hífen no título não é grupo
+    ("Spider-Man.No.Way.Home.2021.2160p.mkv", None, None),
+])
+def test_group_suffix(filename, source, group):
+    release = lo.parse_release_name(filename)
+
+    assert (release.source, release.group) == (source, group)
+
+
+def test_brackets_and_underscores():
+    assert fields(lo.parse_release_name("[GRP] Movie_Name (2019) [1080p].mp4")) == \
+        ("GRP Movie Name", 2019, None, (), '1080p', None, None)
+
+
+def test_names_without_markers():
+    assert fields(lo.parse_release_name("Filme.mkv")) == ("Filme", None, None, (), None, None, None)
+    assert fields(lo.parse_release_name("Um.Filme.Qualquer")) == ("Um Filme Qualquer", None, None, (), None, None, None)
+
+
+def test_parse_many_keeps_order_and_memoizes():
+    names = ["A.2001.mkv", "B.S01E02.mkv", "A.2001.mkv"]
+
+    releases = lo.parse_many(names)
+
+    assert [release.title for release in releases] == ["A", "B", "A"]
+    assert releases[0] is releases[2]
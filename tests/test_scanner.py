@@ -0,0 +1,21 @@
+import library_organizer as lo
+
+
+def test_scan_skips_formats_that_cannot_be_tagged(tmp_path):
+    season = tmp_path / 'Série' / 'Temporada 1'
+    season.mkdir(parents=True)
+    for name in ('Show.S01E01.mkv', 'Show.S01E02.AVI', 'Show.S01E03.mov', 'Show.S01E04_processed.mkv',
+                 '.Show.S01E05.mkv', 'notas.txt'):
+        (season / name).write_bytes(b'video')
+    (tmp_path / 'Filme.2020.MP4').write_bytes(b'video')
+
+    scanned = [path for path, _ in lo.scan_video_files(str(tmp_path))]
+
+    assert scanned == [str(tmp_path / 'Filme.2020.MP4'), str(season / 'Show.S01E01.mkv')]
+
+
+def test_watcher_ignores_formats_that_cannot_be_tagged():
+    assert lo.is_watched_video('/biblioteca/Filme.2020.mkv')
+    assert not lo.is_watched_video('/biblioteca/Filme.2020.avi')
+    assert not lo.is_watched_video('/biblioteca/Filme.2020.mov')
+    assert not lo.is_watched_video('/biblioteca/Filme.2020_processed.mp4')
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import library_organizer as lo
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lo.time, 'time', clock)
+    return clock
+
+
+def open_cache(tmp_path, **options):
+    return lo.TMDbCache(str(tmp_path), **options)
+
+
+def test_positive_and_negative_entries_expire_separately(tmp_path, clock):
+    cache = open_cache(tmp_path, ttl_days=30, negative_ttl_days=7)
+    cache.set('filme', {'id': 1})
+    cache.set('nada', [])
+
+    clock.now += 8 * 86400
+    assert cache.get('filme') == (True, {'id': 1})
+    assert cache.get('nada') == (False, None)
+    clock.now += 30 * 86400
+    assert cache.get('filme') == (False, None)
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+
+def test_offline_mode_uses_expired_entries(tmp_path, clock):
+    cache = open_cache(tmp_path, ttl_days=1)
+    cache.set('filme', {'id': 1})
+    cache.close()
+    clock.now += 10 * 86400
+
+    cache = open_cache(tmp_path, ttl_days=1, offline=True)
+    assert cache.get('filme') == (True, {'id': 1})
+    cache.close()
+
+
+def test_refresh_ignores_the_cache(tmp_path, clock):
+    cache = open_cache(tmp_path)
+    cache.set('filme', {'id': 1})
+    cache.refresh = True
+
+    assert cache.get('filme') == (False, None)
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = open_cache(tmp_path, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, {'key': key})
+        clock.now += 1
+    assert cache.get('a')[0]
+    cache.close()
+
+    cache = open_cache(tmp_path, max_entries=2)
+    assert [cache.get(key)[0] for key in ('a', 'b', 'c')] == [True, False, True]
+    cache.close()
+
+
+def test_keys_use_the_normalized_title():
+    assert (lo.TMDbCache.make_key('search', 'movie', 'pt-BR', 'O  Poderoso   Chefão')
+            == lo.TMDbCache.make_key('search', 'movie', 'pt-BR', 'o poderoso chefão'))
+
+
+def test_rate_limiter_allows_a_burst_then_spaces_requests():
+    limiter = lo.RateLimiter(rate=20, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(2):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_does_not_refill_during_a_pause():
+    limiter = lo.RateLimiter(rate=20)
+    limiter.pause(0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    # Depois da pausa, os tokens voltam no ritmo normal (um a cada 50 ms), sem rajada
+    assert time.monotonic() - start >= 0.29
@@ -0,0 +1,45 @@
+import os
+import random
+import struct
+
+import pytest
+
+import library_organizer as lo
+
+
+def reference_hash(path):
+    # Implementação de referência da documentação do OpenSubtitles (lê os trechos com read)
+    size = os.path.getsize(path)
+    total = size
+    with open(path, 'rb') as f:
+        for offset in (0, size - 65536):
+            f.seek(offset)
+            total += sum(struct.unpack('<8192Q', f.read(65536)))
+    return f"{total & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+@pytest.mark.parametrize('size', [131072, 300001, 5 * 1024 * 1024 + 13])
+def test_hash_matches_the_reference(tmp_path, size):
+    path = tmp_path / 'filme.mkv'
+    path.write_bytes(random.Random(size).randbytes(size))
+
+    assert lo.compute_opensubtitles_hash(str(path)) == reference_hash(str(path))
+
+
+def test_small_files_have_no_hash(tmp_path):
+    path = tmp_path / 'filme.mkv'
+    path.write_bytes(b'\0' * 131071)
+
+    assert lo.compute_opensubtitles_hash(str(path)) is None
+
+
+def test_cached_hash_keeps_the_size_it_was_computed_for(tmp_path):
+    path = tmp_path / 'filme.mkv'
+    path.write_bytes(random.Random(1).randbytes(200000))
+    file_cache = lo.FileInfoCache(str(tmp_path / 'cache'))
+
+    video_hash, size = lo.get_video_hash(str(path), file_cache)
+    assert (video_hash, size) == (reference_hash(str(path)), 200000)
+    assert lo.get_video_hash(str(path), file_cache) == (video_hash, 200000)
+    assert file_cache.hits == 1
+    file_cache.close()